@@ -0,0 +1,286 @@
+# benchmark.py
+# End-to-end throughput benchmark for translate -> sentiment -> score, run
+# against the local fake Gemini backend (model_backend.FakeGeminiBackend) on
+# synthetic review datasets, so no API key or network is needed.
+# Reports, per stage: reviews/sec, the unique reviews (dedup groups) actually
+# resolved and their rate, p50/p95/p99 call latency, median time to the first
+# streamed item, retries (429s, 5xx and malformed replies) and peak RSS. Each
+# dataset size runs in a fresh process so the RSS figures don't bleed into each other.
+# Synthetic reviews are random word draws, so only the DUPLICATE_RATE repeats
+# fall under the dedup threshold.
+# Results can be appended to a JSONL baseline and compared with the previous
+# run of the same configuration.
+#
+# Usage:
+#   python benchmark.py --sizes 1000 10000
+#   python benchmark.py --sizes 100000 --latency 0.05 --rate-limit-rate 0.02 --malformed-rate 0.01 --save benchmarks.jsonl
+#   python benchmark.py --sizes 5000 --keys 4 --key-rpm 120     # throughput vs number of pooled keys
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# -------------------------- CONFIG --------------------------
+SIZES = [1_000]
+STAGES = ["translate", "sentiment", "score"]
+CHUNK_ROWS = 5_000
+CONCURRENCY = 16                 # Batches in flight per stage
+REQUESTS_PER_MINUTE = 1_000_000  # Effectively unlimited; the fake backend's latency is the bottleneck
+TOKENS_PER_MINUTE = 1_000_000_000
+BACKOFF = 0.1                    # Seconds per attempt for retries without a hint (Gemini default: 5)
+DUPLICATE_RATE = 0.1             # Share of synthetic reviews that repeat an earlier one
+NON_ENGLISH_RATE = 0.3           # Share of synthetic reviews in Hindi
+SEED = 42
+
+ENGLISH_PHRASES = [
+    "Loved the story and characters", "Plot was confusing and slow", "It was okay, not too bad",
+    "Beautiful writing and a moving ending", "The print quality is poor", "Arrived late and the cover was torn",
+    "A must read for every fan of the genre", "Too long, I could not finish it", "Great value for the price",
+    "The translation felt flat", "Couldn't put it down", "Boring in the middle but the ending saves it",
+]
+HINDI_PHRASES = [
+    "कहानी बहुत अच्छी है", "किताब की छपाई खराब है", "पात्र यादगार हैं", "अंत बहुत भावुक था",
+    "कीमत के हिसाब से ठीक है", "बहुत धीमी कहानी", "हर किसी को पढ़नी चाहिए",
+]
+ENGLISH_WORDS = sorted({w.strip(",.'").lower() for p in ENGLISH_PHRASES for w in p.split()} | set(
+    "author chapter pages hero villain romance mystery history gift paperback hardcover delivery edition "
+    "language emotional funny dark simple deep classic modern village city family friendship war love".split()))
+HINDI_WORDS = sorted({w for p in HINDI_PHRASES for w in p.split()} | set(
+    "लेखक अध्याय पन्ने नायक प्रेम इतिहास उपहार भाषा परिवार दोस्ती गांव शहर सरल गहरा".split()))
+WORDS_PER_REVIEW = (8, 24)       # Random words appended to the phrases, so reviews don't near-duplicate
+BOOKS = ["White Nights", "The Alchemist", "Godaan", "Wings of Fire", "The Guide", "Gitanjali"]
+
+
+# -------------------------- SYNTHETIC DATA --------------------------
+def synthetic_chunks(n, chunk_rows=CHUNK_ROWS, seed=SEED):
+    """Yield DataFrames shaped like the scraped review store, `n` rows in total."""
+    rng = random.Random(seed)
+    history = []
+    for start in range(0, n, chunk_rows):
+        rows = []
+        for i in range(start, min(n, start + chunk_rows)):
+            if history and rng.random() < DUPLICATE_RATE:
+                text = rng.choice(history)
+            else:
+                hindi = rng.random() < NON_ENGLISH_RATE
+                phrases, words = (HINDI_PHRASES, HINDI_WORDS) if hindi else (ENGLISH_PHRASES, ENGLISH_WORDS)
+                text = (". ".join(rng.sample(phrases, rng.randint(1, 2))) + ". "
+                        + " ".join(rng.choice(words) for _ in range(rng.randint(*WORDS_PER_REVIEW))))
+                if len(history) < 10_000:
+                    history.append(text)
+            book = rng.randrange(len(BOOKS))
+            rows.append({
+                "book_title": BOOKS[book],
+                "product": f"B0BENCH{book:03d}",
+                "review_id": f"R{i:09d}",
+                "review_text": text,
+                "review_date": f"Reviewed in India on {rng.randint(1, 28)} March 2024",
+                "rating": float(rng.randint(1, 5)),
+            })
+        yield pd.DataFrame(rows)
+
+
+# -------------------------- MEASUREMENT --------------------------
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None if it can't be measured)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def _percentiles(latencies):
+    if not latencies:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"p50": round(float(p50), 4), "p95": round(float(p95), 4), "p99": round(float(p99), 4)}
+
+
+# -------------------------- RUN --------------------------
+def _configure(stage, backend, config):
+    stage.model = backend
+    stage.CONCURRENCY = config["concurrency"]
+    stage.REQUESTS_PER_MINUTE = REQUESTS_PER_MINUTE
+    stage.TOKENS_PER_MINUTE = TOKENS_PER_MINUTE
+
+
+def run_size(n, config):
+    """Run the selected stages over `n` synthetic reviews; returns the per-stage metrics."""
+    os.environ["MODEL_BACKEND"] = "fake"     # stages must not need a key at import
+    os.environ["PIPELINE_METRICS_FILE"] = os.environ["PIPELINE_PROMETHEUS_FILE"] = ""   # no metric files
+    import gemini_executor
+    import score_and_reason
+    import sentiment
+    import translated_review
+    from checkpoint import Journal
+    from dedup import Deduplicator
+    from language_filter import PrefilterStats
+    from local_sentiment import LocalSentimentModel
+    from metrics import METRICS
+    from client_pool import ClientPool
+    from model_backend import FakeGeminiBackend
+    from response_cache import ResponseCache
+
+    gemini_executor.BASE_BACKOFF = config["backoff"]
+    stages = {"translate": translated_review, "sentiment": sentiment, "score": score_and_reason}
+    fakes = {}
+    for name in config["stages"]:
+        fakes[name] = []
+
+        def fake(key=None, model=None, name=name):
+            fakes[name].append(FakeGeminiBackend(config["latency"], config["jitter"], config["error_rate"],
+                                                 config["rate_limit_rate"], config["malformed_rate"],
+                                                 config["retry_after"], seed=config["seed"] + len(fakes[name])))
+            return fakes[name][-1]
+        if config["keys"] > 1 or config["key_rpm"]:
+            # One pooled fake per key, each with its own per-minute budget
+            keys = [(f"key{i + 1}", f"{name}-{i + 1}") for i in range(config["keys"])]
+            backend = ClientPool(keys, [(f"fake-{name}", config["key_rpm"] or REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE)],
+                                 fake, tier=name)
+        else:
+            backend = fake()
+        _configure(stages[name], backend, config)
+
+    seconds = {name: 0.0 for name in config["stages"]}
+    local_model = LocalSentimentModel.load()
+    quiet = contextlib.redirect_stdout(open(os.devnull, "w", encoding="utf-8")) if not config["verbose"] \
+        else contextlib.nullcontext()
+    with tempfile.TemporaryDirectory() as tmp, quiet:
+        # Fresh cache and journals: every review really goes through the (fake) API
+        cache = ResponseCache(os.path.join(tmp, "cache.sqlite"))
+        journals = {name: Journal(os.path.join(tmp, f"{name}.journal.jsonl")) for name in config["stages"]}
+        dedup = {name: Deduplicator(stages[name].DEDUP_THRESHOLD) for name in config["stages"]}
+        stats = PrefilterStats(translated_review.plan_batches)
+        rng = random.Random(config["seed"])
+        offset = 0
+        try:
+            for chunk in synthetic_chunks(n, config["chunk_rows"], config["seed"]):
+                df = chunk
+                if "translate" in seconds:
+                    start = time.perf_counter()
+                    df = translated_review.translate_chunk(df, cache, journals["translate"], stats,
+                                                           dedup["translate"], offset)
+                    seconds["translate"] += time.perf_counter() - start
+                elif "reviews_translated" not in df.columns:
+                    df["reviews_translated"] = "no change"
+                if "sentiment" in seconds:
+                    start = time.perf_counter()
+                    df = sentiment.analyze_chunk(df, cache, journals["sentiment"], dedup["sentiment"],
+                                                 local_model, offset)
+                    seconds["sentiment"] += time.perf_counter() - start
+                elif "Sentiment" not in df.columns:
+                    df["Sentiment"] = [rng.choice(["Positive", "Neutral", "Negative"]) for _ in range(len(df))]
+                if "score" in seconds:
+                    start = time.perf_counter()
+                    score_and_reason.score_chunk(df, cache, journals["score"], dedup["score"], offset)
+                    seconds["score"] += time.perf_counter() - start
+                offset += len(chunk)
+        finally:
+            cache.close()
+            for journal in journals.values():
+                journal.close()
+
+    results = {}
+    for name in config["stages"]:
+        fake = {k: sum(f.stats()[k] for f in fakes[name]) for k in ("calls", "errors", "rate_limited", "malformed")}
+        unique = dedup[name].resolved         # groups actually resolved (journal/cache/API)
+        results[name] = {
+            "reviews_per_sec": round(n / seconds[name], 1) if seconds[name] else None,
+            "unique": unique,
+            "unique_per_sec": round(unique / seconds[name], 1) if seconds[name] else None,
+            "seconds": round(seconds[name], 3),
+            "calls": fake["calls"],
+            "retries": fake["errors"] + fake["rate_limited"] + fake["malformed"],
+            **fake,
+            **_percentiles(METRICS.values("request_seconds", stage=name)),
+            "first_item_p50": _percentiles(METRICS.values("first_item_seconds", stage=name))["p50"],
+        }
+    return {"size": n, "stages": results, "peak_rss_mb": peak_rss_mb()}
+
+
+# -------------------------- REPORT --------------------------
+def _previous(path, record):
+    """Most recent saved run with the same size and knobs, if any."""
+    if not path or not os.path.exists(path):
+        return None
+    match = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                old = json.loads(line)
+                if old["size"] == record["size"] and old["config"] == record["config"]:
+                    match = old
+    return match
+
+
+def report(record, previous=None):
+    rss = record["peak_rss_mb"]
+    print(f"\n📊 {record['size']:,} reviews — peak RSS {f'{rss:.0f} MB' if rss is not None else 'n/a'}")
+    print(f"   {'stage':<10}{'rev/s':>10}{'unique':>8}{'uniq/s':>9}{'calls':>8}{'retries':>9}"
+          f"{'p50':>9}{'p95':>9}{'p99':>9}{'1st item':>10}")
+    for name, m in record["stages"].items():
+        line = (f"   {name:<10}{m['reviews_per_sec'] or 0:>10.1f}{m.get('unique', 0):>8}"
+                f"{m.get('unique_per_sec') or 0:>9.1f}{m['calls']:>8}{m['retries']:>9}"
+                f"{m['p50'] or 0:>8.3f}s{m['p95'] or 0:>8.3f}s{m['p99'] or 0:>8.3f}s"
+                f"{m.get('first_item_p50') or 0:>9.3f}s")
+        old = previous and previous["stages"].get(name)
+        if old and old.get("reviews_per_sec") and m["reviews_per_sec"]:
+            change = m["reviews_per_sec"] / old["reviews_per_sec"] - 1
+            line += f"   ({change:+.1%} vs baseline)"
+        print(line)
+
+
+# -------------------------- MAIN --------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Gemini stages against a local fake backend.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="synthetic dataset sizes (rows)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.25)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls failing with a 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of calls failing with a 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share of truncated/short replies")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="retry hint in the fake 429s")
+    parser.add_argument("--backoff", type=float, default=BACKOFF)
+    parser.add_argument("--keys", type=int, default=1, help="fake API keys behind a client_pool.ClientPool")
+    parser.add_argument("--key-rpm", type=float, help="requests per minute per pooled key (pools even one key)")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--save", metavar="JSONL", help="append results to this baseline file")
+    parser.add_argument("--verbose", action="store_true", help="show the stages' own progress output")
+    args = parser.parse_args()
+
+    config = {key: value for key, value in vars(args).items() if key not in ("sizes", "save")}
+    for n in args.sizes:
+        print(f"⏱️ Benchmarking {', '.join(args.stages)} on {n:,} synthetic reviews...")
+        with ProcessPoolExecutor(max_workers=1) as pool:   # fresh process per size for a clean peak RSS
+            result = pool.submit(run_size, n, config).result()
+        record = {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                  "config": {k: v for k, v in config.items() if k != "verbose"}, **result}
+        report(record, _previous(args.save, record))
+        if args.save:
+            with open(args.save, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+    if args.save:
+        print(f"\n💾 Appended results to '{args.save}'")
+
+
+if __name__ == "__main__":
+    main()
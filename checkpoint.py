@@ -0,0 +1,113 @@
+# checkpoint.py
+# Crash-safe checkpoint/resume journal shared by the Gemini stages.
+# Every finished batch is appended (and fsync'ed) to a JSONL journal next to
+# the stage's output file, recording each row's key and its output. The key is
+# a digest of what the row sends to the model (row_key), not its position, so a
+# resume against a re-scraped, appended or reordered input never hands one
+# review's result to another.
+# Restarting with --resume skips rows that already completed and re-queues
+# rows whose output was an error placeholder.
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+
+# -------------------------- CONFIG --------------------------
+ERROR_MARKERS = {"Error during processing", "error", "Unknown"}
+
+
+def journal_path(output_file):
+    """The journal that belongs to a stage's output file."""
+    return output_file + ".journal.jsonl"
+
+
+def row_key(text):
+    """Journal key of a row: a digest of the prompt text it sends to the model."""
+    return hashlib.blake2b(str(text).encode("utf-8"), digest_size=12).hexdigest()
+
+
+def is_complete(value):
+    """False for missing results and for the stages' error placeholders."""
+    if value is None:
+        return False
+    if isinstance(value, dict):
+        return not any(v in ERROR_MARKERS for v in value.values() if isinstance(v, str))
+    return value not in ERROR_MARKERS
+
+
+def arg_parser(description):
+    """Argument parser with the --resume flag shared by the three LLM stages."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted run from its journal instead of starting over")
+    return parser
+
+
+# -------------------------- JOURNAL --------------------------
+class Journal:
+    """Append-only journal of {row key: output}, written per batch and per streamed item."""
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done = {}
+        if resume and os.path.exists(path):
+            self._load()
+            print(f"⏯️ Resuming from '{path}': {len(self.done)} rows already complete")
+        elif os.path.exists(path):
+            os.remove(path)
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # torn final line from a crash mid-write
+                for row_id, value in zip(entry["ids"], entry["out"]):
+                    if is_complete(value):
+                        self.done[row_id] = value
+                    else:
+                        self.done.pop(row_id, None)
+
+    def record(self, row_ids, outputs, sync=True):
+        """
+        Append results for `row_ids`. A finished batch is fsync'ed (`sync`);
+        items streamed in before their batch finishes are only flushed, and the
+        batch's final record supersedes them. Safe to call from worker threads.
+        """
+        entry = {"t": round(time.time(), 3), "ids": list(row_ids), "out": list(outputs)}
+        with self.lock:
+            self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.file.flush()
+            if sync:
+                os.fsync(self.file.fileno())
+            for row_id, value in zip(row_ids, outputs):
+                if is_complete(value):
+                    self.done[row_id] = value
+                else:
+                    self.done.pop(row_id, None)
+
+    def close(self):
+        self.file.close()
+
+
+def resume_rows(journal, row_ids, resolve):
+    """
+    One result per row: completed rows come from the journal, the rest from
+    `resolve(positions)`, which must return one result per position, in order.
+    """
+    todo = [i for i, row_id in enumerate(row_ids) if row_id not in journal.done]
+    skipped = len(row_ids) - len(todo)
+    if skipped:
+        print(f"⏭️ Skipping {skipped} rows completed in a previous run")
+
+    fresh = resolve(todo) if todo else []
+    results = [journal.done.get(row_id) for row_id in row_ids]
+    for i, value in zip(todo, fresh):
+        results[i] = value
+    return results
@@ -0,0 +1,221 @@
+# client_pool.py
+# Multi-key, multi-model Gemini client pool.
+# Every (API key, model) pair is a slot with its own requests-per-minute and
+# tokens-per-minute budget, error history and cooldown. Each call goes to the
+# slot with the most headroom; a 429 benches that key for the server's retry
+# hint, repeated 5xx bench it for COOLDOWN_SECONDS, and a rejected key (401/403)
+# is dropped, while the call itself fails over to the next usable slot. The
+# stages pick a model tier: cheap translation/labelling calls and the heavier
+# score-with-reason calls use different models, so each has its own quota.
+# Aggregate throughput grows with the number of keys: the executor's limits
+# become the sum of the slot budgets (see executor_limits).
+#
+# Keys: GEMINI_API_KEYS="key1,key2,..." (falls back to GEMINI_API_KEY).
+
+import os
+import threading
+import time
+from collections import deque
+
+from gemini_executor import estimate_tokens, is_retryable, retry_delay, status_code
+from metrics import METRICS
+
+# -------------------------- CONFIG --------------------------
+# Per tier, in failover order: (model, requests per minute, tokens per minute) for EACH key
+MODEL_TIERS = {
+    "light": [("gemini-flash-lite-latest", 15, 250_000)],     # translate, sentiment
+    "heavy": [("gemini-flash-latest", 10, 250_000)],          # score with reason, fused
+}
+QUOTA_SHARE = 1.0                # Share of each key's quota this process may use (scheduler.py lowers it)
+COOLDOWN_SECONDS = 30            # Bench time after repeated server errors (a 429 uses its retry hint)
+ERROR_WINDOW = 20                # Recent calls per slot used for its error rate
+MAX_ERROR_RATE = 0.5             # A slot whose recent error rate exceeds this is benched
+MIN_ERROR_SAMPLES = 4            # ...once it has at least this many recent calls
+FAILOVER_ATTEMPTS = 3            # Slots tried within one call before the error goes back to the executor
+REJECTED_STATUS = {401, 403}     # Key rejected: never use the slot again this run
+
+
+def api_keys():
+    """[(name, key)] from GEMINI_API_KEYS, or GEMINI_API_KEY alone. Names are used in logs instead of keys."""
+    keys = [k.strip() for k in os.getenv("GEMINI_API_KEYS", "").split(",") if k.strip()]
+    if not keys and os.getenv("GEMINI_API_KEY"):
+        keys = [os.getenv("GEMINI_API_KEY")]
+    return [(f"key{i + 1}", key) for i, key in enumerate(keys)]
+
+
+class _Budget:
+    """Per-minute budget refilled continuously (thread-safe under the pool lock)."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+    def wait(self, amount, now):
+        """Seconds until `amount` units are available."""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+
+class _Slot:
+    def __init__(self, name, model, rpm, tpm, backend):
+        self.name = name
+        self.model = model
+        self.backend = backend
+        self.requests = _Budget(rpm * QUOTA_SHARE)
+        self.tokens = _Budget(tpm * QUOTA_SHARE)
+        self.cooldown_until = 0.0
+        self.disabled = False
+        self.recent = deque(maxlen=ERROR_WINDOW)
+        self.calls = self.errors = self.throttled = 0
+
+    def wait(self, tokens, now):
+        if self.disabled:
+            return float("inf")
+        return max(self.cooldown_until - now, self.requests.wait(1, now), self.tokens.wait(tokens, now))
+
+    def error_rate(self):
+        return self.recent.count(False) / len(self.recent) if self.recent else 0.0
+
+
+# Slots are shared by every pool in the process, so two tiers that list the
+# same key and model draw on one budget.
+_SLOTS = {}
+_LOCK = threading.Lock()
+
+
+class ClientPool:
+    """generate_content() over every key × model of one tier, with quota-aware routing and failover."""
+
+    def __init__(self, keys, models, factory, tier="default"):
+        """`keys` [(name, key)], `models` [(model, rpm, tpm)], `factory(key, model)` -> backend."""
+        self.tier = tier
+        self.keys = len(keys)
+        self.slots = []
+        with _LOCK:
+            for model, rpm, tpm in models:
+                for name, key in keys:
+                    if (key, model) not in _SLOTS:
+                        _SLOTS[key, model] = _Slot(name, model, rpm, tpm, factory(key, model))
+                    self.slots.append(_SLOTS[key, model])
+        if not self.slots:
+            raise ValueError("❌ ClientPool needs at least one key and one model")
+        # Budget of the tier's primary model across all keys (failover models are spill-over)
+        primary = [s for s in self.slots if s.model == models[0][0]]
+        self.requests_per_minute = sum(s.requests.capacity for s in primary)
+        self.tokens_per_minute = sum(s.tokens.capacity for s in primary)
+
+    def _acquire(self, tokens, exclude):
+        """Block until a usable slot not in `exclude` has budget; take one request from it."""
+        while True:
+            with _LOCK:
+                now = time.monotonic()
+                usable = [s for s in self.slots if s not in exclude and not s.disabled]
+                if not usable:
+                    return None
+                # Ready slots first, then the tier's order (primary model), then the most request headroom
+                slot = min(usable, key=lambda s: (s.wait(tokens, now) > 0, self.slots.index(s) // self.keys,
+                                                  s.wait(tokens, now), -s.requests.level))
+                delay = slot.wait(tokens, now)
+                if delay <= 0:
+                    slot.requests.take(1)
+                    slot.tokens.take(tokens)
+                    slot.calls += 1
+                    return slot
+            METRICS.observe("key_wait_seconds", delay, tier=self.tier)
+            time.sleep(min(delay, 1.0))
+
+    def _succeeded(self, slot):
+        with _LOCK:
+            slot.recent.append(True)
+        METRICS.inc("key_calls_total", key=slot.name, model=slot.model, outcome="ok")
+
+    def _failed(self, slot, error):
+        code = status_code(error)
+        with _LOCK:
+            slot.errors += 1
+            slot.recent.append(False)
+            now = time.monotonic()
+            if code in REJECTED_STATUS:
+                slot.disabled = True
+                outcome = "rejected"
+                print(f"🚫 {slot.name}/{slot.model} rejected ({code}); no longer used")
+            elif code == 429:
+                slot.throttled += 1
+                slot.cooldown_until = max(slot.cooldown_until, now + retry_delay(error, 1))
+                outcome = "throttled"
+            else:
+                outcome = "error"
+                if len(slot.recent) >= MIN_ERROR_SAMPLES and slot.error_rate() > MAX_ERROR_RATE:
+                    slot.cooldown_until = now + COOLDOWN_SECONDS
+                    slot.recent.clear()
+                    print(f"🧊 {slot.name}/{slot.model} benched for {COOLDOWN_SECONDS}s after repeated errors")
+        METRICS.inc("key_calls_total", key=slot.name, model=slot.model, outcome=outcome)
+
+    def generate_content(self, prompt, **kwargs):
+        """Send `prompt` through the best slot, failing over to others on throttling and server errors."""
+        tokens = estimate_tokens(prompt) + estimate_tokens(kwargs.get("system_instruction") or "")
+        tried = set()
+        error = None
+        for _ in range(FAILOVER_ATTEMPTS):
+            slot = self._acquire(tokens, tried)
+            if slot is None:
+                break
+            try:
+                response = slot.backend.generate_content(prompt, **kwargs)
+            except Exception as e:
+                self._failed(slot, e)
+                tried.add(slot)
+                error = e
+                if not is_retryable(e) and status_code(e) not in REJECTED_STATUS:
+                    raise
+                continue
+            self._succeeded(slot)
+            return _Tracked(response, self, slot) if kwargs.get("stream") else response
+        if error is None:
+            raise RuntimeError(f"❌ No usable API key left for the '{self.tier}' tier")
+        raise error
+
+    def stats(self):
+        """Per-slot counters for reports."""
+        with _LOCK:
+            return [{"key": s.name, "model": s.model, "calls": s.calls, "errors": s.errors,
+                     "throttled": s.throttled, "error_rate": round(s.error_rate(), 3), "disabled": s.disabled}
+                    for s in self.slots]
+
+
+class _Tracked:
+    """A streamed response whose mid-stream errors are charged to the slot that served it."""
+
+    def __init__(self, response, pool, slot):
+        self._response = response
+        self._pool = pool
+        self._slot = slot
+
+    def __iter__(self):
+        try:
+            yield from self._response
+        except Exception as e:
+            self._pool._failed(self._slot, e)
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+def executor_limits(backend, concurrency, requests_per_minute, tokens_per_minute):
+    """
+    run_batches limits for a stage: with a pool the per-key budgets add up and
+    each key gets `concurrency` batches in flight; otherwise the stage's own.
+    """
+    if isinstance(backend, ClientPool):
+        return {"concurrency": concurrency * backend.keys,
+                "requests_per_minute": backend.requests_per_minute,
+                "tokens_per_minute": backend.tokens_per_minute}
+    return {"concurrency": concurrency, "requests_per_minute": requests_per_minute,
+            "tokens_per_minute": tokens_per_minute}
@@ -0,0 +1,140 @@
+# dedup.py
+# Review deduplication and fan-out for the Gemini stages.
+# Reviews are normalized (case, whitespace, punctuation, emoji) and grouped
+# with their exact and near-duplicates (MinHash over character shingles with
+# LSH banding). Only one representative per group is sent to Gemini; its
+# result is fanned back to every member row, and the group ID (the row ID of
+# the group's first review) is kept in the `dup_group` column for auditing.
+# The index and the remembered results are LRU-bounded (MAX_GROUPS), so memory
+# stays flat on million-row runs. The trade-off is recall: a review whose group
+# was evicted (not matched in the last MAX_GROUPS groups) starts a new group
+# and is resolved again, usually as a response-cache hit.
+
+import hashlib
+import re
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+# -------------------------- CONFIG --------------------------
+DEDUP_THRESHOLD = 0.85           # Estimated Jaccard similarity to count as a near-duplicate
+NUM_PERM = 64                    # MinHash signature length
+BANDS = 16                       # LSH bands (NUM_PERM / BANDS rows per band)
+SHINGLE_SIZE = 5                 # Characters per shingle
+MAX_GROUPS = 200_000             # Groups (and results) kept; the least recently matched are evicted
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize_review(text):
+    """Lowercase, drop punctuation/emoji/symbols and collapse whitespace."""
+    text = unicodedata.normalize("NFKC", "" if text is None else str(text)).lower()
+    return _NON_WORD.sub(" ", text).strip()
+
+
+class Deduplicator:
+    """
+    Incremental exact + near-duplicate grouping. The index is kept across
+    chunks, so a review matches groups seen earlier in the same run, and
+    `results` remembers each group's answer for fan-out; both hold at most
+    `max_groups` groups, least recently matched evicted first.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=NUM_PERM, bands=BANDS, shingle_size=SHINGLE_SIZE,
+                 max_groups=MAX_GROUPS):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_groups = max_groups
+        rng = np.random.default_rng(1)
+        self.a = rng.integers(1, _MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, _MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.exact = {}               # digest of normalized text -> group ID
+        self.buckets = {}             # (band, band signature) -> {group IDs}
+        self.signatures = {}          # group ID -> MinHash signature
+        self.groups = OrderedDict()   # group ID -> its exact digests, least recently matched first
+        self.results = OrderedDict()  # group ID -> resolved result, least recently used first
+        self.resolved = 0             # groups sent to `resolve` so far (evictions don't lower it)
+
+    def _signature(self, norm):
+        k = self.shingle_size
+        shingles = {norm[i:i + k] for i in range(len(norm) - k + 1)}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64)
+        return ((np.outer(hashes, self.a) + self.b) % _MERSENNE_PRIME).min(axis=0)
+
+    def _band_keys(self, signature):
+        r = self.rows_per_band
+        return [(band, signature[band * r:(band + 1) * r].tobytes()) for band in range(self.bands)]
+
+    def _evict(self):
+        """Forget the least recently matched groups beyond max_groups."""
+        while len(self.groups) > self.max_groups:
+            group, digests = self.groups.popitem(last=False)
+            for digest in digests:
+                if self.exact.get(digest) == group:
+                    del self.exact[digest]
+            signature = self.signatures.pop(group, None)
+            if signature is not None:
+                for key in self._band_keys(signature):
+                    members = self.buckets.get(key)
+                    if members is not None:
+                        members.discard(group)
+                        if not members:
+                            del self.buckets[key]
+
+    def assign(self, texts, row_ids):
+        """Return the group ID for each text, registering new groups as it goes."""
+        groups = []
+        for text, row_id in zip(texts, row_ids):
+            norm = normalize_review(text)
+            digest = hashlib.blake2b(norm.encode("utf-8"), digest_size=12).digest()
+            group = self.exact.get(digest)
+            if group is None and len(norm) >= 2 * self.shingle_size:
+                signature = self._signature(norm)
+                keys = self._band_keys(signature)
+                candidates = {g for key in keys for g in self.buckets.get(key, ())}
+                best = max(candidates, default=None,
+                           key=lambda g: np.mean(self.signatures[g] == signature))
+                if best is not None and np.mean(self.signatures[best] == signature) >= self.threshold:
+                    group = best
+                else:
+                    group = row_id
+                    self.signatures[group] = signature
+                    for key in keys:
+                        self.buckets.setdefault(key, set()).add(group)
+            if group is None:
+                group = row_id
+            if digest not in self.exact:
+                self.exact[digest] = group
+                self.groups.setdefault(group, []).append(digest)
+            self.groups.move_to_end(group)
+            groups.append(group)
+            self._evict()
+        return groups
+
+    def resolve(self, groups, resolve):
+        """
+        One result per position in `groups`. Only the first position of each
+        group not resolved earlier is passed to `resolve(positions)`; every
+        member then receives its group's result.
+        """
+        reps = {}
+        for pos, group in enumerate(groups):
+            if group not in self.results and group not in reps:
+                reps[group] = pos
+        if groups:
+            print(f"👥 Dedup: {len(groups)} reviews -> {len(reps)} unique to resolve")
+        fresh = resolve(list(reps.values())) if reps else []
+        self.resolved += len(reps)
+        for group, value in zip(reps, fresh):
+            self.results[group] = value
+        values = [self.results[group] for group in groups]
+        for group in dict.fromkeys(groups):
+            self.results.move_to_end(group)
+        while len(self.results) > self.max_groups:
+            self.results.popitem(last=False)
+        return values
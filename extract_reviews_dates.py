@@ -1,6 +1,7 @@
 # amazon_reviews_scraper_fixed.py
 from playwright.sync_api import sync_playwright
-import time
+
+from scrape_helpers import EXTRACT_REVIEWS_JS, PageTimer, block_resources
 
 def scrape_book_reviews():
     url = "https://www.amazon.in/s?k=novels&i=stripbooks&crid=AD02FPL0UXRQ&sprefix=novels%2Cstripbooks%2C392&ref=nb_sb_noss_2"
@@ -8,12 +9,16 @@ def scrape_book_reviews():
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=False)
         context = browser.new_context()
+        block_resources(context)  # no images, fonts, media or trackers
         page = context.new_page()
+        timer = PageTimer()
 
         print("Opening Amazon novels page...")
-        page.goto(url, timeout=60000)
+        clock = timer.page()
+        page.goto(url, timeout=60000, wait_until="domcontentloaded")
+        clock.lap("navigate")
         page.wait_for_selector("div.s-main-slot")
-        time.sleep(3)
+        clock.lap("wait")
 
         # Step 1: Click on the specific book link
         print("Clicking the 'White Nights – Fyodor Dostoyevsky' link...")
@@ -35,9 +40,13 @@ def scrape_book_reviews():
             new_page = page
 
         # Step 3: Wait for product page to load
+        clock = timer.page()
         new_page.wait_for_load_state("domcontentloaded")
+        clock.lap("navigate")
         new_page.wait_for_selector("#productTitle", timeout=30000)
-        title = new_page.query_selector("#productTitle").inner_text().strip()
+        clock.lap("wait")
+        title = new_page.inner_text("#productTitle").strip()
+        clock.lap("extract")
         print(f"\n📖 Book Title: {title}")
 
         # Step 4: Scroll to and click Customer Reviews section
@@ -46,43 +55,37 @@ def scrape_book_reviews():
             new_page.wait_for_selector("h2#averageCustomerReviewsAnchor", timeout=15000)
             heading = new_page.query_selector("h2#averageCustomerReviewsAnchor")
             heading.scroll_into_view_if_needed()
-            time.sleep(2)
             heading.click()
-            time.sleep(3)
         except:
             print("⚠️ Customer reviews heading not found.")
             browser.close()
             return
 
-        # Step 5: Wait for reviews
+        # Step 5: Wait for reviews (event-driven: returns as soon as they are in the DOM)
         print("Collecting reviews...")
         try:
             new_page.wait_for_selector("div[id^='customer_review']", timeout=30000)
+            clock.lap("wait")
         except:
             print("⚠️ No customer reviews loaded.")
             browser.close()
             return
 
-        # Step 6: Extract review id, date, and text
+        # Step 6: Extract review id, date, and text (all reviews in one page.evaluate round trip)
         print("\n--- Customer Reviews ---\n")
-        review_divs = new_page.query_selector_all("div[id^='customer_review']")
+        reviews = new_page.evaluate(EXTRACT_REVIEWS_JS)["reviews"]
+        clock.lap("extract")
 
-        if not review_divs:
+        if not reviews:
             print("No reviews found for this book.")
         else:
-            for review in review_divs:
-                review_id = review.get_attribute("id")
-                text_el = review.query_selector("[data-hook='review-body']")
-                date_el = review.query_selector("[data-hook='review-date']")
-
-                review_text = text_el.inner_text().strip().replace("\n", " ") if text_el else "No review text"
-                review_date = date_el.inner_text().strip() if date_el else "No date found"
-
-                print(f"🆔 Review ID: {review_id}")
-                print(f"📅 Date: {review_date}")
-                print(f"💬 Review: {review_text}")
+            for review in reviews:
+                print(f"🆔 Review ID: {review['review_id']}")
+                print(f"📅 Date: {review['review_date']}")
+                print(f"💬 Review: {review['review_text']}")
                 print("-" * 90)
 
+        timer.report()
         browser.close()
 
 if __name__ == "__main__":
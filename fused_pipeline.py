@@ -0,0 +1,229 @@
+# fused_pipeline.py
+# Optional single-call mode: translates, classifies and scores each review in
+# ONE Gemini request per batch, instead of three trips through
+# translated_review.py -> sentiment.py -> score_and_reason.py.
+# Writes the same columns as reviews_scored_reasoned11.xlsx.
+#
+# Usage:
+#   python fused_pipeline.py
+#   python fused_pipeline.py --compare reviews_scored_reasoned11.parquet
+
+import argparse
+
+from client_pool import executor_limits
+from gemini_executor import MalformedResponse, estimate_tokens, pack_batches, run_batches
+from json_stream import response_config, stream_by_id, tag
+from metrics import METRICS
+from model_backend import MissingAPIKey, get_backend
+from prompt_compaction import normalize, record
+from response_cache import ResponseCache, prompt_version, run_cached
+from review_store import ChunkWriter, MissingColumns, export_excel, read_all, read_chunks, require_columns
+
+# -------------------------- CONFIG --------------------------
+INPUT_FILE = "amazon_book_reviews.parquet"       # Raw scraped reviews (review_scraper.py)
+OUTPUT_FILE = "reviews_fused11.parquet"          # Same columns as reviews_scored_reasoned11
+EXCEL_EXPORT = None                              # e.g. "reviews_fused11.xlsx" for a final Excel copy
+CHUNK_ROWS = 5_000                               # Rows read/written per chunk
+MODEL_NAME = "gemini-flash-latest"               # Primary model of MODEL_TIER (also the cache namespace)
+MODEL_TIER = "heavy"                             # client_pool.MODEL_TIERS entry: keys, models and quotas
+MAX_BATCH_ITEMS = 30                             # Upper bound on reviews per request
+INPUT_TOKEN_BUDGET = 3_000                       # Estimated review tokens per request
+OUTPUT_TOKEN_BUDGET = 6_000                      # Estimated reply tokens per request
+OUTPUT_TOKENS_PER_ITEM = 40                      # labels, score and reason, plus the translation
+CONCURRENCY = 4
+REQUESTS_PER_MINUTE = 15
+TOKENS_PER_MINUTE = 1_000_000
+MAX_RETRIES = 2
+DEDUP_THRESHOLD = 0.85
+ROLLUP_FILE = "sentiment_rollup_fused.sqlite"    # Trend rollups merged per chunk (None to skip); not the staged
+                                                 # pipeline's file, whose review keys would swallow these rows
+
+OUTPUT_COLUMNS = ["book_title", "product", "review_id", "review_text", "reviews_translated", "review_date",
+                  "rating", "dup_group", "Sentiment", "sentiment_source", "Sentiment_Score", "Reason"]   # staged order
+ERROR_RESULT = {"translation": "error", "sentiment": "Unknown", "score": None, "reason": "Error during processing"}
+RESPONSE_CONFIG = response_config(translation="STRING", sentiment="STRING", score="INTEGER", reason="STRING")
+SYSTEM_INSTRUCTION = (                           # Sent once per request instead of a preamble in every prompt
+    "You are a review analysis assistant. Each review starts with its ID in brackets. Return one object "
+    'per review, echoing its ID, with: translation, exactly "no change" if the review is already in '
+    "English, otherwise its English translation; sentiment, Positive, Neutral, or Negative; score, "
+    "from -10 to +10 (Positive +4 to +10, Neutral -3 to +3, Negative -10 to -4); reason, a short, "
+    "clear reason for the score."
+)
+
+# -------------------------- API SETUP --------------------------
+# Created on first use: Gemini unless MODEL_BACKEND=fake (see model_backend.py); None without GEMINI_API_KEY
+model = None
+
+
+def client():
+    """The stage's model, shared with every other stage using MODEL_NAME in this process."""
+    global model
+    if model is None:
+        model = get_backend(MODEL_NAME, tier=MODEL_TIER)
+    return model
+
+
+# -------------------------- PROMPT BUILDER --------------------------
+def build_prompt(batch_reviews):
+    """Build one prompt of (normalized) reviews; SYSTEM_INSTRUCTION asks for the four fields per review."""
+    return "Reviews:\n" + "\n".join(tag(i, r) for i, r in enumerate(batch_reviews))
+
+# -------------------------- PARSER --------------------------
+def parse_item(item):
+    """One streamed {"id", "translation", "sentiment", "score", "reason"} object, without its ID."""
+    if not {"translation", "sentiment", "score"} <= item.keys():
+        raise MalformedResponse(f"❌ Incomplete review object {item!r}")
+    return {key: item.get(key) for key in ("translation", "sentiment", "score", "reason")}
+
+# -------------------------- GEMINI CALL --------------------------
+def fused_batch(batch_reviews):
+    """Send a batch to Gemini and get translation, sentiment, score and reason per review."""
+    response = client().generate_content(build_prompt(batch_reviews), stream=True,
+                                         system_instruction=SYSTEM_INSTRUCTION, generation_config=RESPONSE_CONFIG)
+    return stream_by_id(response, "fused", len(batch_reviews), parse_item)
+
+
+def failed_batch(batch_reviews):
+    """Placeholder results for a batch that exhausted its retries."""
+    return [dict(ERROR_RESULT) for _ in batch_reviews]
+
+# -------------------------- COMPARISON --------------------------
+def compare(fused_file, staged_file):
+    """
+    Print label agreement and score drift between fused output and the
+    three-stage output. Rows are matched on (product,) review_id, or on row
+    number when either file has no review_id.
+    """
+    import pandas as pd
+    fused_df, staged_df = read_all(fused_file), read_all(staged_file)
+    keys = [col for col in ("product", "review_id") if col in fused_df.columns and col in staged_df.columns]
+    if "review_id" not in keys:
+        keys = ["row_id"]
+        fused_df, staged_df = (df.assign(row_id=range(len(df))) for df in (fused_df, staged_df))
+        print("⚠️ No review_id in both files; matching rows by position")
+    columns = keys + ["Sentiment", "Sentiment_Score"]
+    merged = fused_df[columns].drop_duplicates(keys).merge(
+        staged_df[columns].drop_duplicates(keys), on=keys, suffixes=("_fused", "_staged"))
+    n = len(merged)
+    agree = (merged["Sentiment_fused"] == merged["Sentiment_staged"]).mean() if n else 0.0
+    drift = (pd.to_numeric(merged["Sentiment_Score_fused"], errors="coerce")
+             - pd.to_numeric(merged["Sentiment_Score_staged"], errors="coerce"))
+    print(f"\n📊 Fused vs staged on {n} matched reviews "
+          f"({len(fused_df) - n} fused-only, {len(staged_df) - n} staged-only):")
+    print(f"   Sentiment agreement: {agree:.1%}")
+    print(f"   Mean |score difference|: {drift.abs().mean():.2f}")
+
+# -------------------------- CHUNK PROCESSING --------------------------
+def fused_chunk(df, cache, dedup, offset=0):
+    """Translate, classify and score one chunk of reviews."""
+    import pandas as pd
+    df.rename(columns={"Book_Title": "book_title", "Review_Date": "review_date"}, inplace=True)
+    df["review_text"] = df["review_text"].fillna("").astype(str)
+    reviews = df["review_text"].tolist()
+    prompts = [normalize(r) for r in reviews]      # never truncated: the reply carries the full translation
+
+    def run(positions):
+        record("fused", [reviews[p] for p in positions], [prompts[p] for p in positions])
+        todo = [prompts[p] for p in positions]
+        costs = [estimate_tokens(t) for t in todo]
+        plan = pack_batches(costs, [c + OUTPUT_TOKENS_PER_ITEM for c in costs],
+                            INPUT_TOKEN_BUDGET, OUTPUT_TOKEN_BUDGET, MAX_BATCH_ITEMS)
+        batches = [[todo[i] for i in b] for b in plan]
+        print(f"🚀 Fused run: {len(todo)} reviews in {len(batches)} token-budgeted batches "
+              f"({CONCURRENCY} in flight)...")
+        all_results = run_batches(
+            batches, fused_batch, failed_batch,
+            **executor_limits(client(), CONCURRENCY, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE),
+            max_retries=MAX_RETRIES,
+            estimate=lambda batch: estimate_tokens(SYSTEM_INSTRUCTION) + estimate_tokens(build_prompt(batch)),
+            stage="fused",
+        )
+        return [r for results in all_results for r in results]
+
+    def resolve_unique(positions):
+        return run_cached(cache, "fused", MODEL_NAME, prompt_version(build_prompt, SYSTEM_INSTRUCTION),
+                          [prompts[p] for p in positions],
+                          lambda sub: run([positions[i] for i in sub]),
+                          is_valid=lambda r: r.get("reason") != ERROR_RESULT["reason"])
+
+    groups = dedup.assign(reviews, range(offset, offset + len(df)))
+    df["dup_group"] = groups
+    results = dedup.resolve(groups, resolve_unique)
+
+    df["reviews_translated"] = [r.get("translation", "error") for r in results]
+    df["Sentiment"] = [r.get("sentiment", "Unknown") for r in results]
+    df["sentiment_source"] = "gemini"
+    df["Sentiment_Score"] = pd.to_numeric(pd.Series([r.get("score") for r in results], index=df.index),
+                                          errors="coerce")
+    df["Reason"] = [r.get("reason") for r in results]
+    return df[[col for col in OUTPUT_COLUMNS if col in df.columns]]
+
+# -------------------------- MAIN --------------------------
+def process_chunks(chunks, cache=None):
+    """
+    Translate, classify and score an iterable of DataFrame chunks, yielding
+    each finished chunk; the rollups are merged once the caller has taken it.
+    """
+    from dedup import Deduplicator
+    from sentiment_rollup import RollupStore
+    if client() is None:
+        raise MissingAPIKey()
+    own_cache = cache is None
+    cache = cache or ResponseCache()
+    dedup = Deduplicator(DEDUP_THRESHOLD)
+    rollup = RollupStore(ROLLUP_FILE) if ROLLUP_FILE else None
+    offset = 0
+    try:
+        for i, chunk in enumerate(chunks):
+            require_columns(chunk, ["review_text"])
+            print(f"📦 Chunk {i + 1}: {len(chunk)} rows")
+            with METRICS.timer("chunk_seconds", stage="fused"):
+                result = fused_chunk(chunk, cache, dedup, offset)
+            METRICS.inc("rows_total", len(chunk), stage="fused")
+            offset += len(chunk)
+            yield result
+            if rollup:
+                rollup.update(result)
+    finally:
+        if own_cache:
+            cache.close()
+        if rollup:
+            rollup.close()
+
+
+def run(input_file=INPUT_FILE, output_file=OUTPUT_FILE, excel=EXCEL_EXPORT):
+    """Run the fused stage from `input_file` into `output_file`. Returns the rows written, or None on bad input."""
+    try:
+        with ChunkWriter(output_file) as writer:
+            for result in process_chunks(read_chunks(input_file, CHUNK_ROWS)):
+                writer.write(result)
+    except (MissingColumns, MissingAPIKey) as e:
+        print(f"❌ {e}")
+        return None
+    except FileNotFoundError:
+        print(f"❌ File '{input_file}' not found.")
+        return None
+    except PermissionError:
+        print(f"❌ Close '{input_file}' if open and retry.")
+        return None
+
+    print(f"\n✅ Done — Saved {writer.rows} rows as '{output_file}'")
+    if excel:
+        export_excel(output_file, excel)
+    METRICS.finish()
+    return writer.rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Translate, classify and score reviews in one Gemini call per batch.")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--excel", default=EXCEL_EXPORT, help="optional final Excel copy")
+    parser.add_argument("--compare", metavar="STAGED_FILE", help="compare against the three-stage output")
+    args = parser.parse_args()
+    if run(args.input, args.output, args.excel) is not None and args.compare:
+        compare(args.output, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+# gemini_executor.py
+# Shared asyncio executor for the Gemini stages.
+# Packs reviews into token-budgeted batches, keeps several batches in flight,
+# stays inside a requests-per-minute and tokens-per-minute budget, backs off on
+# 429/5xx using the server's retry hints, bisects batches whose reply is
+# malformed, and returns results in the same order as the input batches.
+# Streamed replies hand each item to an `on_item` callback as soon as it is
+# parsed, and a reply that misses some item IDs only re-requests those items.
+
+import asyncio
+import contextvars
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import METRICS
+
+# -------------------------- DEFAULTS --------------------------
+CONCURRENCY = 4                 # Batches in flight at once
+REQUESTS_PER_MINUTE = 15        # Gemini free-tier RPM
+TOKENS_PER_MINUTE = 1_000_000   # Gemini free-tier TPM
+MAX_RETRIES = 2                 # Retry attempts per batch
+BASE_BACKOFF = 5                # Seconds, multiplied by the attempt number
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+_RETRY_HINT_PATTERNS = [
+    re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE),
+    re.compile(r"retry[- ]after:?\s*([\d.]+)", re.IGNORECASE),
+]
+
+
+# -------------------------- RATE LIMITING --------------------------
+def estimate_tokens(text):
+    """
+    Local token estimate used for TPM budgeting and batch packing:
+    ~4 ASCII characters per token, ~1.5 characters per token for other
+    scripts (Devanagari, Tamil, emoji, ...), which tokenize much less densely.
+    """
+    text = str(text)
+    non_ascii = sum(1 for ch in text if not ch.isascii())
+    return int((len(text) - non_ascii) / 4 + non_ascii / 1.5) + 1
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at `capacity` units per minute."""
+
+    def __init__(self, capacity):
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        """Wait until `amount` units are available, then take them."""
+        amount = min(float(amount), self.capacity)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """Combined requests-per-minute and tokens-per-minute budget."""
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, tokens):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(tokens)
+
+
+# -------------------------- RETRY HELPERS --------------------------
+def status_code(exc):
+    """HTTP status of a Gemini / google.api_core error, or None."""
+    code = getattr(exc, "code", None)
+    if callable(code):
+        code = code()
+    if isinstance(code, int):
+        return code
+    value = getattr(code, "value", None)
+    if isinstance(value, tuple) and value and isinstance(value[0], int):
+        # grpc.StatusCode -> the HTTP status of the retryable ones
+        return {4: 504, 8: 429, 13: 500, 14: 503}.get(value[0])
+    match = re.search(r"^\s*([45]\d\d)\b", str(exc))
+    return int(match.group(1)) if match else None
+
+
+def is_retryable(exc):
+    """
+    True for throttling / transient server errors, and for parse and transport
+    (connection, timeout) failures that carry no status. Anything else, such
+    as a bug in a stage's parser, fails the batch at once instead of retrying.
+    """
+    code = status_code(exc)
+    if code is None:
+        return isinstance(exc, (MalformedResponse, OSError))
+    return code in RETRYABLE_STATUS
+
+
+def retry_delay(exc, attempt):
+    """Seconds to wait before the next attempt, preferring the server's hint."""
+    for pattern in _RETRY_HINT_PATTERNS:
+        match = pattern.search(str(exc))
+        if match:
+            return float(match.group(1)) + random.uniform(0, 1)
+    return BASE_BACKOFF * attempt + random.uniform(0, 1)
+
+
+# -------------------------- BATCH PACKING --------------------------
+class MalformedResponse(ValueError):
+    """The model's reply could not be parsed or has the wrong number of items."""
+
+
+class PartialResponse(MalformedResponse):
+    """Some items of a batch are missing from the reply; `found` maps batch position -> result for the rest."""
+
+    def __init__(self, message, found):
+        super().__init__(message)
+        self.found = dict(found)
+
+
+def _take(batch, positions):
+    """The items of `batch` (a list or a DataFrame) at `positions`."""
+    if hasattr(batch, "iloc"):
+        return batch.iloc[positions]
+    return [batch[i] for i in positions]
+
+
+# Where the batch call running in this context sends each streamed item (see emit_item)
+_item_sink = contextvars.ContextVar("item_sink", default=None)
+
+
+def emit_item(position, value):
+    """Report item `position` of the current batch as soon as it is parsed (no-op outside the executor)."""
+    sink = _item_sink.get()
+    if sink is not None:
+        sink(position, value)
+
+
+def pack_batches(input_costs, output_costs, max_input_tokens, max_output_tokens, max_items):
+    """
+    Greedily pack items (in order) into batches that stay within an input and
+    an output token budget and at most `max_items` items. An item larger than a
+    budget on its own still gets a batch of its own. Returns lists of item indices.
+    """
+    batches, current, used_in, used_out = [], [], 0, 0
+    for i, (cost_in, cost_out) in enumerate(zip(input_costs, output_costs)):
+        if current and (len(current) >= max_items
+                        or used_in + cost_in > max_input_tokens
+                        or used_out + cost_out > max_output_tokens):
+            batches.append(current)
+            current, used_in, used_out = [], 0, 0
+        current.append(i)
+        used_in += cost_in
+        used_out += cost_out
+    if current:
+        batches.append(current)
+    return batches
+
+
+# -------------------------- EXECUTOR --------------------------
+def _timed_sink(emit, stage, start):
+    """Item sink for one attempt that also records the time to its first streamed item."""
+    first = []
+
+    def sink(position, value):
+        if not first:
+            first.append(True)
+            METRICS.observe("first_item_seconds", time.perf_counter() - start, stage=stage)
+        if emit is not None:
+            emit(position, value)
+    return sink
+
+
+def _record_call(stage, label, attempt, items, started, latency, outcome, error=None):
+    METRICS.inc("requests_total", stage=stage, outcome=outcome)
+    METRICS.observe("request_seconds", latency, stage=stage)
+    METRICS.event("request", stage=stage, batch=label, attempt=attempt, items=items, outcome=outcome,
+                  latency=round(latency, 4), rate_limit_wait=round(started, 4),
+                  status=status_code(error) if error is not None else None,
+                  error=str(error)[:200] if error is not None else None)
+
+
+async def _call_with_retries(batch, call, fallback, limiter, estimate, max_retries, label, stage, emit=None):
+    """
+    Call the model for one batch. Transient errors are retried. When a reply
+    is missing some items (PartialResponse: cut off, or IDs skipped), the
+    items that arrived are kept and only the missing ones are requested again;
+    an unusable reply to a multi-item batch bisects it and retries the two
+    halves one after the other (inside the batch's concurrency slot), so only
+    the item the model keeps failing on gets the fallback result.
+    `emit(position, value)` receives items as they stream in.
+    """
+    def remap(positions):
+        return None if emit is None else (lambda k, value: emit(positions[k], value))
+
+    attempt = 0
+    while True:
+        attempt += 1
+        start = time.perf_counter()
+        await limiter.acquire(estimate(batch))
+        waited = time.perf_counter() - start
+        METRICS.observe("rate_limit_wait_seconds", waited, stage=stage)
+        start = time.perf_counter()
+        _item_sink.set(_timed_sink(emit, stage, start))   # copied into the worker thread by to_thread
+        try:
+            result = await asyncio.to_thread(call, batch)
+            _record_call(stage, label, attempt, len(batch), waited, time.perf_counter() - start, "ok")
+            return result
+        except MalformedResponse as e:
+            _record_call(stage, label, attempt, len(batch), waited, time.perf_counter() - start, "malformed", e)
+            METRICS.inc("parse_failures_total", stage=stage)
+            found = {i: v for i, v in getattr(e, "found", {}).items() if 0 <= i < len(batch)}
+            if found:
+                missing = [i for i in range(len(batch)) if i not in found]
+                if missing:
+                    print(f"✂️ {label}: {e}; keeping {len(found)} items, re-requesting {len(missing)}")
+                    METRICS.inc("retries_total", stage=stage)
+                    retried = await _call_with_retries(_take(batch, missing), call, fallback, limiter, estimate,
+                                                       max_retries, label, stage, remap(missing))
+                    found.update(zip(missing, retried))
+                return [found[i] for i in range(len(batch))]
+            if len(batch) > 1:
+                mid = len(batch) // 2
+                first, second = list(range(mid)), list(range(mid, len(batch)))
+                print(f"✂️ {label}: {e}; splitting {len(batch)} items into {mid} + {len(batch) - mid}")
+                METRICS.inc("retries_total", stage=stage)
+                head = await _call_with_retries(_take(batch, first), call, fallback, limiter, estimate, max_retries,
+                                                label, stage, remap(first))
+                tail = await _call_with_retries(_take(batch, second), call, fallback, limiter, estimate, max_retries,
+                                                label, stage, remap(second))
+                return list(head) + list(tail)
+            print(f"⚠️ {label}, attempt {attempt} failed: {e}")
+            if attempt > max_retries:
+                return fallback(batch)
+            METRICS.inc("retries_total", stage=stage)
+        except Exception as e:
+            _record_call(stage, label, attempt, len(batch), waited, time.perf_counter() - start, "error", e)
+            print(f"⚠️ {label}, attempt {attempt} failed: {e}")
+            if attempt > max_retries or not is_retryable(e):
+                return fallback(batch)
+            METRICS.inc("retries_total", stage=stage)
+            await asyncio.sleep(retry_delay(e, attempt))
+
+
+async def _run_batch(index, total, batch, call, fallback, limiter, semaphore, estimate, max_retries, label,
+                     on_result, on_item, stage):
+    queued = time.perf_counter()
+    emit = None if on_item is None else (lambda k, value: on_item(index, k, value))
+    async with semaphore:
+        METRICS.observe("queue_wait_seconds", time.perf_counter() - queued, stage=stage)
+        result = await _call_with_retries(batch, call, fallback, limiter, estimate, max_retries,
+                                          f"{label} {index + 1}", stage, emit)
+        print(f"🔹 {label} {index + 1}/{total} done")
+    if on_result is not None:
+        on_result(index, result)
+    return result
+
+
+async def run_batches_async(batches, call, fallback, *, concurrency=CONCURRENCY,
+                            requests_per_minute=REQUESTS_PER_MINUTE,
+                            tokens_per_minute=TOKENS_PER_MINUTE,
+                            max_retries=MAX_RETRIES, estimate=None, label="Batch", on_result=None,
+                            on_item=None, stage="gemini"):
+    """
+    Run `call(batch)` for every batch with bounded concurrency and rate limits.
+    `call` is a blocking function that raises on failure (PartialResponse when
+    only some items came back, MalformedResponse for unusable replies, which
+    bisects the batch); after `max_retries`
+    retries (or on a non-retryable error) `fallback(batch)` supplies the result.
+    `on_result(index, result)` is called as each batch finishes (e.g. to
+    checkpoint it); `on_item(index, position, value)` is called from the worker
+    thread for every item a streaming `call` reports through emit_item, before
+    its batch finishes. Results are returned in input order. Latency, retries,
+    parse failures and waits are recorded in metrics.METRICS under `stage`.
+    """
+    if estimate is None:
+        estimate = lambda batch: sum(estimate_tokens(item) for item in batch)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [
+        _run_batch(i, len(batches), batch, call, fallback, limiter, semaphore, estimate, max_retries, label,
+                   on_result, on_item, stage)
+        for i, batch in enumerate(batches)
+    ]
+    return await asyncio.gather(*tasks)
+
+
+def run_batches(batches, call, fallback, **kwargs):
+    """
+    Blocking wrapper around `run_batches_async` for the stage scripts. The
+    loop gets one worker thread per batch in flight; asyncio's default pool is
+    sized by CPU count and would queue them.
+    """
+    async def main():
+        workers = kwargs.get("concurrency", CONCURRENCY)
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers))
+        return await run_batches_async(batches, call, fallback, **kwargs)
+    return asyncio.run(main())
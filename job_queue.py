@@ -0,0 +1,207 @@
+# job_queue.py
+# Durable SQLite work queue for scheduler.py.
+# Each row is one product at one stage (search -> scrape -> translate ->
+# sentiment -> score). Workers claim a job inside BEGIN IMMEDIATE and hold a
+# time-limited lease they keep renewing; a job whose worker died is reclaimed
+# once its lease runs out. Completing a job enqueues the product's next stage
+# in the same transaction. Any number of processes, on one machine or on several
+# sharing the DB file, can drain the same queue.
+
+import os
+import socket
+import sqlite3
+import time
+
+# -------------------------- CONFIG --------------------------
+QUEUE_FILE = os.getenv("JOB_QUEUE_FILE", "job_queue.sqlite")
+JOURNAL_MODE = os.getenv("JOB_QUEUE_JOURNAL_MODE", "WAL")   # WAL needs one host; use DELETE on a network share
+STAGES = ["search", "scrape", "translate", "sentiment", "score"]
+LEASE_SECONDS = 300          # A claimed job returns to the queue if not renewed within this
+MAX_ATTEMPTS = 3             # Claims per job before it is marked failed
+RETRY_BACKOFF = 30           # Seconds before the first retry, doubled on each further attempt
+BUSY_TIMEOUT = 60            # Seconds to wait for another process's write lock
+
+ACTIVE = ("pending", "running")
+
+
+def worker_id():
+    """host:pid, recorded as the owner of every job this process claims."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def next_stage(stage):
+    i = STAGES.index(stage)
+    return STAGES[i + 1] if i + 1 < len(STAGES) else None
+
+
+class JobQueue:
+    """Jobs table with atomic claim, lease renewal, retry with backoff and stage hand-off."""
+
+    def __init__(self, path=QUEUE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id           INTEGER PRIMARY KEY AUTOINCREMENT,
+                product      TEXT NOT NULL,
+                stage        TEXT NOT NULL,
+                run          INTEGER,
+                input_file   TEXT,
+                output_file  TEXT,
+                status       TEXT NOT NULL DEFAULT 'pending',
+                attempts     INTEGER NOT NULL DEFAULT 0,
+                owner        TEXT,
+                lease_until  REAL,
+                available_at REAL NOT NULL,
+                error        TEXT,
+                rows         INTEGER,
+                created_at   REAL NOT NULL,
+                updated_at   REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (stage, status, available_at)")
+
+    def _transaction(self):
+        return _Immediate(self.conn)
+
+    def _insert(self, product, stage, run=None, input_file=None, delay=0):
+        now = time.time()
+        cursor = self.conn.execute(
+            "INSERT INTO jobs (product, stage, run, input_file, available_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (product, stage, run, input_file, now + delay, now, now),
+        )
+        return cursor.lastrowid
+
+    # ---- producers ----
+    def add(self, product, stage="scrape", input_file=None):
+        """Queue `product` at `stage`; returns the job ID, or None if it already has an open job there."""
+        with self._transaction():
+            open_job = self.conn.execute(
+                f"SELECT id FROM jobs WHERE product = ? AND stage = ? AND status IN {ACTIVE}", (product, stage)
+            ).fetchone()
+            if open_job:
+                return None
+            return self._insert(product, stage, input_file=input_file)
+
+    # ---- workers ----
+    def claim(self, stage, owner, lease=LEASE_SECONDS):
+        """Atomically take the oldest runnable job of `stage` (or one whose lease expired). None if idle."""
+        now = time.time()
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE jobs SET status = 'failed', error = COALESCE(error, 'lease expired'), updated_at = ? "
+                "WHERE stage = ? AND status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, stage, now, MAX_ATTEMPTS),
+            )
+            job = self.conn.execute(
+                "SELECT * FROM jobs WHERE stage = ? AND ("
+                "  (status = 'pending' AND available_at <= ?) OR (status = 'running' AND lease_until < ?)"
+                ") ORDER BY available_at, id LIMIT 1",
+                (stage, now, now),
+            ).fetchone()
+            if job is None:
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, lease_until = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE id = ?",
+                (owner, now + lease, now, job["id"]),
+            )
+        return dict(job, status="running", owner=owner, attempts=job["attempts"] + 1)
+
+    def renew(self, job_id, owner, lease=LEASE_SECONDS):
+        """Extend the lease; False if the job was reclaimed by another worker meanwhile."""
+        now = time.time()
+        cursor = self.conn.execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND owner = ? AND status = 'running'",
+            (now + lease, now, job_id, owner),
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job, output_file=None, rows=None, follow_ups=()):
+        """
+        Mark `job` done and, in the same transaction, queue the next stage on
+        `output_file` plus any `follow_ups` ((product, stage) pairs, e.g. the
+        ASINs a search resolved to). Returns False if the lease was lost.
+        """
+        now = time.time()
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'done', output_file = ?, rows = ?, error = NULL, lease_until = NULL, "
+                "updated_at = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (output_file, rows, now, job["id"], job["owner"]),
+            )
+            if cursor.rowcount != 1:
+                return False
+            stage = next_stage(job["stage"])
+            if output_file and stage:
+                self._insert(job["product"], stage, run=job["run"] or job["id"], input_file=output_file)
+            for product, stage in follow_ups:
+                open_job = self.conn.execute(
+                    f"SELECT id FROM jobs WHERE product = ? AND stage = ? AND status IN {ACTIVE}", (product, stage)
+                ).fetchone()
+                if not open_job:
+                    self._insert(product, stage)
+        return True
+
+    def fail(self, job, error):
+        """Put `job` back with exponential backoff, or mark it failed after MAX_ATTEMPTS claims."""
+        now = time.time()
+        final = job["attempts"] >= MAX_ATTEMPTS
+        self.conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, available_at = ?, updated_at = ? "
+            "WHERE id = ? AND owner = ? AND status = 'running'",
+            ("failed" if final else "pending", str(error)[:2000],
+             now + RETRY_BACKOFF * 2 ** (job["attempts"] - 1), now, job["id"], job["owner"]),
+        )
+        return final
+
+    # ---- inspection ----
+    def open_jobs(self, stages):
+        """Pending or running jobs in any of `stages` (a worker may only exit once upstream is drained)."""
+        marks = ", ".join("?" * len(stages))
+        row = self.conn.execute(
+            f"SELECT COUNT(*) FROM jobs WHERE stage IN ({marks}) AND status IN {ACTIVE}", list(stages)
+        ).fetchone()
+        return row[0]
+
+    def counts(self):
+        """{stage: {status: n}} for the status report."""
+        counts = {}
+        for row in self.conn.execute("SELECT stage, status, COUNT(*) FROM jobs GROUP BY stage, status"):
+            counts.setdefault(row[0], {})[row[1]] = row[2]
+        return counts
+
+    def jobs(self, status=None, limit=50):
+        query, params = "SELECT * FROM jobs", []
+        if status:
+            query, params = query + " WHERE status = ?", [status]
+        return [dict(r) for r in self.conn.execute(query + " ORDER BY id DESC LIMIT ?", params + [limit])]
+
+    def retry_failed(self, stage=None):
+        """Give failed jobs a fresh set of attempts."""
+        now = time.time()
+        query = "UPDATE jobs SET status = 'pending', attempts = 0, available_at = ?, updated_at = ? WHERE status = 'failed'"
+        params = [now, now]
+        if stage:
+            query, params = query + " AND stage = ?", params + [stage]
+        return self.conn.execute(query, params).rowcount
+
+    def close(self):
+        self.conn.close()
+
+
+class _Immediate:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK: takes the write lock up front so two claims never race."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
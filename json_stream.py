@@ -0,0 +1,165 @@
+# json_stream.py
+# Incremental parser for the JSON arrays the Gemini stages ask for.
+# Instead of waiting for the whole reply and slicing find('[')..rfind(']'),
+# the stages request generate_content(stream=True) and feed each chunk to
+# JSONArrayStream, which returns every top-level array element as soon as it
+# closes. Prompts tag every review with an ID ("[3] ...") and the reply is
+# constrained by a response schema to objects that echo it ({"id": 3, ...}),
+# so items are joined back by ID rather than by position: a reply that skips,
+# repeats or reorders items never shifts a row. Each item is handed to the
+# executor's item sink right away (so it reaches the checkpoint journal before
+# the batch finishes), and the IDs that did not arrive are re-requested alone.
+
+import json
+
+from gemini_executor import MalformedResponse, PartialResponse, emit_item
+from metrics import METRICS
+
+_WHITESPACE = " \t\r\n"
+
+
+class JSONArrayStream:
+    """
+    Push parser for one JSON array: `feed(text)` returns the elements that
+    completed in that piece of text. Anything before the first '[' (prose,
+    a ```json fence) is ignored, as is anything after the closing ']'.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0              # next character to scan in buffer
+        self.started = False      # seen the opening '['
+        self.done = False         # seen the closing ']'
+        self.depth = 0            # nesting inside the current element
+        self.in_string = False
+        self.escape = False
+        self.item_start = None    # buffer index where the current element began
+        self.count = 0
+
+    def feed(self, text):
+        if self.done or not text:
+            return []
+        self.buffer += text
+        items = []
+        buf, i = self.buffer, self.pos
+        while i < len(buf) and not self.done:
+            ch = buf[i]
+            if not self.started:
+                if ch == "[":
+                    self.started = True
+                i += 1
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.depth == 0:           # a top-level string element just closed
+                        items.append(self._finish(i + 1))
+                i += 1
+                continue
+            if self.item_start is None:
+                if ch in _WHITESPACE or ch == ",":
+                    i += 1
+                    continue
+                if ch == "]":
+                    self.done = True
+                    i += 1
+                    continue
+                self.item_start = i
+            if ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                if self.depth == 0:               # ']' ending the array after a number/literal
+                    items.append(self._finish(i))
+                    self.done = True
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        items.append(self._finish(i + 1))
+            elif ch == "," and self.depth == 0:   # ',' ending a number/literal
+                items.append(self._finish(i))
+            i += 1
+        # Drop the consumed prefix so the buffer only holds the open element
+        keep = self.item_start if self.item_start is not None else i
+        self.buffer = buf[keep:]
+        if self.item_start is not None:
+            self.item_start = 0
+        self.pos = i - keep
+        return items
+
+    def _finish(self, end):
+        raw = self.buffer[self.item_start:end]
+        self.item_start = None
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise MalformedResponse(f"invalid array element {self.count + 1}: {e}")
+        self.count += 1
+        return value
+
+
+def tag(i, text):
+    """Prompt line for batch item `i` (0-based); the model echoes the 1-based ID."""
+    return f"[{i + 1}] {text}"
+
+
+def response_config(**fields):
+    """
+    generation_config for JSON mode with a schema: an array of objects with an
+    integer "id" plus `fields` (name -> schema type, e.g. translation="STRING").
+    """
+    properties = {"id": {"type": "INTEGER"}, **{name: {"type": kind} for name, kind in fields.items()}}
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": {"type": "ARRAY",
+                            "items": {"type": "OBJECT", "properties": properties, "required": list(properties)}},
+    }
+
+
+def stream_by_id(response, stage, size, convert):
+    """
+    Consume a streamed reply of [{"id": n, ...}, ...] for a batch tagged 1..size.
+    Each object is joined to its item by ID, passed through `convert` and
+    emitted at that position as soon as it closes; objects with an unknown or
+    repeated ID, or that `convert` rejects (MalformedResponse), are dropped.
+    Returns the results in batch order, or raises PartialResponse with the
+    positions that did arrive when some IDs are missing.
+    """
+    parser = JSONArrayStream()
+    found = {}
+    dropped = 0
+    error = None
+    try:
+        for chunk in response:
+            for item in parser.feed(chunk.text):
+                position = item.get("id") if isinstance(item, dict) else None
+                if not isinstance(position, int) or not 1 <= position <= size or position - 1 in found:
+                    dropped += 1
+                    continue
+                try:
+                    value = convert(item)
+                except MalformedResponse:
+                    dropped += 1
+                    continue
+                found[position - 1] = value
+                emit_item(position - 1, value)
+    except MalformedResponse as e:
+        error = str(e)
+    except Exception as e:
+        if not found:
+            raise
+        error = f"stream failed after {len(found)} items: {e}"
+    else:
+        METRICS.usage(stage, response)
+        if not parser.done:
+            error = f"stream ended after {len(found)} items without a closing ']'"
+    if len(found) == size:
+        return [found[i] for i in range(size)]
+    missing = size - len(found)
+    raise PartialResponse(f"{error or 'reply incomplete'}; {missing} of {size} IDs missing"
+                          + (f", {dropped} items dropped" if dropped else ""), found)
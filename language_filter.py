@@ -0,0 +1,90 @@
+# language_filter.py
+# Offline language/script prefilter for translated_review.py.
+# Reviews that are confidently English are marked "no change" locally, so only
+# the rest are sent to Gemini for translation. Detection needs no network or
+# model: it looks at which Unicode scripts the letters belong to (Devanagari,
+# Tamil, Bengali, ...) and, for Latin-script text, at how many words are
+# common English words (to catch romanized Hindi/Tamil, which still needs
+# translating).
+
+import re
+import unicodedata
+
+from gemini_executor import estimate_tokens
+
+# -------------------------- CONFIG --------------------------
+ENGLISH_THRESHOLD = 0.8          # Minimum confidence to skip the translation API
+
+_WORD = re.compile(r"[a-z']+")
+COMMON_ENGLISH = set("""
+a about after all also am an and any are as at be because been before best book books but by can
+characters could did do does don't end enjoyed even ever every excellent fantastic for from get good
+great had has have he her his how i if in is it it's its just like liked love loved made make many me
+more most much must my nice no not of on one only or other our out over page pages plot quality read
+reading really recommend same she should so some story such than that the their them then there these
+they this those time to too translation up very was waste we well were what when which while who why
+will with worth would writing you your
+amazing awesome bad beautiful boring classic condition copy delivery interesting must-read novel
+okay ok perfect poor print product superb wonderful worst
+""".split())
+
+
+# -------------------------- DETECTION --------------------------
+def _script(ch):
+    """First word of the Unicode character name, e.g. 'LATIN', 'DEVANAGARI', 'TAMIL'."""
+    try:
+        return unicodedata.name(ch).split(" ", 1)[0]
+    except ValueError:
+        return "UNKNOWN"
+
+
+def english_confidence(text):
+    """
+    Confidence in [0, 1] that a review is English.
+    Text without any letters (emoji, punctuation, empty) has nothing to
+    translate and scores 1.0; any non-Latin script lowers the score in
+    proportion to how many letters use it.
+    """
+    letters = [ch for ch in str(text) if ch.isalpha()]
+    if not letters:
+        return 1.0
+    latin = sum(1 for ch in letters if ch.isascii() or _script(ch) == "LATIN") / len(letters)
+    if latin < 0.5:
+        return 0.0
+
+    words = _WORD.findall(str(text).lower())
+    if not words:
+        return 0.0
+    common = sum(1 for w in words if w in COMMON_ENGLISH) / len(words)
+    return latin * min(1.0, 0.4 + 1.2 * common)
+
+
+def english_mask(texts, threshold=ENGLISH_THRESHOLD):
+    """One boolean per text: True when it can be marked "no change" without the API."""
+    return [english_confidence(t) >= threshold for t in texts]
+
+
+# -------------------------- REPORTING --------------------------
+class PrefilterStats:
+    """Counts how many rows, API calls and input tokens the prefilter saved."""
+
+    def __init__(self, plan_batches):
+        self.plan_batches = plan_batches
+        self.rows = 0
+        self.local_rows = 0
+        self.local_tokens = 0
+        self.calls_before = 0
+        self.calls_after = 0
+
+    def add(self, texts, mask):
+        local = sum(mask)
+        self.rows += len(texts)
+        self.local_rows += local
+        self.local_tokens += sum(estimate_tokens(t) for t, en in zip(texts, mask) if en)
+        self.calls_before += len(self.plan_batches(texts))
+        self.calls_after += len(self.plan_batches([t for t, en in zip(texts, mask) if not en]))
+
+    def report(self):
+        share = self.local_rows / self.rows if self.rows else 0.0
+        print(f"🔤 Language prefilter: {self.local_rows}/{self.rows} reviews ({share:.0%}) kept locally as English")
+        print(f"   Saved ~{self.calls_before - self.calls_after} API calls and ~{self.local_tokens} input tokens")
@@ -0,0 +1,206 @@
+# local_sentiment.py
+# Offline, CPU-only sentiment classifier used in front of Gemini by sentiment.py.
+# A small lexicon plus a NumPy softmax-regression model over hashed word and
+# bigram features, trained on our past Gemini-labelled output. A whole column
+# is scored in one vectorized call; only low-confidence rows go to Gemini, and
+# with no GEMINI_API_KEY every row is labelled locally. Without a trained model
+# file only the lexicon is left, which has never been benchmarked against
+# Gemini, so sentiment.py sends every row to Gemini unless told otherwise.
+#
+# Usage:
+#   python local_sentiment.py train reviews_with_sentiment_batched11.parquet
+#   python local_sentiment.py benchmark reviews_with_sentiment_batched11.parquet --threshold 0.8
+
+import argparse
+import os
+import re
+import zlib
+import numpy as np
+
+from review_store import read_all
+
+# -------------------------- CONFIG --------------------------
+MODEL_FILE = "local_sentiment_model.npz"
+LOCAL_CONFIDENCE = 0.8           # Rows at or above this confidence skip Gemini
+LABELS = np.array(["Negative", "Neutral", "Positive"])
+N_FEATURES = 1 << 18             # Hashed feature space
+EPOCHS = 30
+LEARNING_RATE = 0.5
+L2 = 1e-4
+
+POSITIVE_WORDS = set("""
+amazing awesome beautiful best brilliant captivating classic enjoy enjoyed excellent fantastic fascinating
+gem good great happy impressive interesting love loved lovely masterpiece must nice outstanding perfect
+recommend recommended superb touching wonderful worth
+""".split())
+NEGATIVE_WORDS = set("""
+awful bad boring damaged disappointed disappointing dull fake hate hated horrible poor refund returned
+slow terrible torn useless waste worst wrong
+""".split())
+NEGATORS = {"not", "no", "never", "don't", "didn't", "isn't", "wasn't", "hardly"}
+
+_WORD = re.compile(r"[a-z']+")
+
+
+# -------------------------- FEATURES --------------------------
+def tokenize(text):
+    """Lowercase words with negation folded in ("not good" -> "not_good")."""
+    words = _WORD.findall(str(text).lower())
+    tokens, negate = [], False
+    for w in words:
+        if w in NEGATORS:
+            negate = True
+            continue
+        tokens.append("not_" + w if negate else w)
+        negate = False
+    return tokens
+
+
+def lexicon_counts(tokens):
+    """(positive, negative) lexicon hits; a negated word counts for the opposite side."""
+    pos = sum(1 for t in tokens if t in POSITIVE_WORDS or (t.startswith("not_") and t[4:] in NEGATIVE_WORDS))
+    neg = sum(1 for t in tokens if t in NEGATIVE_WORDS or (t.startswith("not_") and t[4:] in POSITIVE_WORDS))
+    return pos, neg
+
+
+def _features(tokens):
+    pos, neg = lexicon_counts(tokens)
+    feats = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    feats += ["__lex_pos__"] * pos + ["__lex_neg__"] * neg + ["__bias__"]
+    return [zlib.crc32(f.encode("utf-8")) % N_FEATURES for f in feats]
+
+
+def featurize(texts):
+    """Flat (document index, feature index) arrays for a list of texts."""
+    doc_idx, feat_idx = [], []
+    for i, text in enumerate(texts):
+        ids = _features(tokenize(text))
+        doc_idx.extend([i] * len(ids))
+        feat_idx.extend(ids)
+    return np.asarray(doc_idx, dtype=np.int64), np.asarray(feat_idx, dtype=np.int64)
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+# -------------------------- MODEL --------------------------
+class LocalSentimentModel:
+    """Hashed bag-of-words softmax regression; falls back to the lexicon when untrained."""
+
+    def __init__(self, weights=None):
+        self.weights = weights
+
+    @property
+    def trained(self):
+        """False for the lexicon-only fallback."""
+        return self.weights is not None
+
+    @classmethod
+    def load(cls, path=MODEL_FILE):
+        """Load trained weights, or return a lexicon-only model when there is no model file."""
+        if os.path.exists(path):
+            return cls(np.load(path)["weights"])
+        return cls()
+
+    def save(self, path=MODEL_FILE):
+        np.savez_compressed(path, weights=self.weights)
+
+    def fit(self, texts, labels, epochs=EPOCHS, lr=LEARNING_RATE):
+        doc_idx, feat_idx = featurize(texts)
+        y = np.searchsorted(LABELS, np.asarray(labels))
+        onehot = np.eye(len(LABELS), dtype=np.float32)[y]
+        self.weights = np.zeros((N_FEATURES, len(LABELS)), dtype=np.float32)
+        n = len(texts)
+        for _ in range(epochs):
+            logits = np.zeros((n, len(LABELS)), dtype=np.float32)
+            np.add.at(logits, doc_idx, self.weights[feat_idx])
+            err = (_softmax(logits) - onehot) / n
+            grad = np.zeros_like(self.weights)
+            np.add.at(grad, feat_idx, err[doc_idx])
+            self.weights -= lr * (grad + L2 * self.weights)
+        return self
+
+    def predict_proba(self, texts):
+        """(n, 3) class probabilities for a whole column of texts in one call."""
+        texts = list(texts)
+        if self.weights is None:
+            return self._lexicon_proba(texts)
+        doc_idx, feat_idx = featurize(texts)
+        logits = np.zeros((len(texts), len(LABELS)), dtype=np.float32)
+        np.add.at(logits, doc_idx, self.weights[feat_idx])
+        return _softmax(logits)
+
+    def _lexicon_proba(self, texts):
+        counts = np.array([lexicon_counts(tokenize(t)) for t in texts], dtype=np.float32).reshape(-1, 2)
+        margin = counts[:, 0] - counts[:, 1]
+        conf = np.minimum(0.95, 0.55 + 0.15 * np.abs(margin))
+        proba = np.full((len(texts), len(LABELS)), 0.0, dtype=np.float32)
+        label = np.where(margin > 0, 2, np.where(margin < 0, 0, 1))
+        conf = np.where(margin == 0, 0.4, conf)
+        proba[:] = ((1 - conf) / 2)[:, None]
+        proba[np.arange(len(texts)), label] = conf
+        return proba
+
+    def predict(self, texts):
+        """Labels and confidences for a list of texts."""
+        proba = self.predict_proba(texts)
+        return LABELS[proba.argmax(axis=1)], proba.max(axis=1)
+
+
+def english_text(df):
+    """Vectorized pick of the English text per row: the translation unless it is "no change"."""
+    if "reviews_translated" not in df.columns:
+        return df["review_text"].fillna("").astype(str)
+    translated = df["reviews_translated"].fillna("no change").astype(str)
+    return df["review_text"].fillna("").astype(str).where(translated == "no change", translated)
+
+
+# -------------------------- CLI --------------------------
+def gemini_labelled(df):
+    """Rows with a valid label that came from Gemini (sentiment.py marks its local labels "local")."""
+    labelled = df["Sentiment"].isin(LABELS)
+    if "sentiment_source" in df.columns:
+        labelled &= df["sentiment_source"] == "gemini"
+    return df[labelled]
+
+
+def benchmark(model, df, threshold):
+    """Agreement with Gemini labels and the share of traffic the local model would take."""
+    labelled = gemini_labelled(df)
+    labels, conf = model.predict(english_text(labelled).tolist())
+    gemini = labelled["Sentiment"].to_numpy()
+    routed = conf >= threshold
+    print(f"📊 Local model vs Gemini on {len(labelled)} labelled reviews")
+    print(f"   Overall agreement: {(labels == gemini).mean():.1%}")
+    print(f"   Offloaded at confidence >= {threshold}: {routed.mean():.1%} of rows")
+    if routed.any():
+        print(f"   Agreement on offloaded rows: {(labels[routed] == gemini[routed]).mean():.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or benchmark the offline sentiment model.")
+    parser.add_argument("command", choices=["train", "benchmark"])
+    parser.add_argument("data", help="Gemini-labelled file with a Sentiment column")
+    parser.add_argument("--model", default=MODEL_FILE)
+    parser.add_argument("--threshold", type=float, default=LOCAL_CONFIDENCE)
+    args = parser.parse_args()
+
+    df = read_all(args.data)
+    if args.command == "train":
+        labelled = gemini_labelled(df).sample(frac=1.0, random_state=0)
+        split = int(len(labelled) * 0.8)
+        train, test = labelled.iloc[:split], labelled.iloc[split:]
+        model = LocalSentimentModel().fit(english_text(train).tolist(), train["Sentiment"].tolist())
+        model.save(args.model)
+        print(f"✅ Trained on {len(train)} reviews, saved to '{args.model}'")
+        if len(test):
+            benchmark(model, test, args.threshold)
+    else:
+        benchmark(LocalSentimentModel.load(args.model), df, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# metrics.py
+# Structured instrumentation for the LLM pipeline.
+# The executor, cache, review store and stage batch functions record into one
+# process-wide registry (METRICS):
+#   - pipeline_metrics.jsonl  one JSON event per request / cache lookup / chunk / I/O call
+#   - pipeline_metrics_<stage>.prom  Prometheus text snapshot of the counters and latency summaries
+# and each stage prints a short summary at the end of its run, including which
+# of quota waits, request latency or file I/O dominated the wall time.
+
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# -------------------------- CONFIG --------------------------
+METRICS_FILE = os.getenv("PIPELINE_METRICS_FILE", "pipeline_metrics.jsonl")
+PROMETHEUS_FILE = os.getenv("PIPELINE_PROMETHEUS_FILE", "pipeline_metrics_{stages}.prom")   # one file per stage run
+PREFIX = "pipeline_"
+QUANTILES = (0.5, 0.95, 0.99)
+
+HELP = {
+    "requests_total": "Model calls by outcome (ok, error, malformed)",
+    "request_seconds": "Latency of one model call",
+    "first_item_seconds": "Time from sending a request to its first streamed item",
+    "retries_total": "Model calls that were retried or split after a failure",
+    "parse_failures_total": "Replies that could not be parsed or had the wrong item count",
+    "input_tokens_total": "Prompt tokens reported in the response usage metadata",
+    "output_tokens_total": "Reply tokens reported in the response usage metadata",
+    "review_tokens": "Estimated tokens of one review sent to the model, before (raw) and after (compact) compaction",
+    "truncated_reviews_total": "Reviews cut to their head and tail to fit the stage's token cap",
+    "cache_hits_total": "Reviews answered from the response cache",
+    "cache_misses_total": "Reviews sent on to the model",
+    "queue_wait_seconds": "Time a batch waited for a concurrency slot",
+    "rate_limit_wait_seconds": "Time a call waited for the RPM/TPM budget",
+    "rows_total": "Rows written by the stage",
+    "chunk_seconds": "Wall time to process one chunk",
+    "io_seconds": "Time spent reading/writing Parquet, CSV and Excel files",
+    "key_calls_total": "Model calls per API key and model by outcome (ok, throttled, error, rejected)",
+    "key_wait_seconds": "Time a call waited for any key of its tier to have quota",
+}
+
+
+class Metrics:
+    """Thread-safe counters and latency summaries, with every observation logged as JSONL."""
+
+    def __init__(self, path=METRICS_FILE, prometheus_path=PROMETHEUS_FILE):
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self.counters = {}
+        self.summaries = {}
+        self.lock = threading.Lock()
+        self._file = None
+
+    # ---- recording ----
+    def event(self, kind, **fields):
+        """Append one structured event to the JSONL log."""
+        if not self.path:
+            return
+        line = json.dumps({"ts": round(time.time(), 3), "run": self.run_id, "event": kind, **fields},
+                          ensure_ascii=False, default=str)
+        with self.lock:
+            if self._file is None:
+                # Line-buffered: one write() per event, so appends from parallel workers don't interleave
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(line + "\n")
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.summaries.setdefault(key, []).append(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the seconds spent inside the block under `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(name, seconds, **labels)
+            self.event(name, seconds=round(seconds, 4), **labels)
+
+    def usage(self, stage, response):
+        """Record the token counts of a Gemini response (usage_metadata), if it has any."""
+        meta = getattr(response, "usage_metadata", None)
+        if meta is None:
+            return
+        tokens_in = getattr(meta, "prompt_token_count", 0) or 0
+        tokens_out = getattr(meta, "candidates_token_count", 0) or 0
+        self.inc("input_tokens_total", tokens_in, stage=stage)
+        self.inc("output_tokens_total", tokens_out, stage=stage)
+        self.event("usage", stage=stage, input_tokens=tokens_in, output_tokens=tokens_out)
+
+    # ---- reading ----
+    def total(self, name, **labels):
+        """Sum of counter `name` over all label sets matching `labels`."""
+        want = set(labels.items())
+        return sum(v for (n, key), v in self.counters.items() if n == name and want <= set(key))
+
+    def values(self, name, **labels):
+        want = set(labels.items())
+        return [x for (n, key), vals in self.summaries.items() if n == name and want <= set(key) for x in vals]
+
+    def stages(self):
+        return sorted({dict(key).get("stage") for (_, key) in list(self.counters) + list(self.summaries)} - {None})
+
+    # ---- output ----
+    def write_prometheus(self, path=None):
+        """Write a Prometheus text-format snapshot (counters and quantile summaries); returns the path."""
+        path = (path or self.prometheus_path).format(stages="_".join(self.stages()) or "run")
+        if not path:
+            return None
+
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+        import numpy as np
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            summaries = sorted((k, list(v)) for k, v in self.summaries.items())
+        for kind, items in (("counter", counters), ("summary", summaries)):
+            seen = set()
+            for (name, labels), value in items:
+                metric = PREFIX + name
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append(f"# HELP {metric} {HELP.get(name, name)}")
+                    lines.append(f"# TYPE {metric} {kind}")
+                if kind == "counter":
+                    lines.append(f"{metric}{fmt(labels)} {value}")
+                    continue
+                for q, v in zip(QUANTILES, np.quantile(value, QUANTILES)):
+                    lines.append(f"{metric}{fmt(labels, [('quantile', q)])} {v:.6f}")
+                lines.append(f"{metric}_sum{fmt(labels)} {sum(value):.6f}")
+                lines.append(f"{metric}_count{fmt(labels)} {len(value)}")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, path)
+        return path
+
+    def summary(self):
+        """Print a per-stage report and what the run was mostly waiting on."""
+        import numpy as np
+        elapsed = time.time() - self.started
+        print(f"\n📈 Run {self.run_id} — {elapsed:.1f}s")
+        for stage in self.stages():
+            rows = self.total("rows_total", stage=stage)
+            chunk_time = sum(self.values("chunk_seconds", stage=stage))
+            latencies = self.values("request_seconds", stage=stage)
+            rate = f"{rows / chunk_time:.1f} rows/s" if chunk_time else "n/a"
+            print(f"   {stage}: {rows} rows in {chunk_time:.1f}s ({rate})")
+            if latencies:
+                p50, p95, p99 = np.quantile(latencies, QUANTILES)
+                print(f"      requests: {self.total('requests_total', stage=stage, outcome='ok')} ok, "
+                      f"{self.total('requests_total', stage=stage, outcome='error')} errors, "
+                      f"{self.total('parse_failures_total', stage=stage)} parse failures, "
+                      f"{self.total('retries_total', stage=stage)} retries; "
+                      f"latency p50 {p50:.2f}s p95 {p95:.2f}s p99 {p99:.2f}s")
+            tokens_in, tokens_out = self.total("input_tokens_total", stage=stage), self.total("output_tokens_total", stage=stage)
+            if tokens_in or tokens_out:
+                print(f"      tokens: {tokens_in} in, {tokens_out} out")
+            raw, sent = (self.values("review_tokens", stage=stage, phase=p) for p in ("raw", "compact"))
+            if raw:
+                print(f"      compaction: {sum(raw)} -> {sum(sent)} review tokens "
+                      f"({1 - sum(sent) / max(sum(raw), 1):.0%} saved), p95 per row "
+                      f"{np.quantile(raw, 0.95):.0f} -> {np.quantile(sent, 0.95):.0f}, "
+                      f"{self.total('truncated_reviews_total', stage=stage)} truncated")
+            hits, misses = self.total("cache_hits_total", stage=stage), self.total("cache_misses_total", stage=stage)
+            if hits or misses:
+                print(f"      cache: {hits} hits, {misses} misses ({hits / (hits + misses):.0%} hit rate)")
+            # Summed over batches in flight, so compare them with each other rather than with wall time
+            waits = {
+                "quota (RPM/TPM wait)": sum(self.values("rate_limit_wait_seconds", stage=stage)),
+                "model latency": sum(latencies),
+            }
+            if any(waits.values()):
+                print(f"      batch time: {', '.join(f'{k} {v:.1f}s' for k, v in waits.items())} "
+                      f"→ bound by {max(waits, key=waits.get)}; "
+                      f"{sum(self.values('queue_wait_seconds', stage=stage)):.1f}s queued for a slot")
+        io = {op: sum(self.values("io_seconds", op=op)) for op in ("read", "write", "export")}
+        if any(io.values()):
+            busy = sum(self.values("chunk_seconds"))
+            print(f"   file I/O: {', '.join(f'{op} {s:.1f}s' for op, s in io.items())} "
+                  f"vs {busy:.1f}s processing chunks")
+        slots = sorted({(dict(labels)["key"], dict(labels)["model"])
+                        for name, labels in list(self.counters) if name == "key_calls_total"})
+        for key, model in slots:
+            outcomes = {o: self.total("key_calls_total", key=key, model=model, outcome=o)
+                        for o in ("ok", "throttled", "error", "rejected")}
+            print(f"   🔑 {key}/{model}: " + ", ".join(f"{n} {o}" for o, n in outcomes.items() if n))
+
+    def finish(self):
+        """End of run: flush the event log, write the Prometheus snapshot and print the summary."""
+        self.event("run_finished", seconds=round(time.time() - self.started, 3))
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        snapshot = self.write_prometheus()
+        self.summary()
+        if self.path:
+            print(f"   📝 Events in '{self.path}'" + (f", snapshot in '{snapshot}'" if snapshot else ""))
+
+
+# Process-wide registry used by every stage
+METRICS = Metrics()
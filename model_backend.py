@@ -0,0 +1,283 @@
+# model_backend.py
+# Pluggable model backends for the Gemini stages.
+# Every stage only needs `backend.generate_content(prompt, system_instruction=...)`,
+# so the real Gemini client and a local stand-in are interchangeable:
+#   MODEL_BACKEND=gemini (default)  google.generativeai with one API client per key, behind a
+#                                   client_pool.ClientPool over every key in GEMINI_API_KEYS
+#   MODEL_BACKEND=fake              FakeGeminiBackend: schema-correct replies with
+#                                   configurable latency, errors, 429s and malformed JSON
+# The fake backend lets benchmark.py (and anyone without a key) run the whole
+# pipeline offline.
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from client_pool import MODEL_TIERS, ClientPool, api_keys
+from gemini_executor import REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, estimate_tokens
+
+# -------------------------- CONFIG --------------------------
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "gemini")
+
+# Fake-backend defaults (each overridable with the FAKE_* environment variable of the same name)
+FAKE_LATENCY = 0.5               # Seconds per call before jitter
+FAKE_JITTER = 0.25               # +/- uniform jitter, as a fraction of the latency
+FAKE_ERROR_RATE = 0.0            # Share of calls failing with a 500/503
+FAKE_RATE_LIMIT_RATE = 0.0       # Share of calls failing with a 429 (with a retry hint)
+FAKE_MALFORMED_RATE = 0.0        # Share of calls returning truncated JSON or a short array
+FAKE_RETRY_AFTER = 0.5           # Seconds suggested in the 429 message
+FAKE_STREAM_CHUNK = 64           # Characters per chunk with stream=True
+FAKE_FIRST_CHUNK_SHARE = 0.3     # Share of the latency spent before the first streamed chunk
+FAKE_KEYS = 1                    # >1 puts that many fake keys behind a ClientPool
+FAKE_KEY_RPM = 60                # Requests per minute per fake key in the pool
+
+SENTIMENTS = ["Positive", "Neutral", "Negative"]
+SCORE_RANGES = {"Positive": (4, 10), "Neutral": (-3, 3), "Negative": (-10, -4)}
+_TAGGED = re.compile(r"(?m)^\[(\d+)\] ")
+_LABEL = re.compile(r"^\((\w+)\) ")           # score prompt: "[1] (Positive) review text"
+
+
+# -------------------------- GEMINI --------------------------
+class GeminiBackend:
+    """
+    google.generativeai, imported on the first request; one model per system
+    instruction. Each backend has its own API client bound to its key, since
+    genai.configure() swaps one process-wide client under every pool slot.
+    """
+
+    def __init__(self, model_name, api_key):
+        self.model_name = model_name
+        self.api_key = api_key
+        self._client = None
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def model(self, system_instruction=None):
+        with self._lock:
+            if system_instruction not in self._models:
+                import google.generativeai as genai
+                from google.ai import generativelanguage as glm
+                if self._client is None:
+                    self._client = glm.GenerativeServiceClient(client_options={"api_key": self.api_key})
+                model = genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+                model._client = self._client      # used instead of the global default client
+                self._models[system_instruction] = model
+        return self._models[system_instruction]
+
+    def generate_content(self, prompt, system_instruction=None, **kwargs):
+        return self.model(system_instruction).generate_content(prompt, **kwargs)
+
+
+# -------------------------- FAKE GEMINI --------------------------
+class FakeAPIError(Exception):
+    """Raised by the fake backend; `code` is read by gemini_executor.status_code like a google.api_core error."""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FakeUsage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeStream:
+    """Iterable of text chunks like a streamed GenerateContentResponse; the latency is spread over the chunks."""
+
+    def __init__(self, text, usage_metadata, seconds):
+        self.chunks = [text[i:i + FAKE_STREAM_CHUNK] for i in range(0, len(text), FAKE_STREAM_CHUNK)] or [""]
+        self.usage_metadata = usage_metadata
+        self.seconds = seconds
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            time.sleep(self.seconds / len(self.chunks))
+            yield FakeResponse(chunk)
+
+
+class FakeGeminiBackend:
+    """
+    Local stand-in for a Gemini model. Recognises the translate, sentiment,
+    score and fused prompts, finds the ID-tagged reviews in them and answers
+    with a JSON array in the schema that stage asks for. Labels are derived from
+    a hash of each review, so repeated runs give identical output.
+    """
+
+    def __init__(self, latency=FAKE_LATENCY, jitter=FAKE_JITTER, error_rate=FAKE_ERROR_RATE,
+                 rate_limit_rate=FAKE_RATE_LIMIT_RATE, malformed_rate=FAKE_MALFORMED_RATE,
+                 retry_after=FAKE_RETRY_AFTER, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = self.errors = self.rate_limited = self.malformed = 0
+
+    @classmethod
+    def from_env(cls):
+        def knob(name, default):
+            return float(os.getenv(name, default))
+        return cls(latency=knob("FAKE_LATENCY", FAKE_LATENCY), jitter=knob("FAKE_JITTER", FAKE_JITTER),
+                   error_rate=knob("FAKE_ERROR_RATE", FAKE_ERROR_RATE),
+                   rate_limit_rate=knob("FAKE_RATE_LIMIT_RATE", FAKE_RATE_LIMIT_RATE),
+                   malformed_rate=knob("FAKE_MALFORMED_RATE", FAKE_MALFORMED_RATE),
+                   retry_after=knob("FAKE_RETRY_AFTER", FAKE_RETRY_AFTER))
+
+    def stats(self):
+        return {"calls": self.calls, "errors": self.errors, "rate_limited": self.rate_limited,
+                "malformed": self.malformed}
+
+    def generate_content(self, prompt, stream=False, system_instruction=None, **kwargs):
+        with self.lock:
+            self.calls += 1
+            roll = self.random.random()
+            delay = max(0.0, self.latency * (1 + self.random.uniform(-self.jitter, self.jitter)))
+        time.sleep(delay * FAKE_FIRST_CHUNK_SHARE if stream else delay)
+
+        if roll < self.rate_limit_rate:
+            with self.lock:
+                self.rate_limited += 1
+            raise FakeAPIError(429, f"Resource has been exhausted (fake). Please retry in {self.retry_after}s.")
+        roll -= self.rate_limit_rate
+        if roll < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            raise FakeAPIError(503, "The model is overloaded (fake). Please try again later.")
+        roll -= self.error_rate
+
+        items = reply_items(prompt, system_instruction)
+        text = json.dumps(items, ensure_ascii=False)
+        if roll < self.malformed_rate:
+            with self.lock:
+                self.malformed += 1
+            if len(items) > 1 and roll < self.malformed_rate / 2:
+                del items[self.random.randrange(len(items))]           # one result missing
+                text = json.dumps(items, ensure_ascii=False)
+            else:
+                text = text[: max(1, len(text) // 2)]                   # cut off mid-reply
+        usage = FakeUsage(estimate_tokens(prompt) + (estimate_tokens(system_instruction) if system_instruction else 0),
+                          estimate_tokens(text))
+        if stream:
+            return FakeStream(text, usage, delay * (1 - FAKE_FIRST_CHUNK_SHARE))
+        return FakeResponse(text, usage)
+
+
+def _tagged_items(body):
+    """(ID, text) of the consecutively tagged items ('[1] ...', '[2] ...') in `body`."""
+    starts = []
+    for match in _TAGGED.finditer(body):
+        if int(match.group(1)) == len(starts) + 1:
+            starts.append(match)
+    return [(int(m.group(1)), body[m.end(): (starts[i + 1].start() if i + 1 < len(starts) else len(body))].strip())
+            for i, m in enumerate(starts)]
+
+
+def _sentiment(text):
+    digest = hashlib.md5(text.encode("utf-8")).digest()
+    return SENTIMENTS[digest[0] % 3], digest[1]
+
+
+def _score(sentiment, salt):
+    low, high = SCORE_RANGES.get(sentiment, (-3, 3))
+    return low + salt % (high - low + 1)
+
+
+def _translation(text):
+    return "no change" if text.isascii() else f"English translation of: {text[:40]}"
+
+
+def reply_items(prompt, system_instruction=None):
+    """
+    The JSON items a well-behaved model would return for one of the pipeline's
+    prompts, each echoing its ID. The stage is recognised from its system
+    instruction (or the prompt itself, for instructions sent inline).
+    """
+    instruction = f"{system_instruction or ''}\n{prompt}"
+    reviews = _tagged_items(prompt.split("Reviews:", 1)[-1])
+    if "sentiment scoring assistant" in instruction:
+        items = []
+        for item_id, item in reviews:
+            label = _LABEL.match(item)
+            label = label.group(1) if label else "Neutral"
+            _, salt = _sentiment(item)
+            items.append({"id": item_id, "score": _score(label, salt),
+                          "reason": f"Fake reason for a {label.lower()} review"})
+        return items
+    if "translation assistant" in instruction:
+        return [{"id": i, "translation": _translation(r)} for i, r in reviews]
+    if "sentiment analysis assistant" in instruction:
+        return [{"id": i, "sentiment": _sentiment(r)[0]} for i, r in reviews]
+    if "review analysis assistant" in instruction:
+        items = []
+        for i, r in reviews:
+            label, salt = _sentiment(r)
+            items.append({"id": i, "translation": _translation(r), "sentiment": label, "score": _score(label, salt),
+                          "reason": f"Fake reason for a {label.lower()} review"})
+        return items
+    raise FakeAPIError(400, "Fake backend does not recognise this prompt.")
+
+
+# -------------------------- FACTORY --------------------------
+class MissingAPIKey(RuntimeError):
+    """A stage that needs Gemini was started without any API key."""
+
+    def __init__(self):
+        super().__init__("GEMINI_API_KEY not found. Set it using: setx GEMINI_API_KEY 'your_key' "
+                         "(or GEMINI_API_KEYS for several keys)")
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_backend(model_name, backend=None, tier=None):
+    """
+    Backend selected by MODEL_BACKEND. For Gemini, a ClientPool over every
+    API key and the models of `tier` (client_pool.MODEL_TIERS; just
+    `model_name` if the tier isn't configured); None when no key is set so
+    callers can fall back or report it.
+    Clients are shared: every stage asking for the same tier/model in one
+    process gets the same (lazily configured) instance.
+    """
+    backend = backend or MODEL_BACKEND
+    if backend not in ("gemini", "fake"):
+        raise ValueError(f"❌ Unknown MODEL_BACKEND '{backend}' (use 'gemini' or 'fake')")
+    models = MODEL_TIERS.get(tier) or [(model_name, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE)]
+    if backend == "fake":
+        n = int(os.getenv("FAKE_KEYS", FAKE_KEYS))
+        keys = [(f"key{i + 1}", f"fake-{i + 1}") for i in range(n)]
+        models = [(model, float(os.getenv("FAKE_KEY_RPM", FAKE_KEY_RPM)), tpm) for model, _, tpm in models]
+    else:
+        keys = api_keys()
+        if not keys:
+            return None
+    key = (backend, tier or model_name, tuple(k for _, k in keys))
+    with _clients_lock:
+        if key not in _clients:
+            if backend == "fake" and len(keys) == 1:
+                _clients[key] = FakeGeminiBackend.from_env()
+            elif backend == "fake":
+                _clients[key] = ClientPool(keys, models, lambda k, m: FakeGeminiBackend.from_env(), tier or model_name)
+            else:
+                _clients[key] = ClientPool(keys, models, lambda k, m: GeminiBackend(m, k), tier or model_name)
+        return _clients[key]
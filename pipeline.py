@@ -0,0 +1,124 @@
+# pipeline.py
+# One command line for the LLM stages. Stage modules, pandas, pyarrow and the
+# Gemini client are only imported when a subcommand needs them, so --help and
+# argument errors return immediately. `run` chains several stages in one
+# process: the input is read once, every chunk flows through the stages in
+# memory sharing one model client and one response cache, and only the final
+# DataFrame is written (no intermediate files between stages).
+#
+# Usage:
+#   python pipeline.py run                                   # translate -> sentiment -> score
+#   python pipeline.py run --stages sentiment score --input reviews_translated11.parquet
+#   python pipeline.py translate --input new_reviews.parquet --output new_translated.parquet --resume
+#   python pipeline.py fused --compare reviews_scored_reasoned11.parquet
+#   python pipeline.py export reviews_scored_reasoned11.parquet reviews_scored_reasoned11.xlsx
+
+import argparse
+import importlib
+import time
+
+# -------------------------- CONFIG --------------------------
+INPUT_FILE = "amazon_book_reviews.parquet"
+OUTPUT_FILE = "reviews_scored_reasoned11.parquet"
+CHAIN = ["translate", "sentiment", "score"]       # Order the stages run in
+STAGE_MODULES = {"translate": "translated_review", "sentiment": "sentiment", "score": "score_and_reason",
+                 "fused": "fused_pipeline"}
+
+
+def stage_module(stage):
+    return importlib.import_module(STAGE_MODULES[stage])
+
+
+# -------------------------- CHAINED RUN --------------------------
+def run_chain(stages, input_file=INPUT_FILE, output_file=OUTPUT_FILE, resume=False, excel=None, chunk_rows=None):
+    """
+    Run `stages` (in CHAIN order) over `input_file` in one pass and write the
+    last stage's output to `output_file`. Each stage keeps its own journal
+    next to the output. Returns the rows written, or None if the input is unusable.
+    """
+    from metrics import METRICS
+    from model_backend import MissingAPIKey
+    from response_cache import ResponseCache
+    from review_store import CHUNK_ROWS, ChunkWriter, MissingColumns, export_excel, read_chunks
+
+    stages = [s for s in CHAIN if s in stages]
+    print(f"🔗 {' -> '.join(stages)}: '{input_file}' -> '{output_file}'")
+    cache = ResponseCache()
+    try:
+        chunks = read_chunks(input_file, chunk_rows or CHUNK_ROWS)
+        for stage in stages:
+            chunks = stage_module(stage).process_chunks(chunks, f"{output_file}.{stage}", resume, cache)
+        with ChunkWriter(output_file) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    except (MissingColumns, MissingAPIKey) as e:
+        print(f"❌ {e}")
+        return None
+    except FileNotFoundError:
+        print(f"❌ File '{input_file}' not found.")
+        return None
+    except PermissionError:
+        print(f"❌ Close '{input_file}' if open and retry.")
+        return None
+    finally:
+        cache.close()
+
+    print(f"\n✅ Done — saved {writer.rows} rows to '{output_file}'")
+    if excel:
+        export_excel(output_file, excel)
+    METRICS.finish()
+    return writer.rows
+
+
+# -------------------------- MAIN --------------------------
+def main():
+    started = time.perf_counter()
+    parser = argparse.ArgumentParser(description="Run the review pipeline stages.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    chain = commands.add_parser("run", help="several stages in one process, without intermediate files")
+    chain.add_argument("--stages", nargs="+", choices=CHAIN, default=CHAIN)
+    chain.add_argument("--input", default=INPUT_FILE)
+    chain.add_argument("--output", default=OUTPUT_FILE)
+    chain.add_argument("--chunk-rows", type=int)
+    chain.add_argument("--excel", help="optional final Excel copy")
+    chain.add_argument("--resume", action="store_true", help="continue from the stages' journals")
+
+    for stage in CHAIN:
+        single = commands.add_parser(stage, help=f"only the {stage} stage (defaults from {STAGE_MODULES[stage]}.py)")
+        single.add_argument("--input")
+        single.add_argument("--output")
+        single.add_argument("--excel")
+        single.add_argument("--resume", action="store_true")
+
+    fused = commands.add_parser("fused", help="translate, classify and score in one request per batch")
+    fused.add_argument("--input")
+    fused.add_argument("--output")
+    fused.add_argument("--excel")
+    fused.add_argument("--compare", metavar="STAGED_FILE", help="compare against the three-stage output")
+
+    export = commands.add_parser("export", help="Parquet/CSV -> Excel")
+    export.add_argument("source")
+    export.add_argument("target")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run_chain(args.stages, args.input, args.output, args.resume, args.excel, args.chunk_rows)
+    elif args.command == "export":
+        from review_store import export_excel
+        export_excel(args.source, args.target)
+    elif args.command == "fused":
+        module = stage_module("fused")
+        output = args.output or module.OUTPUT_FILE
+        if module.run(args.input or module.INPUT_FILE, output, args.excel or module.EXCEL_EXPORT) is not None \
+                and args.compare:
+            module.compare(output, args.compare)
+    else:
+        module = stage_module(args.command)
+        module.run(args.input or module.INPUT_FILE, args.output or module.OUTPUT_FILE, args.resume,
+                   args.excel or module.EXCEL_EXPORT)
+    print(f"⏱️ {time.perf_counter() - started:.1f}s total")
+
+
+if __name__ == "__main__":
+    main()
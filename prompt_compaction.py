@@ -0,0 +1,72 @@
+# prompt_compaction.py
+# Input-token reduction for the Gemini stages. Input tokens drive both cost and
+# latency, so every review is compacted before it is tagged into a prompt:
+#   - Unicode NFC, whitespace and newlines collapsed to single spaces
+#   - runs of one repeated symbol or emoji ("!!!!!!", "😍😍😍😍😍") cut to MAX_REPEAT
+#   - reviews over the stage's token cap keep their head and tail around an ellipsis
+#     (openings and conclusions carry most of a review's sentiment). Only sentiment
+#     and score truncate; translate and fused send normalize()d reviews, since their
+#     reply is the stored translation and must cover the whole review
+# The per-batch instructions live in each stage's SYSTEM_INSTRUCTION instead of
+# the prompt body. record() logs every sent review's estimated tokens before and
+# after compaction, so the saving per stage shows up in the run summary and the
+# Prometheus snapshot.
+
+import re
+import unicodedata
+
+from gemini_executor import estimate_tokens
+from metrics import METRICS
+
+# -------------------------- CONFIG --------------------------
+MAX_REVIEW_TOKENS = 400          # Default cap on estimated tokens per review (each stage sets its own)
+HEAD_SHARE = 0.7                 # Share of a truncated review kept from its start; the rest from its end
+ELLIPSIS = " […] "               # Marks where a truncated review was cut
+MAX_REPEAT = 3                   # Longest run of one repeated symbol/emoji kept
+
+_WHITESPACE = re.compile(r"\s+")
+_REPEATS = re.compile(rf"([^\w\s])\1{{{MAX_REPEAT},}}")
+
+
+def normalize(text):
+    """Single-line review text: NFC, collapsed whitespace, long symbol/emoji runs shortened."""
+    text = unicodedata.normalize("NFC", "" if text is None else str(text))
+    text = _REPEATS.sub(lambda m: m.group(1) * MAX_REPEAT, text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def truncate(text, max_tokens=MAX_REVIEW_TOKENS):
+    """Head and tail of `text` within about `max_tokens` estimated tokens, cut at word boundaries."""
+    tokens = estimate_tokens(text)
+    if not max_tokens or tokens <= max_tokens:
+        return text
+    # Characters per token differ by script, so size the cut from this text's own density
+    chars = int(len(text) * (max_tokens - estimate_tokens(ELLIPSIS)) / tokens)
+    while True:
+        head, tail = text[:int(chars * HEAD_SHARE)], text[len(text) - (chars - int(chars * HEAD_SHARE)):]
+        if " " in head.strip():
+            head = head.rsplit(" ", 1)[0]
+        if " " in tail.strip():
+            tail = tail.split(" ", 1)[1]
+        cut = f"{head.rstrip()}{ELLIPSIS}{tail.lstrip()}"
+        if estimate_tokens(cut) <= max_tokens or chars < 20:
+            return cut
+        chars = int(chars * 0.9)
+
+
+def compact(text, max_tokens=MAX_REVIEW_TOKENS):
+    """The review as it goes into a prompt (see module header)."""
+    return truncate(normalize(text), max_tokens)
+
+
+def record(stage, raw_texts, compact_texts):
+    """Per-row token accounting for the reviews one stage is about to send."""
+    raw = [estimate_tokens(t) for t in raw_texts]
+    sent = [estimate_tokens(t) for t in compact_texts]
+    truncated = sum(1 for r, c in zip(raw_texts, compact_texts) if normalize(r) != c)
+    for before, after in zip(raw, sent):
+        METRICS.observe("review_tokens", before, stage=stage, phase="raw")
+        METRICS.observe("review_tokens", after, stage=stage, phase="compact")
+    METRICS.inc("truncated_reviews_total", truncated, stage=stage)
+    METRICS.event("compaction", stage=stage, rows=len(raw), raw_tokens=sum(raw), compact_tokens=sum(sent),
+                  truncated=truncated)
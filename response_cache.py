@@ -0,0 +1,192 @@
+# response_cache.py
+# Persistent, content-addressed cache of Gemini results shared by all stages.
+# Each review is cached on its own (not per batch), keyed by a hash of
+# (stage, model name, prompt version, normalized review text), so a review that
+# lands in a different batch on the next run still hits. Size/age eviction
+# runs once when a cache that received new entries is closed (or via --evict),
+# not per chunk.
+#
+# Usage:
+#   python response_cache.py --stats
+#   python response_cache.py --clear [stage]
+#   python response_cache.py --evict
+
+import argparse
+import hashlib
+import inspect
+import json
+import re
+import sqlite3
+import time
+import unicodedata
+
+from metrics import METRICS
+
+# -------------------------- CONFIG --------------------------
+CACHE_FILE = "gemini_cache.sqlite"
+MAX_ENTRIES = 1_000_000          # Least-recently-used rows beyond this are evicted
+MAX_AGE_DAYS = 90                # Rows older than this are evicted
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+# -------------------------- KEYS --------------------------
+def normalize_text(text):
+    """Normalize review text for cache keys (Unicode NFC, collapsed whitespace)."""
+    text = unicodedata.normalize("NFC", "" if text is None else str(text))
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def prompt_version(*funcs):
+    """
+    Short hash of the source of the prompt builder(s).
+    Editing `build_prompt` changes the version, which invalidates old entries.
+    """
+    digest = hashlib.sha256()
+    for func in funcs:
+        try:
+            digest.update(inspect.getsource(func).encode("utf-8"))
+        except (OSError, TypeError):
+            digest.update(repr(func).encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+def cache_key(stage, model_name, version, text):
+    raw = "\x1f".join([stage, model_name, version, normalize_text(text)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# -------------------------- CACHE --------------------------
+class ResponseCache:
+    """SQLite-backed per-review result cache with LRU/age eviction and hit counters."""
+
+    def __init__(self, path=CACHE_FILE, max_entries=MAX_ENTRIES, max_age_days=MAX_AGE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0                # entries written since opening; close() evicts if any
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key        TEXT PRIMARY KEY,
+                stage      TEXT NOT NULL,
+                value      TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                used_at    REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_used ON responses(used_at)")
+        self.conn.commit()
+
+    def get_many(self, keys):
+        """Return {key: value} for every cached key and update hit/miss counters."""
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, value FROM responses WHERE key IN ({marks})", chunk
+            ).fetchall()
+            found.update({k: json.loads(v) for k, v in rows})
+        if found:
+            now = time.time()
+            self.conn.executemany("UPDATE responses SET used_at = ? WHERE key = ?",
+                                  [(now, k) for k in found])
+            self.conn.commit()
+        self.hits += sum(1 for k in keys if k in found)
+        self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, stage, items):
+        """Store {key: value} results for `stage`."""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO responses (key, stage, value, created_at, used_at) VALUES (?, ?, ?, ?, ?)",
+            [(k, stage, json.dumps(v, ensure_ascii=False), now, now) for k, v in items.items()],
+        )
+        self.conn.commit()
+        self.puts += len(items)
+
+    def evict(self):
+        """Drop entries older than `max_age_days` and trim to `max_entries` (LRU). Returns rows removed."""
+        before = self.conn.total_changes
+        cutoff = time.time() - self.max_age_days * 86400
+        self.conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,))
+        self.conn.execute("""
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY used_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+        self.conn.commit()
+        return self.conn.total_changes - before
+
+    def invalidate(self, stage=None):
+        """Remove every entry, or only those of one stage. Returns rows removed."""
+        if stage is None:
+            cur = self.conn.execute("DELETE FROM responses")
+        else:
+            cur = self.conn.execute("DELETE FROM responses WHERE stage = ?", (stage,))
+        self.conn.commit()
+        return cur.rowcount
+
+    def stats(self):
+        rows = self.conn.execute("SELECT stage, COUNT(*) FROM responses GROUP BY stage").fetchall()
+        return {"hits": self.hits, "misses": self.misses, "entries": dict(rows)}
+
+    def close(self):
+        """Evict (if this run added entries) and close the database."""
+        if self.puts:
+            self.evict()
+            self.puts = 0
+        self.conn.close()
+
+
+# -------------------------- STAGE HELPER --------------------------
+def run_cached(cache, stage, model_name, version, texts, run, is_valid=lambda value: True):
+    """
+    Resolve one result per text, calling `run(positions)` only for cache misses.
+    `run` receives the list of positions to compute and must return one result
+    per position, in order. Results accepted by `is_valid` are written back.
+    """
+    keys = [cache_key(stage, model_name, version, t) for t in texts]
+    found = cache.get_many(keys)
+    todo = [i for i, k in enumerate(keys) if k not in found]
+    print(f"💾 Cache ({stage}): {len(texts) - len(todo)} hits, {len(todo)} to request")
+    METRICS.inc("cache_hits_total", len(texts) - len(todo), stage=stage)
+    METRICS.inc("cache_misses_total", len(todo), stage=stage)
+    METRICS.event("cache", stage=stage, hits=len(texts) - len(todo), misses=len(todo))
+
+    fresh = run(todo) if todo else []
+    cache.put_many(stage, {keys[i]: value for i, value in zip(todo, fresh) if is_valid(value)})
+
+    results = [found.get(k) for k in keys]
+    for i, value in zip(todo, fresh):
+        results[i] = value
+    return results
+
+
+# -------------------------- CLI --------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or maintain the Gemini response cache.")
+    parser.add_argument("--db", default=CACHE_FILE, help="cache file (default: %(default)s)")
+    parser.add_argument("--stats", action="store_true", help="show entry counts per stage")
+    parser.add_argument("--clear", nargs="?", const="*", metavar="STAGE", help="remove all entries or one stage")
+    parser.add_argument("--evict", action="store_true", help="apply size/age eviction now")
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.db)
+    if args.clear:
+        removed = cache.invalidate(None if args.clear == "*" else args.clear)
+        print(f"🧹 Removed {removed} cached responses")
+    if args.evict:
+        print(f"🧹 Evicted {cache.evict()} cached responses")
+    print(f"📊 {cache.stats()['entries']}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+# review_scraper.py
+# Async Playwright scraper engine for many products per run.
+# One long-lived headless Chromium serves a pool of browser contexts; a queue
+# of product URLs/ASINs is drained by a bounded number of workers, each running
+# scrape_book_reviews on its own page. Every review page is crawled newest
+# first and records stream straight into the Parquet review store that
+# translated_review.py reads; a per-product watermark stops re-crawls at the
+# first review already stored, so scheduled runs only fetch new reviews.
+# New reviews are appended to the store, and a product's watermark only
+# advances once the store file is complete and its crawl reached a known review
+# or the last page; a crawl cut short is fetched again next time.
+# `--full` ignores the watermarks and re-crawls every page; the stored copies of
+# the reviews it finds are replaced and every other stored review is kept.
+#
+# Usage:
+#   python review_scraper.py B0CHRJ7F3L B08XYZ1234 --concurrency 4
+#   python review_scraper.py --file products.txt
+#   python review_scraper.py --file products.txt --snapshot-only   # raw HTML only, parse later
+
+import argparse
+import asyncio
+import os
+import re
+from contextlib import asynccontextmanager
+from urllib.parse import quote_plus
+
+import pandas as pd
+from playwright.async_api import async_playwright
+
+from review_store import ChunkWriter, read_chunks
+from scrape_helpers import COLUMNS, EXTRACT_REVIEWS_JS, REVIEW_IDS_JS, PageTimer, block_resources_async, parse_rating
+from snapshot_store import SnapshotStore
+from watermarks import PendingWatermarks, Watermarks
+
+# -------------------------- CONFIG --------------------------
+BASE_URL = "https://www.amazon.in"
+OUTPUT_FILE = "amazon_book_reviews.parquet"
+CONCURRENCY = 4                  # Pages scraping at once
+CONTEXTS = 2                     # Browser contexts (cookie jars) shared by the workers
+NAV_TIMEOUT = 60000              # ms
+HEADLESS = True
+BLOCK_RESOURCES = True           # Skip images, media, fonts and trackers
+
+REVIEWS_URL = "{base}/product-reviews/{asin}?sortBy=recent&pageNumber={page}"
+SEARCH_URL = "{base}/s?k={query}&i=stripbooks"
+SEARCH_RESULTS = 10              # Products taken from the first search results page
+MAX_PAGES = 100                  # Safety cap on review pages per product
+FLUSH_ROWS = 50                  # Reviews buffered before each write
+
+_ASIN = re.compile(r"^[A-Z0-9]{10}$")
+_ASIN_IN_URL = re.compile(r"/(?:dp|gp/product|product-reviews)/([A-Z0-9]{10})")
+
+
+def product_url(product):
+    """Accept an ASIN or a full product URL."""
+    product = product.strip()
+    if _ASIN.match(product):
+        return f"{BASE_URL}/dp/{product}"
+    return product
+
+
+# -------------------------- BROWSER POOL --------------------------
+class BrowserPool:
+    """One headless browser, a few contexts, and at most `concurrency` open pages.
+    Images, media, fonts and trackers are blocked on every context unless `block` is False."""
+
+    def __init__(self, concurrency=CONCURRENCY, contexts=CONTEXTS, headless=HEADLESS, block=BLOCK_RESOURCES):
+        self.concurrency = concurrency
+        self.block = block
+        self.n_contexts = contexts
+        self.headless = headless
+        self.playwright = None
+        self.browser = None
+        self.contexts = []
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self._next = 0
+
+    async def start(self):
+        self.playwright = await async_playwright().start()
+        self.browser = await self.playwright.chromium.launch(headless=self.headless)
+        self.contexts = [await self.browser.new_context() for _ in range(self.n_contexts)]
+        if self.block:
+            for context in self.contexts:
+                await block_resources_async(context)
+        return self
+
+    async def close(self):
+        for context in self.contexts:
+            await context.close()
+        if self.browser:
+            await self.browser.close()
+        if self.playwright:
+            await self.playwright.stop()
+
+    @asynccontextmanager
+    async def page(self):
+        """A fresh page from the next context, closed when the block ends."""
+        async with self.semaphore:
+            context = self.contexts[self._next % len(self.contexts)]
+            self._next += 1
+            page = await context.new_page()
+            try:
+                yield page
+            finally:
+                await page.close()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+# -------------------------- SCRAPING --------------------------
+def product_asin(product):
+    """ASIN of an ASIN or product URL (None if it can't be found)."""
+    product = product.strip()
+    if _ASIN.match(product):
+        return product
+    match = _ASIN_IN_URL.search(product)
+    return match.group(1) if match else None
+
+
+async def _page_reviews(page):
+    """All reviews on the current page in a single round trip, plus whether there is a next page."""
+    data = await page.evaluate(EXTRACT_REVIEWS_JS)
+    reviews = [
+        {"review_id": r["review_id"], "review_text": r["review_text"], "review_date": r["review_date"],
+         "rating": parse_rating(r["rating_text"])}
+        for r in data["reviews"]
+    ]
+    return reviews, data["has_next"]
+
+
+async def crawl_reviews(page, asin, seen=(), max_pages=MAX_PAGES, timer=None, snapshots=None, title=None,
+                        status=None):
+    """
+    Async generator over every review page of a product, newest first.
+    Yields review dicts (review_id, review_date, review_text, rating) and stops
+    at the first review ID in `seen` (the product's watermark).
+    With `snapshots`, each page's raw HTML is archived instead and only review
+    IDs are yielded; snapshot_parser.py extracts the rest offline.
+    `status["complete"]` is set True only when the crawl reached a known review
+    or the last page (not on a page that never loaded or at `max_pages`).
+    """
+    status = {} if status is None else status
+    status["complete"] = False
+    for page_number in range(1, max_pages + 1):
+        clock = (timer or PageTimer()).page()
+        await page.goto(REVIEWS_URL.format(base=BASE_URL, asin=asin, page=page_number),
+                        timeout=NAV_TIMEOUT, wait_until="domcontentloaded")
+        clock.lap("navigate")
+        try:
+            await page.wait_for_selector("div[id^='customer_review']", timeout=30000)
+        except Exception:
+            print(f"⚠️ {asin}: review page {page_number} did not load; crawl incomplete")
+            return
+        clock.lap("wait")
+        if snapshots is not None:
+            snapshots.put(await page.content(), kind="reviews", product=asin, title=title, page=page_number,
+                          url=page.url)
+            data = await page.evaluate(REVIEW_IDS_JS)
+            reviews, has_next = [{"review_id": i} for i in data["ids"]], data["has_next"]
+            clock.lap("snapshot")
+        else:
+            reviews, has_next = await _page_reviews(page)
+            clock.lap("extract")
+        for review in reviews:
+            if review["review_id"] in seen:
+                print(f"⏹️ {asin}: reached known review {review['review_id']} on page {page_number}")
+                status["complete"] = True
+                return
+            yield review
+        if not has_next:
+            status["complete"] = True
+            return
+    print(f"⚠️ {asin}: stopped at MAX_PAGES={max_pages}; crawl incomplete")
+
+
+async def scrape_book_reviews(page, product, watermarks=None, sink=None, timer=None, snapshots=None):
+    """
+    Crawl all new reviews of one product into `sink(DataFrame)`, page by page.
+    The product's watermark is only given the new review IDs if the crawl was
+    complete; pass a PendingWatermarks and commit it once the sink's file is
+    closed. Returns the count.
+    With `snapshots`, pages are archived as raw HTML and nothing is sent to `sink`.
+    """
+    asin = product_asin(product)
+    if asin is None:
+        print(f"⚠️ No ASIN in '{product}', skipping.")
+        return 0
+
+    await page.goto(product_url(asin), timeout=NAV_TIMEOUT, wait_until="domcontentloaded")
+    await page.wait_for_selector("#productTitle", timeout=30000)
+    title = (await page.inner_text("#productTitle")).strip()
+    print(f"📖 {title}")
+    if snapshots is not None:
+        snapshots.put(await page.content(), kind="product", product=asin, title=title, url=page.url)
+
+    seen = watermarks.seen(asin) if watermarks else set()
+    buffer, crawled = [], []
+    status = {}
+
+    def flush():
+        nonlocal buffer
+        if buffer:
+            if sink and snapshots is None:
+                frame = pd.DataFrame([{"book_title": title, "product": asin, **r} for r in buffer], columns=COLUMNS)
+                frame["rating"] = pd.to_numeric(frame["rating"], errors="coerce")
+                sink(frame)
+            crawled.extend({"review_id": r["review_id"], "review_date": r.get("review_date")} for r in buffer)
+            buffer = []
+
+    async for review in crawl_reviews(page, asin, seen, timer=timer, snapshots=snapshots, title=title,
+                                      status=status):
+        buffer.append(review)
+        if len(buffer) >= FLUSH_ROWS:
+            flush()
+    flush()
+    if watermarks and status["complete"]:
+        watermarks.add(asin, crawled)
+    print(f"✅ {title}: {len(crawled)} new reviews" + ("" if status["complete"] else " (watermark not advanced)"))
+    return len(crawled)
+
+
+async def _worker(pool, queue, watermarks, sink, timer, snapshots):
+    while True:
+        product = await queue.get()
+        try:
+            async with pool.page() as page:
+                await scrape_book_reviews(page, product, watermarks, sink, timer, snapshots)
+        except Exception as e:
+            print(f"⚠️ Failed to scrape {product}: {e}")
+        finally:
+            queue.task_done()
+
+
+async def scrape_products(products, sink, watermarks=None, concurrency=CONCURRENCY, contexts=CONTEXTS,
+                          snapshots=None):
+    """Drain a queue of products with `concurrency` workers sharing one browser."""
+    queue = asyncio.Queue()
+    for product in products:
+        queue.put_nowait(product)
+
+    timer = PageTimer()
+    async with BrowserPool(concurrency, contexts) as pool:
+        workers = [asyncio.create_task(_worker(pool, queue, watermarks, sink, timer, snapshots)) for _ in range(concurrency)]
+        await queue.join()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    timer.report()
+
+
+def stored_reviews(path):
+    """(product, review_id) pairs already in the review store at `path`, so re-crawled reviews aren't appended twice."""
+    if not os.path.exists(path):
+        return set()
+    import pyarrow.parquet as pq
+    names = pq.ParquetFile(path).schema_arrow.names
+    if "product" not in names or "review_id" not in names:
+        return set()
+    table = pq.read_table(path, columns=["product", "review_id"])
+    return set(zip(table.column("product").to_pylist(), table.column("review_id").to_pylist()))
+
+
+def merge_full_crawl(path, crawl_path):
+    """Replace the reviews in `path` that a full re-crawl (`crawl_path`) fetched again; all others are kept."""
+    if not os.path.exists(path):
+        os.replace(crawl_path, path)
+        return
+    recrawled = stored_reviews(crawl_path)
+    with ChunkWriter(path) as writer:          # writes a temp file; `path` is only replaced once complete
+        for chunk in read_chunks(path):
+            writer.write(chunk[[(p, r) not in recrawled for p, r in zip(chunk["product"], chunk["review_id"])]])
+        for chunk in read_chunks(crawl_path):
+            writer.write(chunk)
+    os.remove(crawl_path)
+
+
+async def search_products(page, query, limit=SEARCH_RESULTS):
+    """ASINs of the first `limit` book search results for `query`, in result order."""
+    await page.goto(SEARCH_URL.format(base=BASE_URL, query=quote_plus(query)), timeout=NAV_TIMEOUT,
+                    wait_until="domcontentloaded")
+    await page.wait_for_selector("div.s-main-slot", timeout=30000)
+    asins = await page.eval_on_selector_all(
+        "div.s-main-slot div[data-component-type='s-search-result'][data-asin]",
+        "els => els.map(el => el.getAttribute('data-asin'))",
+    )
+    return list(dict.fromkeys(a for a in asins if a and _ASIN.match(a)))[:limit]
+
+
+# -------------------------- MAIN --------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Scrape Amazon reviews for many products concurrently.")
+    parser.add_argument("products", nargs="*", help="ASINs or product URLs")
+    parser.add_argument("--file", help="text file with one ASIN/URL per line")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="review store; new reviews are appended")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--full", action="store_true",
+                        help="ignore the watermarks, re-crawl every page and refresh the reviews found")
+    parser.add_argument("--snapshot-only", action="store_true",
+                        help="archive raw page HTML for snapshot_parser.py instead of extracting reviews")
+    args = parser.parse_args()
+
+    products = list(args.products)
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            products += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if not products:
+        parser.error("give at least one ASIN/URL or --file")
+
+    watermarks = Watermarks()
+    # New IDs are only recorded once the archive/store holding their reviews is complete
+    pending = PendingWatermarks(watermarks, ignore_seen=args.full)
+
+    print(f"🛒 Scraping {len(products)} products ({args.concurrency} at a time)...")
+    try:
+        if args.snapshot_only:
+            snapshots = SnapshotStore()
+            asyncio.run(scrape_products(products, None, pending, concurrency=args.concurrency,
+                                        snapshots=snapshots))
+            pending.commit()
+            print(f"\n🗂️ Archived pages to '{snapshots.root}'; run snapshot_parser.py to extract reviews")
+            return
+        if args.full:
+            crawl_path = args.output + ".full.parquet"
+            with ChunkWriter(crawl_path) as writer:
+                asyncio.run(scrape_products(products, writer.write, pending, concurrency=args.concurrency))
+            if writer.rows:
+                merge_full_crawl(args.output, crawl_path)
+            pending.commit()
+            print(f"\n💾 Refreshed {writer.rows} re-crawled reviews in '{args.output}'")
+            return
+        stored = stored_reviews(args.output)
+
+        def append(frame):
+            fresh = [(p, r) not in stored for p, r in zip(frame["product"], frame["review_id"])]
+            if any(fresh):
+                writer.write(frame[fresh])
+
+        with ChunkWriter(args.output, append=True) as writer:
+            asyncio.run(scrape_products(products, append, pending, concurrency=args.concurrency))
+        pending.commit()
+    finally:
+        watermarks.close()
+    print(f"\n💾 Added {writer.rows} new reviews to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
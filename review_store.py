@@ -0,0 +1,209 @@
+# review_store.py
+# Columnar intermediate store shared by the pipeline stages.
+# Stages read their input as an iterator of bounded-size DataFrame chunks and
+# append their output as Parquet row groups, so peak memory stays flat as the
+# dataset grows. Excel is only produced by an optional final export.
+# pandas and pyarrow are imported on first use, so importing the stages stays cheap.
+#
+# Usage:
+#   python review_store.py import amazon_book_reviews.xlsx amazon_book_reviews.parquet
+#   python review_store.py export reviews_scored_reasoned11.parquet reviews_scored_reasoned11.xlsx
+
+import argparse
+import os
+import time
+
+from metrics import METRICS
+
+# -------------------------- CONFIG --------------------------
+CHUNK_ROWS = 5_000               # Rows per chunk / Parquet row group
+INTEGER_COLUMNS = ("row_id", "dup_group", "review_id")   # ID columns kept as integers; other ints are stored as float64
+
+
+def _require_pyarrow():
+    """(pyarrow, pyarrow.parquet); pyarrow is only needed for .parquet files."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("❌ pyarrow is required for Parquet files. Install it with: pip install pyarrow") from None
+    return pa, pq
+
+
+class MissingColumns(ValueError):
+    """An input file lacks a column a stage needs."""
+
+
+def require_columns(chunk, columns):
+    """Raise MissingColumns unless every one of `columns` is in `chunk`."""
+    missing = [col for col in columns if col not in chunk.columns]
+    if missing:
+        raise MissingColumns(f"Input file must contain these columns: {', '.join(missing)}")
+
+
+# -------------------------- READING --------------------------
+def read_chunks(path, chunk_rows=CHUNK_ROWS):
+    """
+    Yield the rows of `path` as DataFrames of at most `chunk_rows` rows.
+    Parquet and CSV are streamed; Excel has no streaming reader so it is loaded
+    once and sliced (convert it with `python review_store.py import` first).
+    Time spent reading is recorded as io_seconds{op="read"}.
+    """
+    chunks = _read_chunks(path, chunk_rows)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        seconds = time.perf_counter() - start
+        if chunk is None:
+            return
+        METRICS.observe("io_seconds", seconds, op="read", file=path)
+        METRICS.event("io", op="read", file=path, rows=len(chunk), seconds=round(seconds, 4))
+        yield chunk
+
+
+def _read_chunks(path, chunk_rows):
+    import pandas as pd
+    if path.endswith(".parquet"):
+        _, pq = _require_pyarrow()
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    elif path.endswith(".csv"):
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+    else:
+        df = pd.read_excel(path)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows].reset_index(drop=True)
+
+
+def count_rows(path):
+    """Row count without loading the data (Parquet metadata), or None if unknown."""
+    if not path.endswith(".parquet"):
+        return None
+    try:
+        _, pq = _require_pyarrow()
+    except ImportError:
+        return None
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def read_all(path):
+    """Load a whole file into one DataFrame (for small outputs and comparisons)."""
+    import pandas as pd
+    chunks = list(read_chunks(path))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+
+# -------------------------- WRITING --------------------------
+class ChunkWriter:
+    """
+    Appends DataFrame chunks to a Parquet file as row groups.
+    The schema is fixed by the first chunk, widened so later chunks still fit:
+    all-null columns are stored as strings, and integer columns (other than
+    INTEGER_COLUMNS) as float64, since a later chunk may hold fractions or NaN.
+    With `append`, an existing file's row groups are copied first under its
+    (widened) schema; if nothing is written the file is left untouched.
+    """
+
+    def __init__(self, path, append=False):
+        self.pa, self.pq = _require_pyarrow()
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.append = append and os.path.exists(path)
+        self.writer = None
+        self.schema = None
+        self.rows = 0                # rows written by this writer (not counting appended-to ones)
+
+    def _widen(self, field):
+        pa = self.pa
+        if pa.types.is_null(field.type):
+            return field.with_type(pa.string())
+        if pa.types.is_integer(field.type) and field.name not in INTEGER_COLUMNS:
+            return field.with_type(pa.float64())
+        return field
+
+    def _open(self, chunk):
+        pa, pq = self.pa, self.pq
+        if self.append:
+            existing = pq.ParquetFile(self.path)
+            self.schema = pa.schema([self._widen(field) for field in existing.schema_arrow],
+                                    metadata=existing.schema_arrow.metadata)
+            self.writer = pq.ParquetWriter(self.tmp_path, self.schema)
+            for i in range(existing.num_row_groups):
+                self.writer.write_table(existing.read_row_group(i).cast(self.schema))
+            return
+        schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+        self.schema = pa.schema([self._widen(field) for field in schema], metadata=schema.metadata)
+        self.writer = pq.ParquetWriter(self.tmp_path, self.schema)
+
+    def write(self, chunk):
+        pa = self.pa
+        if self.writer is None:
+            self._open(chunk)
+        for field in self.schema:
+            if pa.types.is_string(field.type) and chunk[field.name].dtype != object:
+                col = chunk[field.name]
+                chunk = chunk.assign(**{field.name: col.astype(object).where(col.notna(), None).map(
+                    lambda v: v if v is None else str(v))})
+        with METRICS.timer("io_seconds", op="write", file=self.path):
+            table = pa.Table.from_pandas(chunk, schema=self.schema, preserve_index=False)
+            self.writer.write_table(table)
+        self.rows += len(chunk)
+
+    def close(self):
+        """Finish the file; it only replaces `path` once complete."""
+        if self.writer is not None:
+            self.writer.close()
+            os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self.writer is not None:
+            self.writer.close()
+        return False
+
+
+# -------------------------- EXCEL EXPORT --------------------------
+def export_excel(path, excel_path):
+    """Optional final step: write a Parquet/CSV file out as .xlsx."""
+    try:
+        with METRICS.timer("io_seconds", op="export", file=excel_path):
+            read_all(path).to_excel(excel_path, index=False, engine="openpyxl")
+        print(f"📄 Exported '{path}' to '{excel_path}'")
+    except PermissionError:
+        print(f"❌ Close '{excel_path}' if it's open and re-run.")
+    except Exception as e:
+        print(f"⚠️ Unexpected error while exporting '{excel_path}': {e}")
+
+
+def import_file(path, parquet_path, chunk_rows=CHUNK_ROWS):
+    """Convert an Excel/CSV input into the Parquet store format."""
+    with ChunkWriter(parquet_path) as writer:
+        for chunk in read_chunks(path, chunk_rows):
+            writer.write(chunk)
+    print(f"📦 Imported {writer.rows} rows from '{path}' into '{parquet_path}'")
+
+
+# -------------------------- CLI --------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Convert between Excel/CSV and the Parquet review store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="Excel/CSV -> Parquet")
+    imp.add_argument("source")
+    imp.add_argument("target")
+    exp = sub.add_parser("export", help="Parquet -> Excel")
+    exp.add_argument("source")
+    exp.add_argument("target")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        import_file(args.source, args.target)
+    else:
+        export_excel(args.source, args.target)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# scheduler.py
+# Multi-product job scheduler on top of the durable queue in job_queue.py.
+# Jobs are products (ASINs, product URLs or search queries) flowing through
+#   search -> scrape -> translate -> sentiment -> score
+# with every stage run by its own pool of worker processes. Each product run
+# gets its own directory of stage files, so nothing shares the hard-coded
+# INPUT_FILE/OUTPUT_FILE names of the single-file scripts.
+#
+# Review-ID dedup across runs: the scrape watermarks live in the queue DB, so a
+# re-queued product only yields reviews no earlier run has stored, and a product
+# is never queued twice at a stage while it still has an open job there.
+#
+# Several machines can drain the same queue: point them at one DB file (and one
+# JOBS_DIR) on shared storage, with JOB_QUEUE_JOURNAL_MODE=DELETE if that is a
+# network share. Gemini RPM/TPM limits are split across every worker on one
+# machine that uses the same model tier (translate and sentiment share "light"
+# and its key slots); give each machine its own key or lower the limits.
+#
+# Usage:
+#   python scheduler.py add B0CHRJ7F3L https://www.amazon.in/dp/B08XYZ1234
+#   python scheduler.py add --search "white nights dostoyevsky" --file products.txt
+#   python scheduler.py work --workers scrape=2 translate=4 sentiment=2 score=2
+#   python scheduler.py work --stages translate sentiment --drain      # exit once upstream is empty
+#   python scheduler.py status
+#   python scheduler.py retry --stage score
+
+import argparse
+import asyncio
+import importlib
+import multiprocessing
+import os
+import threading
+import time
+
+import client_pool
+from job_queue import LEASE_SECONDS, QUEUE_FILE, STAGES, JobQueue, worker_id
+
+# -------------------------- CONFIG --------------------------
+JOBS_DIR = "jobs"                # jobs/<ASIN>/run<N>/<stage>.parquet
+WORKERS = {"search": 1, "scrape": 2, "translate": 2, "sentiment": 2, "score": 2}
+POLL_SECONDS = 5                 # Idle wait between claim attempts
+STAGE_MODULES = {"translate": "translated_review", "sentiment": "sentiment", "score": "score_and_reason"}
+STAGE_FILES = {"scrape": "reviews", "translate": "translated", "sentiment": "sentiment", "score": "scored"}
+
+
+def run_file(product, run, stage):
+    path = os.path.join(JOBS_DIR, product, f"run{run:06d}", STAGE_FILES[stage] + ".parquet")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+# -------------------------- STAGE HANDLERS --------------------------
+# Each handler takes a claimed job and returns (output_file, rows, follow_ups);
+# output_file None means the product stops here (e.g. no new reviews).
+class _Browser:
+    """One event loop and headless browser per scrape/search worker, started on first use."""
+
+    def __init__(self):
+        self.loop = None
+        self.pool = None
+
+    def run(self, work):
+        from review_scraper import BrowserPool
+        if self.pool is None:
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.pool = self.loop.run_until_complete(BrowserPool(concurrency=1, contexts=1).start())
+
+        async def on_page():
+            async with self.pool.page() as page:
+                return await work(page)
+        return self.loop.run_until_complete(on_page())
+
+    def close(self):
+        if self.pool is not None:
+            self.loop.run_until_complete(self.pool.close())
+            self.loop.close()
+
+
+def search_job(job, ctx):
+    from review_scraper import search_products
+    asins = ctx["browser"].run(lambda page: search_products(page, job["product"]))
+    print(f"🔎 '{job['product']}': {len(asins)} products")
+    return None, len(asins), [(asin, "scrape") for asin in asins]
+
+
+def scrape_job(job, ctx):
+    from review_scraper import product_asin, scrape_book_reviews
+    from review_store import ChunkWriter
+    from watermarks import PendingWatermarks, Watermarks
+
+    asin = product_asin(job["product"])
+    if asin is None:
+        raise ValueError(f"no ASIN in '{job['product']}'")
+    output = run_file(asin, job["id"], "scrape")
+    marks = Watermarks(ctx["db"])
+    pending = PendingWatermarks(marks)     # a crashed attempt can't hide reviews from its retry
+    try:
+        with ChunkWriter(output) as writer:
+            ctx["browser"].run(lambda page: scrape_book_reviews(page, asin, pending, writer.write))
+        pending.commit()
+    finally:
+        marks.close()
+    return (output if writer.rows else None), writer.rows, []
+
+
+def llm_job(job, ctx):
+    module = ctx["module"]
+    output = os.path.join(os.path.dirname(job["input_file"]), STAGE_FILES[job["stage"]] + ".parquet")
+    rows = module.run(job["input_file"], output, resume=job["attempts"] > 1, excel=None)
+    if rows is None:
+        raise ValueError(f"unusable input file '{job['input_file']}'")
+    return (output if rows else None), rows, []
+
+
+HANDLERS = {"search": search_job, "scrape": scrape_job, "translate": llm_job, "sentiment": llm_job, "score": llm_job}
+
+
+# -------------------------- WORKERS --------------------------
+class _Heartbeat(threading.Thread):
+    """Renews the job's lease every third of LEASE_SECONDS while the handler runs."""
+
+    def __init__(self, db, job):
+        super().__init__(daemon=True)
+        self.db = db
+        self.job = job
+        self.stopped = threading.Event()
+
+    def run(self):
+        queue = JobQueue(self.db)
+        try:
+            while not self.stopped.wait(LEASE_SECONDS / 3):
+                if not queue.renew(self.job["id"], self.job["owner"]):
+                    print(f"⚠️ Lost the lease on job {self.job['id']}; its result will be discarded")
+                    return
+        finally:
+            queue.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def work(stage, db=QUEUE_FILE, share=1, drain=False):
+    """Claim and run `stage` jobs until interrupted (or, with `drain`, until this and earlier stages are empty)."""
+    owner = worker_id()
+    queue = JobQueue(db)
+    ctx = {"db": db}
+    if stage in STAGE_MODULES:
+        module = importlib.import_module(STAGE_MODULES[stage])
+        # The stage's quota (and each pooled key's) is per process; split it across this machine's workers
+        # on the same model tier (see tier_shares).
+        module.REQUESTS_PER_MINUTE = module.REQUESTS_PER_MINUTE / share
+        module.TOKENS_PER_MINUTE = module.TOKENS_PER_MINUTE / share
+        client_pool.QUOTA_SHARE = 1 / share
+        ctx["module"] = module
+    else:
+        ctx["browser"] = _Browser()
+    upstream = STAGES[:STAGES.index(stage) + 1]
+    print(f"👷 {owner} working on '{stage}'")
+    try:
+        while True:
+            job = queue.claim(stage, owner)
+            if job is None:
+                if drain and not queue.open_jobs(upstream):
+                    break
+                time.sleep(POLL_SECONDS)
+                continue
+            print(f"▶️ Job {job['id']}: {stage} {job['product']} (attempt {job['attempts']})")
+            heartbeat = _Heartbeat(db, job)
+            heartbeat.start()
+            try:
+                output, rows, follow_ups = HANDLERS[stage](job, ctx)
+            except Exception as e:
+                heartbeat.stop()
+                final = queue.fail(job, f"{type(e).__name__}: {e}")
+                print(f"{'❌' if final else '🔁'} Job {job['id']} failed: {e}")
+                continue
+            heartbeat.stop()
+            if queue.complete(job, output, rows, follow_ups):
+                print(f"✅ Job {job['id']}: {stage} {job['product']} -> {rows} rows")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if "browser" in ctx:
+            ctx["browser"].close()
+        queue.close()
+
+
+def parse_workers(specs):
+    """['scrape=2', 'score=1'] -> {'scrape': 2, 'score': 1} on top of WORKERS."""
+    workers = dict(WORKERS)
+    for spec in specs or []:
+        stage, _, n = spec.partition("=")
+        if stage not in STAGES or not n.isdigit():
+            raise ValueError(f"bad --workers entry '{spec}' (expected <stage>=<n>, stage one of {STAGES})")
+        workers[stage] = int(n)
+    return workers
+
+
+def tier_shares(stages, workers):
+    """
+    {stage: number of workers drawing on its model tier's quota}. Stages on one
+    tier (translate and sentiment on "light") use the same key slots, so their
+    workers split one quota between them rather than each stage having its own.
+    """
+    tiers = {stage: importlib.import_module(STAGE_MODULES[stage]).MODEL_TIER
+             for stage in stages if stage in STAGE_MODULES and workers[stage]}
+    totals = {}
+    for stage, tier in tiers.items():
+        totals[tier] = totals.get(tier, 0) + workers[stage]
+    return {stage: totals[tier] for stage, tier in tiers.items()}
+
+
+def run_workers(stages, workers, db=QUEUE_FILE, drain=False):
+    """Start workers[stage] processes for each stage and wait for them."""
+    shares = tier_shares(stages, workers)
+    processes = [
+        multiprocessing.Process(target=work, args=(stage, db, shares.get(stage, workers[stage]), drain),
+                                name=f"{stage}-{i}")
+        for stage in stages for i in range(workers[stage])
+    ]
+    print(f"🚀 Starting {len(processes)} workers: " + ", ".join(f"{s}×{workers[s]}" for s in stages if workers[s]))
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping workers; running jobs return to the queue when their lease expires")
+        for process in processes:
+            process.join()
+
+
+# -------------------------- MAIN --------------------------
+def print_status(queue, failed=False):
+    counts = queue.counts()
+    print(f"{'stage':<10}" + "".join(f"{s:>10}" for s in ("pending", "running", "done", "failed")))
+    for stage in STAGES:
+        row = counts.get(stage, {})
+        print(f"{stage:<10}" + "".join(f"{row.get(s, 0):>10}" for s in ("pending", "running", "done", "failed")))
+    if failed:
+        for job in queue.jobs("failed"):
+            print(f"❌ {job['id']} {job['stage']} {job['product']} ({job['attempts']} attempts): {job['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue products and run the pipeline stages with parallel workers.")
+    parser.add_argument("--db", default=QUEUE_FILE, help="queue database (share it to scale out)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="queue products for scraping")
+    add.add_argument("products", nargs="*", help="ASINs or product URLs")
+    add.add_argument("--file", help="text file with one ASIN/URL per line")
+    add.add_argument("--search", action="append", default=[], help="search query whose results are queued")
+
+    worker = commands.add_parser("work", help="run worker processes")
+    worker.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    worker.add_argument("--workers", nargs="+", metavar="STAGE=N", help=f"processes per stage (default {WORKERS})")
+    worker.add_argument("--drain", action="store_true", help="exit when there is nothing left to do")
+
+    status = commands.add_parser("status", help="job counts per stage")
+    status.add_argument("--failed", action="store_true", help="list failed jobs and their errors")
+
+    retry = commands.add_parser("retry", help="re-queue failed jobs")
+    retry.add_argument("--stage", choices=STAGES)
+    args = parser.parse_args()
+
+    if args.command == "work":
+        try:
+            workers = parse_workers(args.workers)
+        except ValueError as e:
+            parser.error(str(e))
+        run_workers(args.stages, workers, args.db, args.drain)
+        return
+
+    queue = JobQueue(args.db)
+    try:
+        if args.command == "add":
+            products = list(args.products)
+            if args.file:
+                with open(args.file, encoding="utf-8") as f:
+                    products += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+            if not products and not args.search:
+                parser.error("give at least one ASIN/URL, --file or --search")
+            if products:
+                from review_scraper import product_asin
+                products = [product_asin(p) or p for p in products]   # one queue key per product
+            jobs = [(p, "scrape") for p in products] + [(q, "search") for q in args.search]
+            added = [queue.add(product, stage) for product, stage in jobs]
+            print(f"📥 Queued {sum(a is not None for a in added)} jobs "
+                  f"({added.count(None)} already queued) in '{args.db}'")
+        elif args.command == "status":
+            print_status(queue, args.failed)
+        elif args.command == "retry":
+            print(f"🔁 Re-queued {queue.retry_failed(args.stage)} failed jobs")
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
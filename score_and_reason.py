@@ -1,134 +1,221 @@
 # gemini_sentiment_score_with_reason_updated.py
-# Reads Excel file with sentiment info, scores it (-10 to +10),
-# adds reasons for each score using Gemini, and saves a new Excel file.
-
-import os
-import time
-import json
-import pandas as pd
-import google.generativeai as genai
+# Reads reviews with sentiment info in chunks, scores them (-10 to +10),
+# adds reasons for each score using Gemini, appends each chunk to a Parquet
+# file and exports the final result to Excel.
+
+from checkpoint import Journal, arg_parser, is_complete, journal_path, resume_rows, row_key
+from client_pool import executor_limits
+from gemini_executor import MalformedResponse, estimate_tokens, pack_batches, run_batches
+from json_stream import response_config, stream_by_id, tag
+from metrics import METRICS
+from model_backend import MissingAPIKey, get_backend
+from prompt_compaction import compact, record
+from response_cache import ResponseCache, prompt_version, run_cached
+from review_store import ChunkWriter, MissingColumns, export_excel, read_chunks, require_columns
 
 # -------------------------- CONFIG --------------------------
-INPUT_FILE = "reviews_with_sentiment_batched11.xlsx"       # Your Excel input file
-OUTPUT_FILE = "reviews_scored_reasoned11.xlsx"              # Output file
-BATCH_SIZE = 10                                  # Gemini batch size
-DELAY_BETWEEN_BATCHES = 3                        # Seconds between requests
+INPUT_FILE = "reviews_with_sentiment_batched11.parquet"    # Input file (.parquet, .csv or .xlsx)
+OUTPUT_FILE = "reviews_scored_reasoned11.parquet"           # Output file
+EXCEL_EXPORT = "reviews_scored_reasoned11.xlsx"             # Final Excel copy (None to skip)
+CHUNK_ROWS = 5_000                                          # Rows read/written per chunk
+MODEL_NAME = "gemini-flash-latest"                          # Primary model of MODEL_TIER (also the cache namespace)
+MODEL_TIER = "heavy"                                        # client_pool.MODEL_TIERS entry: keys, models and quotas
+MAX_BATCH_ITEMS = 30                             # Upper bound on reviews per request
+INPUT_TOKEN_BUDGET = 3_000                       # Estimated review tokens per request
+OUTPUT_TOKEN_BUDGET = 2_000                      # Estimated reply tokens per request
+OUTPUT_TOKENS_PER_ITEM = 30                      # {"score": 8, "reason": "..."},
+CONCURRENCY = 4                                  # Batches in flight at once
+REQUESTS_PER_MINUTE = 15                         # Gemini request budget
+TOKENS_PER_MINUTE = 1_000_000                    # Gemini token budget
 MAX_RETRIES = 2                                  # Retry attempts
+DEDUP_THRESHOLD = 0.85                           # Similarity at which reviews share one score
+ROLLUP_FILE = "sentiment_rollup.sqlite"          # Trend rollups merged per chunk (None to skip)
+MAX_REVIEW_TOKENS = 400                          # Longer reviews are scored from their head and tail
+RESPONSE_CONFIG = response_config(score="INTEGER", reason="STRING")   # JSON mode: {"id", "score", "reason"}
+SYSTEM_INSTRUCTION = (                           # Sent once per request instead of a preamble in every prompt
+    "You are a sentiment scoring assistant. Each review starts with its ID in brackets, then its "
+    "sentiment label (Positive, Neutral, or Negative) in parentheses. Return one object per review, "
+    "echoing its ID, with a score from -10 to +10 (Positive +4 to +10, Neutral -3 to +3, "
+    "Negative -10 to -4) and a short, clear reason for it."
+)
 
 # -------------------------- API SETUP --------------------------
-API_KEY = os.getenv("GEMINI_API_KEY")
-if not API_KEY:
-    raise ValueError("❌ GEMINI_API_KEY not found. Set it using: setx GEMINI_API_KEY 'your_key'")
+# Created on first use: Gemini unless MODEL_BACKEND=fake (see model_backend.py); None without GEMINI_API_KEY
+model = None
+
+
+def client():
+    """The stage's model, shared with every other stage using MODEL_NAME in this process."""
+    global model
+    if model is None:
+        model = get_backend(MODEL_NAME, tier=MODEL_TIER)
+    return model
 
-genai.configure(api_key=API_KEY)
-model = genai.GenerativeModel("gemini-flash-latest")
 
 # -------------------------- PROMPT BUILDER --------------------------
-def build_prompt(batch_df):
+def review_for_scoring(row):
+    """The English text of a review: its translation, or the original when it needed none."""
+    return row["reviews_translated"] if row["reviews_translated"] != "no change" else row["review_text"]
+
+
+def score_text(row):
+    """One review as it appears in the prompt: "(Sentiment) compacted review"."""
+    return f"({row['Sentiment']}) {compact(review_for_scoring(row), MAX_REVIEW_TOKENS)}"
+
+
+def build_prompt(batch_texts):
     """
-    Builds a single Gemini prompt for a batch of reviews.
-    The model will output JSON array of objects:
-    [{"score": int, "reason": "..."}, ...]
+    Builds a single Gemini prompt for a batch of score_text() lines, each tagged
+    with its position in the batch as ID. The model will output JSON array of
+    objects: [{"id": int, "score": int, "reason": "..."}, ...]
     """
-    text = "\n\n".join([
-        f"{i+1}. Review: {row['reviews_translated'] if row['reviews_translated'] != 'no change' else row['review_text']}\n"
-        f"Sentiment: {row['Sentiment']}"
-        for i, row in batch_df.iterrows()
-    ])
-
-    prompt = f"""
-You are a sentiment scoring assistant.  
-Each review already has a labeled sentiment (Positive, Neutral, or Negative).
-
-Your job:
-1. Assign a numeric sentiment score between -10 and +10.
-   - Positive sentiment: +4 to +10  
-   - Neutral sentiment: -3 to +3  
-   - Negative sentiment: -10 to -4  
-2. Give a short, clear reason for the score.
-
-Return only a **JSON array** of objects, one for each review, like this:
-[
-  {{"score": 8, "reason": "Strongly positive tone with enthusiastic wording"}},
-  {{"score": -6, "reason": "Critical comments about the book quality"}}
-]
-
-Here are the reviews to analyze:
-{text}
-"""
-    return prompt
+    return "Reviews:\n" + "\n".join(tag(i, t) for i, t in enumerate(batch_texts))
 
 # -------------------------- PARSER --------------------------
-def parse_json_response(response_text):
-    """Extracts valid JSON list of dictionaries from Gemini response text."""
-    try:
-        start = response_text.find("[")
-        end = response_text.rfind("]") + 1
-        json_str = response_text[start:end]
-        return json.loads(json_str)
-    except Exception:
-        raise ValueError("❌ Could not parse JSON from Gemini response")
+def parse_item(item):
+    """One streamed {"id", "score", "reason"} object -> {"score", "reason"}."""
+    if "score" not in item:
+        raise MalformedResponse(f"❌ No score in {item!r}")
+    return {"score": item["score"], "reason": item.get("reason")}
 
 # -------------------------- GEMINI CALL --------------------------
-def process_batch(batch_df):
-    """Send a batch of reviews to Gemini and get scores + reasons."""
-    prompt = build_prompt(batch_df)
-    attempt = 0
-    while attempt <= MAX_RETRIES:
-        attempt += 1
-        try:
-            response = model.generate_content(prompt)
-            results = parse_json_response(response.text)
-            return results
-        except Exception as e:
-            print(f"⚠️ Attempt {attempt} failed: {e}")
-            if attempt <= MAX_RETRIES:
-                time.sleep(5 * attempt)
-            else:
-                return [{"score": None, "reason": "Error during processing"} for _ in range(len(batch_df))]
+def process_batch(batch_texts):
+    """
+    Send a batch of reviews to Gemini and stream back scores + reasons, each
+    joined to its row by ID and checkpointed as soon as its object closes.
+    Missing IDs raise PartialResponse and only those rows are re-requested.
+    """
+    prompt = build_prompt(batch_texts)
+    response = client().generate_content(prompt, stream=True, system_instruction=SYSTEM_INSTRUCTION,
+                                         generation_config=RESPONSE_CONFIG)
+    return stream_by_id(response, "score", len(batch_texts), parse_item)
+
+
+def failed_batch(batch_texts):
+    """Placeholder results for a batch that exhausted its retries."""
+    return [{"score": None, "reason": "Error during processing"} for _ in batch_texts]
+
+# -------------------------- CHUNK PROCESSING --------------------------
+def score_chunk(df, cache, journal, dedup, offset=0):
+    """Add Sentiment_Score and Reason columns to one chunk of reviews."""
+    import pandas as pd
+    row_ids = list(range(offset, offset + len(df)))
+    # Prompt lines double as cache keys: the compacted review plus its label determine the score
+    texts = [score_text(row) for _, row in df.iterrows()]
+    keys = [row_key(t) for t in texts]                  # journal keys: resume follows the text, not the row position
+
+    def run(positions):
+        raw = [review_for_scoring(df.iloc[p]) for p in positions]
+        record("score", raw, [compact(r, MAX_REVIEW_TOKENS) for r in raw])
+        plan = pack_batches([estimate_tokens(texts[p]) for p in positions],
+                            [OUTPUT_TOKENS_PER_ITEM] * len(positions),
+                            INPUT_TOKEN_BUDGET, OUTPUT_TOKEN_BUDGET, MAX_BATCH_ITEMS)
+        batch_positions = [[positions[i] for i in b] for b in plan]
+        batches = [[texts[p] for p in bp] for bp in batch_positions]
+        print(f"📘 Processing {len(positions)} reviews in {len(batches)} token-budgeted batches "
+              f"({CONCURRENCY} in flight)...")
+        all_results = run_batches(
+            batches, process_batch, failed_batch,
+            **executor_limits(client(), CONCURRENCY, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE),
+            max_retries=MAX_RETRIES,
+            estimate=lambda batch: estimate_tokens(SYSTEM_INSTRUCTION) + estimate_tokens(build_prompt(batch)),
+            on_result=lambda i, results: journal.record([keys[p] for p in batch_positions[i]], results),
+            on_item=lambda i, k, value: journal.record([keys[batch_positions[i][k]]], [value], sync=False),
+            stage="score",
+        )
+        return [r for results in all_results for r in results]
+
+    def resolve(positions):
+        return run_cached(cache, "score", MODEL_NAME, prompt_version(build_prompt, SYSTEM_INSTRUCTION),
+                          [texts[p] for p in positions],
+                          lambda sub: run([positions[i] for i in sub]),
+                          is_valid=is_complete)
+
+    def resolve_unique(positions):
+        """Journal -> cache -> API for one representative per duplicate group."""
+        return resume_rows(journal, [keys[p] for p in positions],
+                           lambda sub: resolve([positions[i] for i in sub]))
+
+    # Reuse the earlier stages' duplicate groups when present
+    if "dup_group" in df.columns:
+        groups = df["dup_group"].tolist()
+    else:
+        groups = dedup.assign(texts, row_ids)
+        df["dup_group"] = groups
+    # One score per duplicate group and label: members labelled differently (e.g. one by the local model)
+    # must each get a score inside their own label's range
+    results = dedup.resolve(list(zip(groups, df["Sentiment"].astype(str))), resolve_unique)
+
+    # Add new columns (numeric scores keep the Parquet column type stable across chunks)
+    df["Sentiment_Score"] = pd.to_numeric(pd.Series([r.get("score") for r in results], index=df.index),
+                                          errors="coerce")
+    df["Reason"] = [r.get("reason") for r in results]
+    return df
 
 # -------------------------- MAIN --------------------------
-def main():
+def process_chunks(chunks, output_file=OUTPUT_FILE, resume=False, cache=None):
+    """
+    Score an iterable of DataFrame chunks, yielding each scored chunk; the
+    rollups are merged once the caller has taken the chunk. The journal
+    belongs to `output_file`; pass `cache` to share one response cache with
+    other stages running in the same process.
+    """
+    from dedup import Deduplicator
+    from sentiment_rollup import RollupStore
+    if client() is None:
+        raise MissingAPIKey()
+    required_cols = ["book_title", "review_text", "reviews_translated", "review_date", "Sentiment"]
+    own_cache = cache is None
+    cache = cache or ResponseCache()
+    journal = Journal(journal_path(output_file), resume=resume)
+    dedup = Deduplicator(DEDUP_THRESHOLD)
+    rollup = RollupStore(ROLLUP_FILE) if ROLLUP_FILE else None
+    offset = 0
     try:
-        df = pd.read_excel(INPUT_FILE)
+        for i, chunk in enumerate(chunks):
+            require_columns(chunk, required_cols)
+            print(f"📦 Chunk {i + 1}: {len(chunk)} rows")
+            with METRICS.timer("chunk_seconds", stage="score"):
+                result = score_chunk(chunk, cache, journal, dedup, offset)
+            METRICS.inc("rows_total", len(chunk), stage="score")
+            offset += len(chunk)
+            yield result
+            if rollup:
+                rollup.update(result)
+    finally:
+        if own_cache:
+            cache.close()
+        journal.close()
+        if rollup:
+            rollup.close()
+
+
+def run(input_file=INPUT_FILE, output_file=OUTPUT_FILE, resume=False, excel=EXCEL_EXPORT):
+    """Score `input_file` into `output_file`. Returns the rows written, or None if the input is unusable."""
+    try:
+        with ChunkWriter(output_file) as writer:
+            for result in process_chunks(read_chunks(input_file, CHUNK_ROWS), output_file, resume):
+                writer.write(result)
+    except (MissingColumns, MissingAPIKey) as e:
+        print(f"❌ {e}")
+        return None
     except FileNotFoundError:
-        print(f"❌ File '{INPUT_FILE}' not found.")
-        return
+        print(f"❌ File '{input_file}' not found.")
+        return None
     except PermissionError:
-        print(f"❌ Close '{INPUT_FILE}' if open and retry.")
-        return
-
-    required_cols = {"book_title", "review_text", "reviews_translated", "review_date", "Sentiment"}
-    if not required_cols.issubset(df.columns):
-        print(f"❌ Input file must contain these columns: {required_cols}")
-        return
+        print(f"❌ Close '{input_file}' if open and retry.")
+        return None
 
-    scores, reasons = [], []
-    print(f"📘 Processing {len(df)} reviews in batches of {BATCH_SIZE}...")
+    print(f"\n✅ Done — Saved {writer.rows} rows as '{output_file}'")
+    if excel:
+        export_excel(output_file, excel)
+    METRICS.finish()
+    return writer.rows
 
-    for start in range(0, len(df), BATCH_SIZE):
-        end = min(start + BATCH_SIZE, len(df))
-        batch_df = df.iloc[start:end]
-        print(f"🔹 Batch {start // BATCH_SIZE + 1}: {start+1}–{end}")
-        results = process_batch(batch_df)
 
-        for r in results:
-            scores.append(r.get("score"))
-            reasons.append(r.get("reason"))
-        time.sleep(DELAY_BETWEEN_BATCHES)
-
-    # Add new columns
-    df["Sentiment_Score"] = scores
-    df["Reason"] = reasons
-
-    # Save to new Excel file
-    try:
-        df.to_excel(OUTPUT_FILE, index=False, engine="openpyxl")
-        print(f"\n✅ Done — Saved as '{OUTPUT_FILE}'")
-    except PermissionError:
-        print(f"❌ Close '{OUTPUT_FILE}' if it's open and re-run.")
-    except Exception as e:
-        print(f"⚠️ Unexpected error while saving: {e}")
+def main():
+    args = arg_parser("Score reviews (-10 to +10) with reasons using Gemini.").parse_args()
+    run(resume=args.resume)
 
 
 if __name__ == "__main__":
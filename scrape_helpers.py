@@ -0,0 +1,120 @@
+# scrape_helpers.py
+# Shared Playwright helpers for the scrapers:
+# - one page.evaluate() call that pulls every review on a page as JSON
+#   (instead of get_attribute + query_selector + inner_text per review,
+#   each of which is a separate round trip to the browser)
+# - request interception that blocks images, media, fonts and trackers
+# - a per-page timing breakdown to show where the time goes
+
+import re
+import time
+from urllib.parse import urlparse
+
+# Columns of the scraped review store
+COLUMNS = ["book_title", "product", "review_id", "review_text", "review_date", "rating"]
+
+# -------------------------- DOM EXTRACTION --------------------------
+EXTRACT_REVIEWS_JS = """
+() => {
+  const pick = (el, sel) => el.querySelector(sel);
+  const reviews = Array.from(document.querySelectorAll("div[id^='customer_review']")).map(el => {
+    const body = pick(el, "[data-hook='review-body']");
+    const date = pick(el, "[data-hook='review-date']");
+    const rating = pick(el, "[data-hook='review-star-rating'], [data-hook='cmps-review-star-rating']");
+    return {
+      review_id: el.id,
+      review_text: body ? body.innerText.trim().replace(/\\n/g, " ") : "No review text",
+      review_date: date ? date.innerText.trim() : "No date found",
+      rating_text: rating ? rating.innerText.trim() : null,
+    };
+  });
+  return {reviews: reviews, has_next: !!document.querySelector("li.a-last a")};
+}
+"""
+
+def parse_rating(text):
+    """'4.0 out of 5 stars' -> 4.0"""
+    match = re.search(r"(\d+(?:[.,]\d+)?)", text or "")
+    return float(match.group(1).replace(",", ".")) if match else None
+
+
+# Only the IDs and the next-page flag (used for the watermark in snapshot mode)
+REVIEW_IDS_JS = """
+() => ({
+  ids: Array.from(document.querySelectorAll("div[id^='customer_review']")).map(el => el.id),
+  has_next: !!document.querySelector("li.a-last a"),
+})
+"""
+
+
+# -------------------------- RESOURCE BLOCKING --------------------------
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+BLOCKED_HOST_PARTS = (
+    "amazon-adsystem.com", "doubleclick.net", "google-analytics.com", "googletagmanager.com",
+    "fls-eu.amazon", "fls-na.amazon", "unagi.amazon", "aax-eu.amazon", "aax-us", "scorecardresearch.com",
+)
+
+
+def should_block(url, resource_type):
+    """True for heavy static resources and third-party ad/tracking requests."""
+    if resource_type in BLOCKED_RESOURCE_TYPES:
+        return True
+    host = urlparse(url).netloc
+    return any(part in host for part in BLOCKED_HOST_PARTS)
+
+
+async def block_resources_async(context):
+    """Install the blocking route on an async Playwright context."""
+    async def handler(route):
+        request = route.request
+        if should_block(request.url, request.resource_type):
+            await route.abort()
+        else:
+            await route.continue_()
+    await context.route("**/*", handler)
+
+
+def block_resources(context):
+    """Install the blocking route on a sync Playwright context."""
+    def handler(route):
+        request = route.request
+        if should_block(request.url, request.resource_type):
+            route.abort()
+        else:
+            route.continue_()
+    context.route("**/*", handler)
+
+
+# -------------------------- TIMING --------------------------
+class PageTimer:
+    """Accumulates per-page seconds spent in each phase (navigate / wait / extract)."""
+
+    def __init__(self):
+        self.phases = {}
+        self.pages = 0
+
+    def page(self):
+        self.pages += 1
+        return _PhaseClock(self)
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def report(self):
+        if not self.pages:
+            return
+        total = sum(self.phases.values()) or 1e-9
+        print(f"⏱️ {self.pages} pages, {total / self.pages:.2f}s per page on average:")
+        for phase, seconds in self.phases.items():
+            print(f"   {phase:<9} {seconds / self.pages:6.2f}s  ({seconds / total:.0%})")
+
+
+class _PhaseClock:
+    def __init__(self, timer):
+        self.timer = timer
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.timer.add(phase, now - self.last)
+        self.last = now
@@ -1,93 +1,205 @@
 # gemini_sentiment_analysis_batched_corrected.py
 
-import os
-import time
-import pandas as pd
-import google.generativeai as genai
+from checkpoint import Journal, arg_parser, is_complete, journal_path, resume_rows, row_key
+from client_pool import executor_limits
+from gemini_executor import MalformedResponse, estimate_tokens, pack_batches, run_batches
+from json_stream import response_config, stream_by_id, tag
+from metrics import METRICS
+from model_backend import get_backend
+from prompt_compaction import compact, record
+from response_cache import ResponseCache, prompt_version, run_cached
+from review_store import ChunkWriter, MissingColumns, export_excel, read_chunks, require_columns
 
 # -------------------------- CONFIG --------------------------
-INPUT_FILE = "reviews_translated11.xlsx"
-OUTPUT_FILE = "reviews_with_sentiment_batched11.xlsx"
-BATCH_SIZE = 5           # Number of reviews per batch
-DELAY_BETWEEN_BATCHES = 10  # Seconds
+INPUT_FILE = "reviews_translated11.parquet"
+OUTPUT_FILE = "reviews_with_sentiment_batched11.parquet"
+EXCEL_EXPORT = None      # e.g. "reviews_with_sentiment_batched11.xlsx" for a final Excel copy
+CHUNK_ROWS = 5_000       # Rows read/written per chunk
+MODEL_NAME = "gemini-flash-lite-latest"   # Primary model of MODEL_TIER (also the cache namespace)
+MODEL_TIER = "light"     # client_pool.MODEL_TIERS entry: keys, models and quotas
+MAX_BATCH_ITEMS = 50     # Upper bound on reviews per request
+INPUT_TOKEN_BUDGET = 3_000   # Estimated review tokens per request
+OUTPUT_TOKEN_BUDGET = 1_000  # Estimated reply tokens per request
+OUTPUT_TOKENS_PER_ITEM = 8   # {"sentiment": "Positive"},
+CONCURRENCY = 4          # Batches in flight at once
+REQUESTS_PER_MINUTE = 15
+TOKENS_PER_MINUTE = 1_000_000
+MAX_RETRIES = 2
+DEDUP_THRESHOLD = 0.85   # Similarity at which reviews share one label
+LOCAL_CONFIDENCE = 0.8   # Local-model confidence needed to skip Gemini (>1 sends every row to Gemini)
+LEXICON_ROUTING = False  # Also skip Gemini on the untrained lexicon fallback (no local_sentiment_model.npz)
+MAX_REVIEW_TOKENS = 300  # Longer reviews are labelled from their head and tail (prompt_compaction.py)
+RESPONSE_CONFIG = response_config(sentiment="STRING")   # JSON mode: one {"id", "sentiment"} per review
+SYSTEM_INSTRUCTION = (   # Sent once per request instead of repeating a preamble in the prompt
+    "You are a sentiment analysis assistant. Each review starts with its ID in brackets. "
+    "Return one object per review, echoing its ID, with its sentiment: Positive, Neutral, or Negative."
+)
 
 # -------------------------- API SETUP --------------------------
-API_KEY = os.getenv("GEMINI_API_KEY")
-if not API_KEY:
-    raise ValueError("Set your GEMINI_API_KEY environment variable")
+# Created on first use: Gemini unless MODEL_BACKEND=fake (see model_backend.py); None without GEMINI_API_KEY
+model = None
 
-genai.configure(api_key=API_KEY)
-model = genai.GenerativeModel("gemini-flash-latest")
-
-# -------------------------- LOAD DATA --------------------------
-if INPUT_FILE.endswith(".csv"):
-    df = pd.read_csv(INPUT_FILE)
-else:
-    df = pd.read_excel(INPUT_FILE)
-
-if "review_text" not in df.columns:
-    raise ValueError("Input file must contain a 'review_text' column.")
+def client():
+    """The stage's model, shared with every other stage using MODEL_NAME in this process."""
+    global model
+    if model is None:
+        model = get_backend(MODEL_NAME, tier=MODEL_TIER)
+    return model
 
 # -------------------------- HELPER FUNCTIONS --------------------------
 def build_prompt(batch_reviews):
-    """Build a single prompt for a batch of reviews."""
-    reviews_text = "\n".join([f"{i+1}. {r}" for i, r in enumerate(batch_reviews)])
-    prompt = f"""
-You are a sentiment analysis assistant.
-For each review below, classify the sentiment as Positive, Neutral, or Negative.
-Return only a JSON array of objects like:
-[
-  {{"sentiment": "Positive"}},
-  {{"sentiment": "Neutral"}}
-]
-
-Reviews:
-{reviews_text}
-"""
-    return prompt
-
-def parse_response(response_text, batch_len):
-    """Extract sentiment list from Gemini response JSON."""
-    import json
-    try:
-        start = response_text.find("[")
-        end = response_text.rfind("]") + 1
-        json_str = response_text[start:end]
-        result = json.loads(json_str)
-        # Ensure one sentiment per review
-        sentiments = [r.get("sentiment", "Unknown") for r in result]
-        if len(sentiments) < batch_len:
-            sentiments += ["Unknown"] * (batch_len - len(sentiments))
-        return sentiments
-    except Exception:
-        return ["Unknown"] * batch_len
+    """Build a single prompt for a batch of (compacted) reviews, each tagged with its ID."""
+    return "Reviews:\n" + "\n".join(tag(i, r) for i, r in enumerate(batch_reviews))
+
+def parse_item(item):
+    """One {"id", "sentiment"} object from the streamed reply -> its label."""
+    sentiment = item.get("sentiment")
+    if not isinstance(sentiment, str):
+        raise MalformedResponse(f"Could not parse sentiment from {item!r}")
+    return sentiment
 
 def analyze_batch(batch_reviews):
-    """Send a batch to Gemini and return sentiment results."""
+    """
+    Send a batch to Gemini and stream back one sentiment per review, joined by
+    ID. Reviews whose ID is missing from the reply raise PartialResponse, and
+    the executor re-requests just those (API errors are retried by the executor).
+    """
     prompt = build_prompt(batch_reviews)
-    try:
-        response = model.generate_content(prompt)
-        sentiments = parse_response(response.text, len(batch_reviews))
-        return sentiments
-    except Exception as e:
-        print(f"⚠️ Error in batch: {e}")
-        return ["Unknown"] * len(batch_reviews)
+    response = client().generate_content(prompt, stream=True, system_instruction=SYSTEM_INSTRUCTION,
+                                         generation_config=RESPONSE_CONFIG)
+    return stream_by_id(response, "sentiment", len(batch_reviews), parse_item)
+
+def failed_batch(batch_reviews):
+    """Placeholder results for a batch that exhausted its retries."""
+    return ["Unknown"] * len(batch_reviews)
+
+# -------------------------- CHUNK PROCESSING --------------------------
+def analyze_chunk(df, cache, journal, dedup, local_model, offset=0):
+    """Add Sentiment and sentiment_source columns to one chunk of reviews."""
+    from local_sentiment import english_text
+    reviews = df["review_text"].tolist()
+    row_ids = list(range(offset, offset + len(df)))
+
+    def run_uncached(positions):
+        """Classify the reviews at `positions` through the executor, journaling each batch."""
+        record("sentiment", [reviews[p] for p in positions], [prompts[p] for p in positions])
+        plan = pack_batches([estimate_tokens(prompts[p]) for p in positions],
+                            [OUTPUT_TOKENS_PER_ITEM] * len(positions),
+                            INPUT_TOKEN_BUDGET, OUTPUT_TOKEN_BUDGET, MAX_BATCH_ITEMS)
+        batch_positions = [[positions[i] for i in b] for b in plan]
+        batches = [[prompts[p] for p in bp] for bp in batch_positions]
+        print(f"Processing {len(positions)} reviews in {len(batches)} token-budgeted batches ({CONCURRENCY} in flight)...")
+        results = run_batches(
+            batches, analyze_batch, failed_batch,
+            **executor_limits(client(), CONCURRENCY, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE),
+            max_retries=MAX_RETRIES,
+            on_result=lambda i, result: journal.record([keys[p] for p in batch_positions[i]], result),
+            on_item=lambda i, k, value: journal.record([keys[batch_positions[i][k]]], [value], sync=False),
+            stage="sentiment",
+        )
+        return [s for batch in results for s in batch]
+
+    def resolve(positions):
+        return run_cached(cache, "sentiment", MODEL_NAME, prompt_version(build_prompt, SYSTEM_INSTRUCTION),
+                          [prompts[p] for p in positions],
+                          lambda sub: run_uncached([positions[i] for i in sub]),
+                          is_valid=is_complete)
+
+    # Reuse the translation stage's duplicate groups when present
+    if "dup_group" in df.columns:
+        groups = df["dup_group"].tolist()
+    else:
+        groups = dedup.assign(reviews, row_ids)
+        df["dup_group"] = groups
+
+    # Confident local predictions never reach Gemini (all of them without an API key)
+    local_labels, confidence = local_model.predict(english_text(df).tolist())
+    if client() is None:
+        threshold = 0.0
+    elif local_model.trained or LEXICON_ROUTING:
+        threshold = LOCAL_CONFIDENCE
+    else:
+        threshold = float("inf")   # untrained lexicon: Gemini labels every row
+    rest = [i for i, c in enumerate(confidence) if c < threshold]
+    prompts = {i: compact(reviews[i], MAX_REVIEW_TOKENS) for i in rest}
+    keys = {i: row_key(prompts[i]) for i in rest}       # journal keys: resume follows the text, not the row position
+    print(f"🧮 Local model labelled {len(reviews) - len(rest)}/{len(reviews)} reviews")
+
+    def resolve_unique(reps):
+        """Journal -> cache -> API for one representative per duplicate group (`reps` index `rest`)."""
+        positions = [rest[r] for r in reps]
+        return resume_rows(journal, [keys[p] for p in positions],
+                           lambda sub: resolve([positions[i] for i in sub]))
+
+    sentiments = list(local_labels)
+    sources = ["local"] * len(reviews)
+    for i, value in zip(rest, dedup.resolve([groups[i] for i in rest], resolve_unique)):
+        sentiments[i] = value
+        sources[i] = "gemini"
+    df["Sentiment"] = sentiments
+    df["sentiment_source"] = sources
+    return df
 
 # -------------------------- MAIN PROCESSING --------------------------
-all_sentiments = []
+def process_chunks(chunks, output_file=OUTPUT_FILE, resume=False, cache=None):
+    """
+    Label an iterable of DataFrame chunks, yielding each labelled chunk.
+    The journal belongs to `output_file`; pass `cache` to share one response
+    cache with other stages running in the same process.
+    """
+    from dedup import Deduplicator
+    from local_sentiment import LocalSentimentModel
+    if client() is None:
+        print("⚠️ GEMINI_API_KEY not set — every review will be labelled by the local model.")
+    own_cache = cache is None
+    cache = cache or ResponseCache()
+    journal = Journal(journal_path(output_file), resume=resume)
+    dedup = Deduplicator(DEDUP_THRESHOLD)
+    local_model = LocalSentimentModel.load()
+    if client() is not None and not local_model.trained and not LEXICON_ROUTING:
+        print("ℹ️ No trained local model — every review goes to Gemini (train one with local_sentiment.py)")
+    offset = 0
+    try:
+        for i, chunk in enumerate(chunks):
+            require_columns(chunk, ["review_text"])
+            print(f"📦 Chunk {i + 1}: {len(chunk)} rows")
+            with METRICS.timer("chunk_seconds", stage="sentiment"):
+                result = analyze_chunk(chunk, cache, journal, dedup, local_model, offset)
+            METRICS.inc("rows_total", len(chunk), stage="sentiment")
+            offset += len(chunk)
+            yield result
+    finally:
+        if own_cache:
+            cache.close()
+        journal.close()
+
+
+def run(input_file=INPUT_FILE, output_file=OUTPUT_FILE, resume=False, excel=EXCEL_EXPORT):
+    """Label `input_file` into `output_file`. Returns the rows written, or None if the input is unusable."""
+    try:
+        with ChunkWriter(output_file) as writer:
+            for result in process_chunks(read_chunks(input_file, CHUNK_ROWS), output_file, resume):
+                writer.write(result)
+    except MissingColumns as e:
+        print(f"❌ {e}")
+        return None
+    except FileNotFoundError:
+        print(f"❌ File '{input_file}' not found.")
+        return None
+    except PermissionError:
+        print(f"❌ Close '{input_file}' if open and retry.")
+        return None
 
-print(f"Processing {len(df)} reviews in batches of {BATCH_SIZE}...")
+    print(f"\n✅ Sentiment analysis completed! Saved {writer.rows} rows to '{output_file}'")
+    if excel:
+        export_excel(output_file, excel)
+    METRICS.finish()
+    return writer.rows
 
-for start in range(0, len(df), BATCH_SIZE):
-    end = min(start + BATCH_SIZE, len(df))
-    batch_reviews = df["review_text"].iloc[start:end].tolist()
-    print(f"🔹 Batch {start//BATCH_SIZE + 1}: reviews {start+1}-{end}")
-    sentiments = analyze_batch(batch_reviews)
-    all_sentiments.extend(sentiments)
-    time.sleep(DELAY_BETWEEN_BATCHES)
 
-df["Sentiment"] = all_sentiments
+def main():
+    args = arg_parser("Classify review sentiment locally, routing low-confidence reviews to Gemini.").parse_args()
+    run(resume=args.resume)
 
-# -------------------------- SAVE RESULTS --------------------------
-df.to_excel(OUTPUT_FILE, index=False)
-print(f"\n✅ Sentiment analysis completed! Saved to '{OUTPUT_FILE}'")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+# sentiment_rollup.py
+# Time-bucketed sentiment rollups for trend graphs.
+# review_date is scraped as Amazon's raw text ("Reviewed in India on 3 March 2024");
+# normalize_dates parses a whole column at once (each distinct string only once).
+# RollupStore keeps, per grain (day / week / month) x book x bucket: the review
+# count, score sum / sum of squares, a -10..+10 score histogram (for exact
+# quantiles) and the label distribution. New batches are merged in with SQLite
+# upserts that only touch their own buckets, so trend queries read a few
+# hundred pre-aggregated rows instead of rescanning the scored file.
+#
+# Usage:
+#   python sentiment_rollup.py build reviews_scored_reasoned11.parquet
+#   python sentiment_rollup.py query --grain week --book "White Nights"
+#   python sentiment_rollup.py query --db sentiment_rollup_fused.sqlite   # fused_pipeline.py's rollups
+
+import argparse
+import hashlib
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from review_store import read_chunks
+
+# -------------------------- CONFIG --------------------------
+ROLLUP_FILE = "sentiment_rollup.sqlite"
+GRAINS = ("day", "week", "month")
+LABELS = ("Positive", "Neutral", "Negative")
+SCORE_MIN, SCORE_MAX = -10, 10
+DATE_FORMATS = ("%d %B %Y", "%B %d, %Y", "%Y-%m-%d")   # amazon.in, amazon.com, already normalized
+KEY_BATCH = 500                                        # Review keys per "already ingested?" lookup
+
+
+# -------------------------- DATES --------------------------
+def normalize_dates(values):
+    """
+    Vectorized parse of Amazon review dates into a datetime64 Series (NaT when
+    unparseable). Parses each distinct string once, so repeated dates are free.
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype="string"), use_na_sentinel=True)
+    text = pd.Series(uniques, dtype="string")
+    text = text.str.extract(r"\bon\s+(.+?)\s*$", expand=False).fillna(text).str.strip()
+    parsed = pd.Series(pd.NaT, index=text.index, dtype="datetime64[ns]")
+    for fmt in DATE_FORMATS:
+        missing = parsed.isna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(text[missing], format=fmt, errors="coerce")
+    dates = parsed.to_numpy()
+    out = np.full(len(codes), np.datetime64("NaT"), dtype="datetime64[ns]")
+    known = codes >= 0
+    out[known] = dates[codes[known]]
+    return pd.Series(out, index=getattr(values, "index", None))
+
+
+def bucket_starts(dates, grain):
+    """First day of each date's bucket as 'YYYY-MM-DD' (weeks start on Monday)."""
+    if grain == "day":
+        starts = dates.dt.normalize()
+    elif grain == "week":
+        starts = dates.dt.normalize() - pd.to_timedelta(dates.dt.weekday, unit="D")
+    elif grain == "month":
+        starts = dates.dt.to_period("M").dt.start_time
+    else:
+        raise ValueError(f"❌ Unknown grain '{grain}' (use one of {', '.join(GRAINS)})")
+    return starts.dt.strftime("%Y-%m-%d")
+
+
+# -------------------------- STORE --------------------------
+class RollupStore:
+    """SQLite rollups of scored reviews per grain x book x bucket, merged on append."""
+
+    def __init__(self, path=ROLLUP_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        label_columns = ", ".join(f"{label.lower()} INTEGER NOT NULL DEFAULT 0" for label in LABELS)
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS rollup (
+                grain     TEXT NOT NULL,
+                book      TEXT NOT NULL,
+                bucket    TEXT NOT NULL,
+                n         INTEGER NOT NULL,
+                score_sum REAL NOT NULL,
+                score_sq  REAL NOT NULL,
+                {label_columns},
+                other     INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (grain, book, bucket)
+            );
+            CREATE TABLE IF NOT EXISTS rollup_scores (
+                grain  TEXT NOT NULL,
+                book   TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                score  INTEGER NOT NULL,
+                n      INTEGER NOT NULL,
+                PRIMARY KEY (grain, book, bucket, score)
+            );
+            CREATE TABLE IF NOT EXISTS ingested (
+                review_key TEXT PRIMARY KEY
+            );
+        """)
+        self.conn.commit()
+
+    # ---- writing ----
+    @staticmethod
+    def _review_keys(df):
+        """
+        Stable identity per row: product/book + review_id, or without a
+        review_id column a hash of (book_title, review_text, review_date)
+        plus the row's occurrence number among identical rows of the batch,
+        so two genuinely identical reviews in one batch still count twice.
+        """
+        if "review_id" in df.columns:
+            owner = (df["product"] if "product" in df.columns else df["book_title"]).astype(str).to_numpy()
+            return pd.Series(owner + "/" + df["review_id"].astype(str).to_numpy())
+        parts = [df[col].astype(str) if col in df.columns else pd.Series("", index=df.index)
+                 for col in ("book_title", "review_text", "review_date")]
+        digests = pd.Series([hashlib.sha1("\x1f".join(row).encode("utf-8")).hexdigest()
+                             for row in zip(*parts)])
+        return "sha1:" + digests + "#" + digests.groupby(digests).cumcount().astype(str)
+
+    def _new_rows(self, keys):
+        """Mask of keys not seen before; records them as ingested."""
+        seen = set()
+        for start in range(0, len(keys), KEY_BATCH):
+            part = keys[start:start + KEY_BATCH]
+            rows = self.conn.execute(
+                f"SELECT review_key FROM ingested WHERE review_key IN ({','.join('?' * len(part))})", part)
+            seen.update(row[0] for row in rows)
+        fresh = np.array([k not in seen for k in keys], dtype=bool)
+        # Duplicates inside the batch itself count once
+        fresh &= ~pd.Series(keys).duplicated().to_numpy()
+        self.conn.executemany("INSERT OR IGNORE INTO ingested VALUES (?)",
+                              [(k,) for k, new in zip(keys, fresh) if new])
+        return fresh
+
+    def update(self, df):
+        """
+        Merge one batch of scored reviews (book_title, review_date,
+        Sentiment_Score, Sentiment; review_id/product when present). Rows
+        without a date or a score are skipped and can be merged later; rows
+        already merged are ignored (see _review_keys), so re-running a stage
+        on the same input doesn't count it twice.
+        Returns the number of rows merged.
+        """
+        frame = pd.DataFrame({
+            "book": df["book_title"].fillna("Unknown").astype(str).to_numpy(),
+            "date": normalize_dates(df["review_date"]).to_numpy(),
+            "score": pd.to_numeric(df["Sentiment_Score"], errors="coerce").to_numpy(),
+            "label": df["Sentiment"].astype(str).to_numpy() if "Sentiment" in df.columns else "",
+        })
+        keep = frame["date"].notna() & frame["score"].notna()
+        keys = self._review_keys(df)
+        valid = keep.to_numpy()
+        fresh = np.zeros(len(frame), dtype=bool)
+        fresh[valid] = self._new_rows(keys[valid].tolist())
+        keep &= fresh
+        frame = frame[keep]
+        if frame.empty:
+            self.conn.commit()
+            return 0
+
+        frame["score_bin"] = frame["score"].round().clip(SCORE_MIN, SCORE_MAX).astype(int)
+        frame["score_sq"] = frame["score"] ** 2
+        for label in LABELS:
+            frame[label.lower()] = (frame["label"] == label).astype(int)
+        frame["other"] = (~frame["label"].isin(LABELS)).astype(int)
+        label_cols = [label.lower() for label in LABELS] + ["other"]
+
+        for grain in GRAINS:
+            frame["bucket"] = bucket_starts(frame["date"], grain)
+            agg = frame.groupby(["book", "bucket"]).agg(
+                n=("score", "size"), score_sum=("score", "sum"), score_sq=("score_sq", "sum"),
+                **{col: (col, "sum") for col in label_cols},
+            ).reset_index()
+            updates = ", ".join(f"{col} = {col} + excluded.{col}" for col in ["n", "score_sum", "score_sq"] + label_cols)
+            self.conn.executemany(
+                f"INSERT INTO rollup (grain, book, bucket, n, score_sum, score_sq, {', '.join(label_cols)}) "
+                f"VALUES ({', '.join('?' * (6 + len(label_cols)))}) "
+                f"ON CONFLICT (grain, book, bucket) DO UPDATE SET {updates}",
+                [(grain, *row) for row in agg[["book", "bucket", "n", "score_sum", "score_sq", *label_cols]]
+                 .itertuples(index=False, name=None)],
+            )
+            hist = frame.groupby(["book", "bucket", "score_bin"]).size().reset_index(name="n")
+            self.conn.executemany(
+                "INSERT INTO rollup_scores (grain, book, bucket, score, n) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (grain, book, bucket, score) DO UPDATE SET n = n + excluded.n",
+                [(grain, book, bucket, int(score), int(n)) for book, bucket, score, n in hist.itertuples(index=False)],
+            )
+        self.conn.commit()
+        return len(frame)
+
+    def rebuild(self, path, chunk_rows=None):
+        """Recreate the rollups from a whole scored file, chunk by chunk."""
+        self.conn.executescript("DELETE FROM rollup; DELETE FROM rollup_scores; DELETE FROM ingested;")
+        merged = 0
+        for chunk in (read_chunks(path, chunk_rows) if chunk_rows else read_chunks(path)):
+            merged += self.update(chunk)
+        return merged
+
+    # ---- reading ----
+    def books(self):
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT book FROM rollup ORDER BY book")]
+
+    def trend(self, grain="month", book=None, start=None, end=None, quantiles=(0.25, 0.5, 0.75)):
+        """
+        One row per bucket: count, mean and std of Sentiment_Score, score
+        quantiles (from the histogram) and the share of each label. `book=None`
+        combines all books; `start`/`end` are inclusive 'YYYY-MM-DD' bounds.
+        """
+        where, params = ["grain = ?"], [grain]
+        if book is not None:
+            where.append("book = ?")
+            params.append(book)
+        if start:
+            where.append("bucket >= ?")
+            params.append(start)
+        if end:
+            where.append("bucket <= ?")
+            params.append(end)
+        where = " AND ".join(where)
+        label_cols = [label.lower() for label in LABELS] + ["other"]
+        trend = pd.read_sql_query(
+            f"SELECT bucket, SUM(n) AS n, SUM(score_sum) AS score_sum, SUM(score_sq) AS score_sq, "
+            f"{', '.join(f'SUM({c}) AS {c}' for c in label_cols)} "
+            f"FROM rollup WHERE {where} GROUP BY bucket ORDER BY bucket", self.conn, params=params)
+        hist = pd.read_sql_query(
+            f"SELECT bucket, score, SUM(n) AS n FROM rollup_scores WHERE {where} GROUP BY bucket, score",
+            self.conn, params=params)
+
+        trend["mean"] = trend["score_sum"] / trend["n"]
+        trend["std"] = np.sqrt(np.maximum(trend["score_sq"] / trend["n"] - trend["mean"] ** 2, 0))
+        for col in label_cols:
+            trend[f"{col}_share"] = trend[col] / trend["n"]
+        if not hist.empty and len(trend):
+            table = hist.pivot(index="bucket", columns="score", values="n").reindex(
+                index=trend["bucket"], columns=range(SCORE_MIN, SCORE_MAX + 1)).fillna(0).to_numpy()
+            cumulative = table.cumsum(axis=1) / table.sum(axis=1, keepdims=True)
+            scores = np.arange(SCORE_MIN, SCORE_MAX + 1)
+            for q in quantiles:
+                trend[f"p{int(q * 100)}"] = scores[(cumulative >= q).argmax(axis=1)]
+        return trend.drop(columns=["score_sum", "score_sq"])
+
+    def close(self):
+        self.conn.close()
+
+
+# -------------------------- CLI --------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the sentiment trend rollups.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--db", default=ROLLUP_FILE, help="rollup file (default: %(default)s)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", parents=[common], help="rebuild the rollups from a scored file")
+    build.add_argument("input", nargs="?", default="reviews_scored_reasoned11.parquet")
+    query = sub.add_parser("query", parents=[common], help="print a trend table")
+    query.add_argument("--grain", choices=GRAINS, default="month")
+    query.add_argument("--book", help="one book title (default: all books combined)")
+    query.add_argument("--start")
+    query.add_argument("--end")
+    args = parser.parse_args()
+
+    store = RollupStore(args.db)
+    try:
+        if args.command == "build":
+            merged = store.rebuild(args.input)
+            print(f"📊 Rolled up {merged} scored reviews from '{args.input}' into '{args.db}'")
+        else:
+            print(store.trend(args.grain, args.book, args.start, args.end).to_string(index=False))
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# snapshot_parser.py
+# Offline parser stage for the raw HTML archive written by
+# `review_scraper.py --snapshot-only`. Snapshots are parsed in a
+# ProcessPoolExecutor, so parsing scales with CPU cores independently of
+# browser concurrency, and re-parsing the whole archive after a selector
+# change needs no network access. Uses selectolax when installed and the
+# standard-library HTML parser otherwise.
+#
+# Usage:
+#   python snapshot_parser.py
+#   python snapshot_parser.py --snapshots snapshots --output amazon_book_reviews.parquet --workers 8
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+
+import pandas as pd
+
+from review_store import ChunkWriter
+from scrape_helpers import COLUMNS, parse_rating
+from snapshot_store import SNAPSHOT_DIR, SnapshotStore
+
+try:
+    from selectolax.parser import HTMLParser as FastHTMLParser
+except ImportError:  # optional speed-up
+    FastHTMLParser = None
+
+# -------------------------- CONFIG --------------------------
+OUTPUT_FILE = "amazon_book_reviews.parquet"
+WORKERS = os.cpu_count() or 1
+TASKS_PER_WORKER_CHUNK = 16
+
+REVIEW_HOOKS = {
+    "review-body": "review_text",
+    "review-date": "review_date",
+    "review-star-rating": "rating_text",
+    "cmps-review-star-rating": "rating_text",
+}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+# Tags whose boundaries separate words in innerText (the in-browser extractor)
+BREAK_TAGS = {"address", "article", "blockquote", "br", "dd", "div", "dl", "dt", "footer", "h1", "h2", "h3", "h4",
+              "h5", "h6", "header", "hr", "li", "ol", "p", "pre", "section", "table", "td", "th", "tr", "ul"}
+
+
+# -------------------------- PARSERS --------------------------
+def _clean(text):
+    return " ".join(text.split())
+
+
+class _ReviewHTMLParser(HTMLParser):
+    """
+    Standard-library equivalent of scrape_helpers.EXTRACT_REVIEWS_JS.
+    Tolerates unclosed tags like a browser would: an end tag closes every
+    element opened after its match, and the next customer_review div (or the
+    end of the page) closes a review left open.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.reviews = []
+        self.has_next = False
+        self.stack = []             # names of the open elements
+        self.review = None          # (level, dict) of the open review div
+        self.hook = None            # (level, field, [text]) of the open data-hook element
+        self.last_li = None         # level of an open li.a-last
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BREAK_TAGS:
+            self._space()
+        if tag in VOID_TAGS:
+            return
+        attrs = dict(attrs)
+        if tag == "div" and (attrs.get("id") or "").startswith("customer_review"):
+            self._close_review()
+            self.stack.append(tag)
+            self.review = (len(self.stack), {"review_id": attrs["id"]})
+            return
+        self.stack.append(tag)
+        if self.review is not None and self.hook is None and attrs.get("data-hook") in REVIEW_HOOKS:
+            self.hook = (len(self.stack), REVIEW_HOOKS[attrs["data-hook"]], [])
+        if tag == "li" and "a-last" in (attrs.get("class") or "").split():
+            self.last_li = len(self.stack)
+        elif tag == "a" and self.last_li is not None:
+            self.has_next = True
+
+    def handle_endtag(self, tag):
+        if tag in BREAK_TAGS:
+            self._space()
+        if tag in VOID_TAGS or tag not in self.stack:
+            return                  # stray end tag
+        del self.stack[len(self.stack) - 1 - self.stack[::-1].index(tag):]
+        self._unwind()
+
+    def handle_data(self, data):
+        if self.hook is not None:
+            self.hook[2].append(data)
+
+    def close(self):
+        super().close()
+        self.stack = []
+        self._unwind()
+
+    def _space(self):
+        if self.hook is not None:
+            self.hook[2].append(" ")
+
+    def _close_hook(self):
+        _, field, parts = self.hook
+        self.review[1].setdefault(field, _clean("".join(parts)))
+        self.hook = None
+
+    def _close_review(self):
+        if self.review is None:
+            return
+        if self.hook is not None:
+            self._close_hook()
+        self.reviews.append(self.review[1])
+        self.review = None
+
+    def _unwind(self):
+        """Close the hook, review and pagination item whose elements are no longer open."""
+        level = len(self.stack)
+        if self.hook is not None and self.hook[0] > level:
+            self._close_hook()
+        if self.review is not None and self.review[0] > level:
+            self._close_review()
+        if self.last_li is not None and self.last_li > level:
+            self.last_li = None
+
+
+def _parse_stdlib(html):
+    parser = _ReviewHTMLParser()
+    parser.feed(html)
+    parser.close()
+    return parser.reviews, parser.has_next
+
+
+def _parse_fast(html):
+    tree = FastHTMLParser(html)
+    reviews = []
+    for el in tree.css("div[id^='customer_review']"):
+        review = {"review_id": el.attributes.get("id")}
+        for hook, field in REVIEW_HOOKS.items():
+            node = el.css_first(f"[data-hook='{hook}']")
+            if node is not None and field not in review:
+                review[field] = _clean(node.text(separator=" "))
+        reviews.append(review)
+    return reviews, tree.css_first("li.a-last a") is not None
+
+
+def parse_reviews_html(html):
+    """(reviews, has_next) from one review page, same fields as the in-browser extractor."""
+    reviews, has_next = (_parse_fast if FastHTMLParser else _parse_stdlib)(html)
+    return [
+        {
+            "review_id": r["review_id"],
+            "review_text": r.get("review_text") or "No review text",
+            "review_date": r.get("review_date") or "No date found",
+            "rating": parse_rating(r.get("rating_text")),
+        }
+        for r in reviews
+    ], has_next
+
+
+def _parse_entry(args):
+    """Worker: load one snapshot from disk and return its review rows."""
+    root, entry = args
+    reviews, _ = parse_reviews_html(SnapshotStore(root).load(entry["hash"]))
+    return [{"book_title": entry.get("title"), "product": entry.get("product"), **r} for r in reviews]
+
+
+# -------------------------- MAIN --------------------------
+def parse_archive(root=SNAPSHOT_DIR, output=OUTPUT_FILE, workers=WORKERS):
+    """Parse every review-page snapshot into `output`, keeping the first copy of each review."""
+    entries = [e for e in SnapshotStore(root).manifest() if e.get("kind") == "reviews"]
+    unique = list({e["hash"]: e for e in entries}.values())
+    print(f"🗂️ Parsing {len(unique)} snapshots with {workers} processes "
+          f"({'selectolax' if FastHTMLParser else 'html.parser'})...")
+
+    seen = set()
+    with ChunkWriter(output) as writer, ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1, min(TASKS_PER_WORKER_CHUNK, len(unique) // (workers * 4) or 1))
+        for rows in pool.map(_parse_entry, [(root, e) for e in unique], chunksize=chunksize):
+            rows = [r for r in rows if (r["product"], r["review_id"]) not in seen]
+            seen.update((r["product"], r["review_id"]) for r in rows)
+            if rows:
+                frame = pd.DataFrame(rows, columns=COLUMNS)
+                frame["rating"] = pd.to_numeric(frame["rating"], errors="coerce")
+                writer.write(frame)
+    print(f"💾 Saved {writer.rows} reviews to '{output}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse archived review-page HTML into the review store.")
+    parser.add_argument("--snapshots", default=SNAPSHOT_DIR)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+    parse_archive(args.snapshots, args.output, args.workers)
+
+
+if __name__ == "__main__":
+    main()
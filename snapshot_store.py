@@ -0,0 +1,57 @@
+# snapshot_store.py
+# Compressed, content-addressed archive of raw product/review page HTML.
+# The scraper's --snapshot-only mode writes here; snapshot_parser.py turns the
+# archive into review rows offline, so a selector fix never needs a re-scrape.
+#
+# Layout:
+#   snapshots/ab/abcdef....html.gz   gzip'ed HTML named by its SHA-256
+#   snapshots/manifest.jsonl         one line per capture: hash, url, product, title, page, time
+
+import gzip
+import hashlib
+import json
+import os
+import time
+
+# -------------------------- CONFIG --------------------------
+SNAPSHOT_DIR = "snapshots"
+COMPRESS_LEVEL = 6
+
+
+class SnapshotStore:
+    """Write-once gzip blobs keyed by content hash, plus an append-only manifest."""
+
+    def __init__(self, root=SNAPSHOT_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.manifest_path = os.path.join(root, "manifest.jsonl")
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest + ".html.gz")
+
+    def put(self, html, **meta):
+        """Store `html` (skipped if identical content exists) and log the capture. Returns the hash."""
+        data = html.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + ".tmp"
+            with gzip.open(tmp, "wb", compresslevel=COMPRESS_LEVEL) as f:
+                f.write(data)
+            os.replace(tmp, path)
+        entry = {"hash": digest, "captured_at": round(time.time(), 3), **meta}
+        with open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return digest
+
+    def load(self, digest):
+        with gzip.open(self._path(digest), "rb") as f:
+            return f.read().decode("utf-8")
+
+    def manifest(self):
+        """Every capture in the order it was taken."""
+        if not os.path.exists(self.manifest_path):
+            return []
+        with open(self.manifest_path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
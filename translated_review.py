@@ -1,108 +1,150 @@
 # translate_reviews_gemini.py
-# Reads an Excel file with a "review_text" column,
+# Reads reviews (Excel/CSV/Parquet) with a "review_text" column in chunks,
 # translates non-English reviews to English using Gemini,
 # marks English reviews as "no change",
-# and saves the final Excel file in correct column order.
-
-import os
-import time
-import json
-import pandas as pd
-import google.generativeai as genai
+# and appends each chunk to a Parquet file in correct column order
+# (with an optional final Excel export).
+
+from checkpoint import Journal, arg_parser, is_complete, journal_path, resume_rows, row_key
+from client_pool import executor_limits
+from gemini_executor import MalformedResponse, estimate_tokens, pack_batches, run_batches
+from json_stream import response_config, stream_by_id, tag
+from language_filter import PrefilterStats, english_mask
+from metrics import METRICS
+from model_backend import MissingAPIKey, get_backend
+from prompt_compaction import normalize, record
+from response_cache import ResponseCache, prompt_version, run_cached
+from review_store import ChunkWriter, MissingColumns, export_excel, read_chunks, require_columns
 
 # ----------------------------- CONFIG -----------------------------
-INPUT_FILE = "amazon_book_reviews.xlsx"        # <-- your input Excel file
-OUTPUT_FILE = "reviews_translated11.xlsx"
-BATCH_SIZE = 8
-DELAY_BETWEEN_BATCHES = 3
+INPUT_FILE = "amazon_book_reviews.parquet"     # <-- your input file (.xlsx, .csv or .parquet; review_scraper.py writes this one)
+OUTPUT_FILE = "reviews_translated11.parquet"
+EXCEL_EXPORT = None                            # e.g. "reviews_translated11.xlsx" for a final Excel copy
+CHUNK_ROWS = 5_000                             # Rows read/written per chunk
+MODEL_NAME = "gemini-flash-lite-latest"       # Primary model of MODEL_TIER (also the cache namespace)
+MODEL_TIER = "light"                           # client_pool.MODEL_TIERS entry: keys, models and quotas
+MAX_BATCH_ITEMS = 40         # Upper bound on reviews per request
+INPUT_TOKEN_BUDGET = 3_000   # Estimated review tokens per request
+OUTPUT_TOKEN_BUDGET = 4_000  # Estimated reply tokens per request (translations ~ same length as input)
+CONCURRENCY = 4              # Batches in flight at once
+REQUESTS_PER_MINUTE = 15
+TOKENS_PER_MINUTE = 1_000_000
 MAX_RETRIES = 2
+DEDUP_THRESHOLD = 0.85       # Similarity at which reviews share one translation
+ENGLISH_THRESHOLD = 0.8      # Local English-detection confidence needed to skip the API (>1 disables the prefilter)
 
 # ----------------------------- API SETUP -----------------------------
-API_KEY = os.getenv("GEMINI_API_KEY")
-if not API_KEY:
-    raise ValueError("❌ GEMINI_API_KEY not found. Set it with: setx GEMINI_API_KEY 'your_key'")
+# Created on first use: Gemini unless MODEL_BACKEND=fake (see model_backend.py); None without GEMINI_API_KEY
+model = None
 
-genai.configure(api_key=API_KEY)
-model = genai.GenerativeModel("gemini-flash-latest")
 
-# ----------------------------- FUNCTIONS -----------------------------
-def build_prompt(batch_reviews):
-    """Build translation prompt for Gemini."""
-    joined = "\n\n".join([f"{i+1}. {r}" for i, r in enumerate(batch_reviews)])
-    prompt = f"""
-You are a translation assistant.
+def client():
+    """The stage's model, shared with every other stage using MODEL_NAME in this process."""
+    global model
+    if model is None:
+        model = get_backend(MODEL_NAME, tier=MODEL_TIER)
+    return model
 
-For each review below:
-- If it's already in English, return exactly "no change".
-- If it's in another language, return its English translation.
 
-Return only a JSON array of strings, each corresponding to the same order as input reviews.
+# JSON mode: one {"id", "translation"} object per review
+RESPONSE_CONFIG = response_config(translation="STRING")
 
-Example:
-["no change", "This book was wonderful", "no change"]
+# Sent once per request as the system instruction; the schema in RESPONSE_CONFIG replaces a format example
+SYSTEM_INSTRUCTION = (
+    "You are a translation assistant. Each review starts with its ID in brackets. "
+    'Return one object per review, echoing its ID: translation is exactly "no change" if the review '
+    "is already in English, otherwise its English translation."
+)
 
-Reviews:
-{joined}
-"""
-    return prompt
+# ----------------------------- FUNCTIONS -----------------------------
+def build_prompt(batch_reviews):
+    """Build translation prompt for Gemini; each (normalized) review is tagged with its ID."""
+    return "Reviews:\n" + "\n".join(tag(i, r) for i, r in enumerate(batch_reviews))
 
 
-def parse_json_array_from_text(text):
-    """Extract JSON array safely from Gemini output."""
-    start = text.find('[')
-    end = text.rfind(']') + 1
-    if start == -1 or end == 0:
-        raise ValueError("No JSON array found in response")
-    json_str = text[start:end]
-    return json.loads(json_str)
+def parse_item(item):
+    """One streamed {"id", "translation"} object -> the translation."""
+    translation = item.get("translation")
+    if not isinstance(translation, str):
+        raise MalformedResponse(f"No translation in {item!r}")
+    return translation
 
 
 def translate_batch(batch_reviews):
-    """Translate a batch of reviews using Gemini."""
-    attempt = 0
-    while attempt <= MAX_RETRIES:
-        attempt += 1
-        try:
-            prompt = build_prompt(batch_reviews)
-            response = model.generate_content(prompt)
-            raw = response.text.strip()
-            return parse_json_array_from_text(raw)
-        except Exception as e:
-            print(f"⚠️ Attempt {attempt} failed: {e}")
-            if attempt <= MAX_RETRIES:
-                time.sleep(5 * attempt)
-            else:
-                return ["error" for _ in batch_reviews]
+    """
+    Translate a batch of reviews using Gemini, streaming the JSON array so each
+    translation is checkpointed as soon as it arrives. Results are joined by
+    ID; missing IDs raise PartialResponse and are re-requested by the executor.
+    """
+    prompt = build_prompt(batch_reviews)
+    response = client().generate_content(prompt, stream=True, system_instruction=SYSTEM_INSTRUCTION,
+                                         generation_config=RESPONSE_CONFIG)
+    return stream_by_id(response, "translate", len(batch_reviews), parse_item)
 
 
-# ----------------------------- MAIN -----------------------------
-def main():
-    try:
-        df = pd.read_excel(INPUT_FILE)
-    except FileNotFoundError:
-        print(f"❌ File '{INPUT_FILE}' not found.")
-        return
-    except PermissionError:
-        print(f"❌ Close '{INPUT_FILE}' if open and retry.")
-        return
+def plan_batches(texts):
+    """Pack reviews into requests by estimated input/output tokens; returns lists of indices."""
+    costs = [estimate_tokens(t) for t in texts]
+    return pack_batches(costs, [c + 4 for c in costs], INPUT_TOKEN_BUDGET, OUTPUT_TOKEN_BUDGET, MAX_BATCH_ITEMS)
 
-    if "review_text" not in df.columns:
-        print("❌ Excel file must contain a 'review_text' column.")
-        return
 
-    df["review_text"] = df["review_text"].fillna("").astype(str)
-    reviews = df["review_text"].tolist()
-    translated = []
+def failed_batch(batch_reviews):
+    """Placeholder results for a batch that exhausted its retries."""
+    return ["error" for _ in batch_reviews]
 
-    print(f"🌍 Translating {len(reviews)} reviews in batches of {BATCH_SIZE}...")
 
-    for start in range(0, len(reviews), BATCH_SIZE):
-        end = min(start + BATCH_SIZE, len(reviews))
-        batch = reviews[start:end]
-        print(f"🔹 Batch {start // BATCH_SIZE + 1}: {start+1}–{end}")
-        results = translate_batch(batch)
-        translated.extend(results)
-        time.sleep(DELAY_BETWEEN_BATCHES)
+# ----------------------------- CHUNK PROCESSING -----------------------------
+def translate_chunk(df, cache, journal, stats, dedup, offset=0):
+    """Translate one chunk of reviews and return it in the stage's column order."""
+    df["review_text"] = df["review_text"].fillna("").astype(str)
+    reviews = df["review_text"].tolist()
+    row_ids = list(range(offset, offset + len(df)))
+
+    def run(positions):
+        record("translate", [reviews[p] for p in positions], [prompts[p] for p in positions])
+        plan = plan_batches([prompts[p] for p in positions])
+        batch_positions = [[positions[i] for i in b] for b in plan]
+        batches = [[prompts[p] for p in bp] for bp in batch_positions]
+        print(f"🌍 Translating {len(positions)} reviews in {len(batches)} token-budgeted batches "
+              f"({CONCURRENCY} in flight)...")
+        results = run_batches(
+            batches, translate_batch, failed_batch,
+            **executor_limits(client(), CONCURRENCY, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE),
+            max_retries=MAX_RETRIES,
+            on_result=lambda i, result: journal.record([keys[p] for p in batch_positions[i]], result),
+            on_item=lambda i, k, value: journal.record([keys[batch_positions[i][k]]], [value], sync=False),
+            stage="translate",
+        )
+        return [t for batch in results for t in batch]
+
+    def resolve(positions):
+        return run_cached(cache, "translate", MODEL_NAME, prompt_version(build_prompt, SYSTEM_INSTRUCTION),
+                          [prompts[p] for p in positions],
+                          lambda sub: run([positions[i] for i in sub]),
+                          is_valid=is_complete)
+
+    # Group duplicate reviews; later stages reuse these groups
+    groups = dedup.assign(reviews, row_ids)
+    df["dup_group"] = groups
+
+    # Confidently-English rows never reach the API
+    mask = english_mask(reviews, ENGLISH_THRESHOLD)
+    stats.add(reviews, mask)
+    rest = [i for i, is_english in enumerate(mask) if not is_english]
+    # Whitespace/repeat compaction only: a truncated review would lose its middle in reviews_translated
+    prompts = {i: normalize(reviews[i]) for i in rest}
+    keys = {i: row_key(prompts[i]) for i in rest}       # journal keys: resume follows the text, not the row position
+
+    def resolve_unique(reps):
+        """Journal -> cache -> API for the representatives `reps` (indices into `rest`)."""
+        positions = [rest[r] for r in reps]
+        return resume_rows(journal, [keys[p] for p in positions],
+                           lambda sub: resolve([positions[i] for i in sub]))
+
+    translated = ["no change"] * len(reviews)
+    rest_results = dedup.resolve([groups[i] for i in rest], resolve_unique)
+    for i, value in zip(rest, rest_results):
+        translated[i] = value
 
     # Insert translated column next to review_text
     df.insert(df.columns.get_loc("review_text") + 1, "reviews_translated", translated)
@@ -113,19 +155,70 @@ def main():
         "Review_Date": "review_date"
     }, inplace=True)
 
-    expected_order = ["book_title", "review_text", "reviews_translated", "review_date"]
-    df = df[[col for col in expected_order if col in df.columns]]
+    expected_order = ["book_title", "product", "review_id", "review_text", "reviews_translated", "review_date",
+                      "rating", "dup_group"]
+    return df[[col for col in expected_order if col in df.columns]]
+
 
+# ----------------------------- MAIN -----------------------------
+def process_chunks(chunks, output_file=OUTPUT_FILE, resume=False, cache=None):
+    """
+    Translate an iterable of DataFrame chunks, yielding each translated chunk.
+    The journal belongs to `output_file`; pass `cache` to share one response
+    cache with other stages running in the same process.
+    """
+    from dedup import Deduplicator
+    if client() is None:
+        raise MissingAPIKey()
+    own_cache = cache is None
+    cache = cache or ResponseCache()
+    journal = Journal(journal_path(output_file), resume=resume)
+    stats = PrefilterStats(plan_batches)
+    dedup = Deduplicator(DEDUP_THRESHOLD)
+    offset = 0
+    try:
+        for i, chunk in enumerate(chunks):
+            require_columns(chunk, ["review_text"])
+            print(f"📦 Chunk {i + 1}: {len(chunk)} rows")
+            with METRICS.timer("chunk_seconds", stage="translate"):
+                result = translate_chunk(chunk, cache, journal, stats, dedup, offset)
+            METRICS.inc("rows_total", len(chunk), stage="translate")
+            offset += len(chunk)
+            yield result
+    finally:
+        if own_cache:
+            cache.close()
+        journal.close()
+    stats.report()
+
+
+def run(input_file=INPUT_FILE, output_file=OUTPUT_FILE, resume=False, excel=EXCEL_EXPORT):
+    """Translate `input_file` into `output_file`. Returns the rows written, or None if the input is unusable."""
     try:
-        df.to_excel(OUTPUT_FILE, index=False, engine="openpyxl")
-        print(f"\n✅ Done — saved translated file as '{OUTPUT_FILE}' with proper column order.")
+        with ChunkWriter(output_file) as writer:
+            for result in process_chunks(read_chunks(input_file, CHUNK_ROWS), output_file, resume):
+                writer.write(result)
+    except (MissingColumns, MissingAPIKey) as e:
+        print(f"❌ {e}")
+        return None
+    except FileNotFoundError:
+        print(f"❌ File '{input_file}' not found.")
+        return None
     except PermissionError:
-        print(f"❌ Close '{OUTPUT_FILE}' if it's open and re-run.")
-    except Exception as e:
-        print(f"⚠️ Unexpected error while saving: {e}")
+        print(f"❌ Close '{input_file}' if open and retry.")
+        return None
 
+    print(f"\n✅ Done — saved {writer.rows} translated rows to '{output_file}' with proper column order.")
+    if excel:
+        export_excel(output_file, excel)
+    METRICS.finish()
+    return writer.rows
 
-if __name__ == "__main__":
-    main()
+
+def main():
+    args = arg_parser("Translate non-English reviews to English using Gemini.").parse_args()
+    run(resume=args.resume)
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# trend_graph.py
+# Sentiment trend visualization over time, drawn from the pre-aggregated
+# rollups in sentiment_rollup.sqlite (kept up to date by score_and_reason.py,
+# or rebuilt with `python sentiment_rollup.py build`; fused_pipeline.py keeps
+# its own in sentiment_rollup_fused.sqlite, plotted with --db), so plotting
+# never rescans the scored reviews.
+#
+# Usage:
+#   python trend_graph.py
+#   python trend_graph.py --grain week --book "White Nights" --output white_nights.png
+
+import argparse
+
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from sentiment_rollup import GRAINS, ROLLUP_FILE, RollupStore
+
+# -------------------------- CONFIG --------------------------
+OUTPUT_FILE = "sentiment_trend.png"
+LABEL_COLORS = {"positive": "tab:green", "neutral": "tab:gray", "negative": "tab:red"}
+
+
+def plot_trend(trend, title, output):
+    """Mean score with its interquartile band on top, label shares stacked below."""
+    dates = pd.to_datetime(trend["bucket"])
+    fig, (top, bottom) = plt.subplots(2, 1, figsize=(11, 7), sharex=True, height_ratios=[2, 1])
+
+    top.plot(dates, trend["mean"], marker="o", label="Mean score")
+    if {"p25", "p75"} <= set(trend.columns):
+        top.fill_between(dates, trend["p25"], trend["p75"], alpha=0.2, label="25th-75th percentile")
+    top.axhline(0, color="black", linewidth=0.5)
+    top.set_ylim(-10, 10)
+    top.set_ylabel("Sentiment score")
+    top.set_title(title)
+    top.legend(loc="lower left")
+
+    bottom.stackplot(dates, *[trend[f"{label}_share"] for label in LABEL_COLORS],
+                     labels=[label.capitalize() for label in LABEL_COLORS], colors=list(LABEL_COLORS.values()))
+    bottom.set_ylim(0, 1)
+    bottom.set_ylabel("Share of reviews")
+    bottom.legend(loc="lower left", ncol=3)
+
+    fig.tight_layout()
+    fig.savefig(output, dpi=120)
+    print(f"📈 Saved trend graph to '{output}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plot sentiment trends from the rollup store.")
+    parser.add_argument("--grain", choices=GRAINS, default="month")
+    parser.add_argument("--book", help="one book title (default: all books combined)")
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    parser.add_argument("--db", default=ROLLUP_FILE)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    args = parser.parse_args()
+
+    store = RollupStore(args.db)
+    try:
+        trend = store.trend(args.grain, args.book, args.start, args.end)
+    finally:
+        store.close()
+    if trend.empty:
+        print(f"❌ No rollups in '{args.db}'. Run score_and_reason.py or `python sentiment_rollup.py build` first.")
+        return
+    title = f"Sentiment per {args.grain} — {args.book or 'all books'} ({int(trend['n'].sum())} reviews)"
+    plot_trend(trend, title, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# watermarks.py
+# Per-product high-watermark of reviews already scraped.
+# The crawler walks review pages newest-first and stops as soon as it reaches
+# a review ID recorded here, so scheduled re-crawls only fetch new reviews.
+# IDs must only be recorded once their reviews are safely stored and the crawl
+# reached known ground (see PendingWatermarks); otherwise a crash or a cut-off
+# crawl would hide reviews from every later run.
+
+import sqlite3
+import time
+
+# -------------------------- CONFIG --------------------------
+WATERMARK_FILE = "scrape_watermarks.sqlite"
+
+
+class Watermarks:
+    """SQLite table of (product, review ID) pairs already written to the store."""
+
+    def __init__(self, path=WATERMARK_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)   # shared by parallel scrape workers
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS seen_reviews (
+                product     TEXT NOT NULL,
+                review_id   TEXT NOT NULL,
+                review_date TEXT,
+                scraped_at  REAL NOT NULL,
+                PRIMARY KEY (product, review_id)
+            )
+        """)
+        self.conn.commit()
+
+    def seen(self, product):
+        """Set of review IDs already stored for `product`."""
+        rows = self.conn.execute("SELECT review_id FROM seen_reviews WHERE product = ?", (product,))
+        return {row[0] for row in rows}
+
+    def add(self, product, records):
+        """Record scraped reviews (dicts with review_id / review_date) for `product`."""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO seen_reviews (product, review_id, review_date, scraped_at) VALUES (?, ?, ?, ?)",
+            [(product, r["review_id"], r.get("review_date"), now) for r in records],
+        )
+        self.conn.commit()
+
+    def reset(self, product=None):
+        """Forget one product (full re-crawl next time) or everything."""
+        if product is None:
+            self.conn.execute("DELETE FROM seen_reviews")
+        else:
+            self.conn.execute("DELETE FROM seen_reviews WHERE product = ?", (product,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class PendingWatermarks:
+    """
+    Watermark view whose new review IDs are only stored on commit(), which the
+    caller runs once the output file holding those reviews is complete.
+    With `ignore_seen` (a full re-crawl) no product has known reviews, but the
+    crawled IDs are still recorded.
+    """
+
+    def __init__(self, marks, ignore_seen=False):
+        self.marks = marks
+        self.ignore_seen = ignore_seen
+        self.new = {}
+
+    def seen(self, product):
+        return set() if self.ignore_seen else self.marks.seen(product)
+
+    def add(self, product, records):
+        self.new.setdefault(product, []).extend(records)
+
+    def commit(self):
+        for product, records in self.new.items():
+            self.marks.add(product, records)
+        self.new = {}